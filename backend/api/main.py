@@ -1,9 +1,11 @@
 import os
 import sys
+from contextlib import asynccontextmanager
 
 from dotenv import load_dotenv
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
 from starlette.middleware.sessions import SessionMiddleware
 
 # Add the current directory (backend) to the Python path
@@ -12,8 +14,23 @@ sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 # Load environment variables from .env file
 load_dotenv()
 
+from database import close_db, init_db
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    init_db()
+    strava.sync_worker.start()
+    strava.token_refresher.start()
+    yield
+    await strava.token_refresher.stop()
+    await strava.sync_worker.stop()
+    await strava.strava_service.aclose()
+    close_db()
+
+
 # Create FastAPI app
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
 
 # Get frontend URL from environment variable or use default
 frontend_url = os.environ.get("FRONTEND_URL", "http://localhost:5173")
@@ -29,6 +46,10 @@ app.add_middleware(
     expose_headers=["*"],
 )
 
+# Compress larger responses such as the workouts list. Server-Sent Events
+# are left uncompressed so tokens aren't held back.
+app.add_middleware(GZipMiddleware, minimum_size=1000, compresslevel=6)
+
 # Then add session middleware
 app.add_middleware(
     SessionMiddleware,
@@ -37,10 +58,11 @@ app.add_middleware(
     https_only=False,
 )
 
-from routes import strava, training_plan
+from routes import analytics, strava, training_plan
 
 app.include_router(strava.router)
 app.include_router(training_plan.router)
+app.include_router(analytics.router)
 
 for route in app.routes:
     print(f"Route: {route.path} [{','.join(route.methods)}]")
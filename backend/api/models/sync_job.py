@@ -0,0 +1,23 @@
+from typing import Optional
+
+from pydantic import BaseModel
+
+
+class SyncJob(BaseModel):
+    """Model for a background Strava sync job"""
+
+    id: int
+    status: str  # "queued", "running", "succeeded" or "failed"
+    full_sync: bool
+    activities_synced: int
+    error: Optional[str] = None
+    created_at: int  # unix timestamps
+    started_at: Optional[int] = None
+    finished_at: Optional[int] = None
+
+
+class SyncStatus(BaseModel):
+    """Model for a user's sync status"""
+
+    last_synced_at: Optional[int] = None
+    job: Optional[SyncJob] = None
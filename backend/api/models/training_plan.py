@@ -0,0 +1,62 @@
+from datetime import date
+from typing import Any, Dict, List, Optional
+
+from pydantic import BaseModel
+
+
+class PlanSession(BaseModel):
+    """Model for one day of a training plan"""
+
+    type: str = "rest"  # "rest", "easy", "long", "quality", "strength" or "race"
+    distance: Optional[float] = None  # in kilometers
+    duration: Optional[int] = None  # in minutes
+    intensity: Optional[str] = None  # "easy", "moderate", "hard" or "race"
+    description: List[str] = ["Rest"]  # display lines, e.g. ["Tempo: 5 km"]
+
+
+class PlanWeek(BaseModel):
+    """Model for a week of a training plan, Monday first"""
+
+    week: int
+    phase: str  # "base", "build", "peak" or "taper"
+    start_date: date
+    distance: float  # in kilometers
+    days: List[PlanSession]
+
+
+class TrainingPlan(BaseModel):
+    """Model for a structured week-by-day training plan"""
+
+    start_date: date
+    race_date: Optional[date] = None  # None when the goal date is beyond the plan
+    race_distance: float  # in kilometers
+    goal_pace: Optional[float] = None  # in min/km
+    available_days: List[str]
+    long_run_day: str
+    strength_day: Optional[str] = None
+    # Starting fitness the plan was built from, reused when it's revised
+    base_volume: Optional[float] = None  # in km/week
+    base_long_run: Optional[float] = None  # in kilometers
+    easy_pace: Optional[float] = None  # in min/km
+    skipped_weeks: List[int] = []
+    weeks: List[PlanWeek]
+
+
+class StoredPlan(BaseModel):
+    """Model for a generated plan with its coaching commentary"""
+
+    id: int
+    commentary: str
+    plan: TrainingPlan
+    response: str  # commentary followed by the plan rendered as an HTML table
+    created_at: int  # unix timestamps
+    updated_at: int
+
+
+class PlanRevision(BaseModel):
+    """Model for a change to a stored plan"""
+
+    goals: Optional[Dict[str, Any]] = None  # fields to change, e.g. {"endDate": ...}
+    preferences: Optional[Dict[str, Any]] = None  # replaces the preferences
+    skip_weeks: List[int] = []  # weeks to take off, e.g. for travel
+    from_week: Optional[int] = None  # first week that may change; not one under way
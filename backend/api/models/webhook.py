@@ -0,0 +1,15 @@
+from typing import Dict, Optional
+
+from pydantic import BaseModel
+
+
+class StravaWebhookEvent(BaseModel):
+    """Model for an event pushed by a Strava webhook subscription"""
+
+    object_type: str  # "activity" or "athlete"
+    object_id: int
+    aspect_type: str  # "create", "update" or "delete"
+    owner_id: int
+    subscription_id: int
+    event_time: int
+    updates: Optional[Dict[str, str]] = None
@@ -0,0 +1,74 @@
+from typing import Optional
+
+from database import get_user_db
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from repositories.best_effort_repository import BestEffortRepository
+from services.analytics_service import AnalyticsService
+from services.best_efforts import get_personal_bests
+
+router = APIRouter(prefix="/analytics", tags=["analytics"])
+
+analytics_service = AnalyticsService()
+
+
+def _user_id(request: Request) -> str:
+    user_id = request.session.get("user_id")
+    if not user_id:
+        raise HTTPException(status_code=401, detail="Not authenticated")
+    return user_id
+
+
+@router.get("/load")
+async def get_training_load(
+    request: Request, days: int = Query(90, ge=1, le=3650), db=Depends(get_user_db)
+):
+    """Daily training load, acute/chronic load and acute:chronic workload ratio"""
+    history = analytics_service.load(db, _user_id(request))
+    return analytics_service.training_load(history, days)
+
+
+@router.get("/weekly")
+async def get_weekly_volume(
+    request: Request, weeks: int = Query(26, ge=1, le=520), db=Depends(get_user_db)
+):
+    """Weekly running distance, time and number of runs"""
+    history = analytics_service.load(db, _user_id(request))
+    return analytics_service.weekly_volume(history, weeks)
+
+
+@router.get("/zones")
+async def get_pace_zones(
+    request: Request, days: int = Query(90, ge=1, le=3650), db=Depends(get_user_db)
+):
+    """Time spent in each pace zone"""
+    history = analytics_service.load(db, _user_id(request))
+    return analytics_service.pace_zones(history, days)
+
+
+@router.get("/predictions")
+async def get_race_predictions(
+    request: Request, days: int = Query(180, ge=1, le=3650), db=Depends(get_user_db)
+):
+    """Predicted 5K, 10K, half marathon and marathon times in minutes"""
+    history = analytics_service.load(db, _user_id(request))
+    return analytics_service.race_predictions(history, days)
+
+
+@router.get("/best-efforts")
+async def get_best_efforts(
+    request: Request,
+    days: Optional[int] = Query(None, ge=1, le=3650),
+    db=Depends(get_user_db),
+):
+    """Fastest 1K, 5K, 10K and half marathon segments within runs, in seconds,
+    over the last `days` days or all time"""
+    return get_personal_bests(db, _user_id(request), days)
+
+
+@router.get("/splits/{strava_id}")
+async def get_splits(strava_id: str, request: Request, db=Depends(get_user_db)):
+    """Seconds taken for each whole kilometer of a run"""
+    splits = BestEffortRepository(db).get_splits(_user_id(request), strava_id)
+    if splits is None:
+        raise HTTPException(status_code=404, detail="No splits for this activity")
+    return {"strava_id": strava_id, "splits": splits}
@@ -1,12 +1,29 @@
+import hashlib
+import json
 import os
-from datetime import datetime
-from typing import List
-
-from database import get_db
-from fastapi import APIRouter, Depends, HTTPException, Request
-from fastapi.responses import RedirectResponse
-from models.workout import Workout, WorkoutCreate
-from services.strava_service import StravaService
+import traceback
+from datetime import date, datetime
+from typing import Any, Optional
+
+from database import async_connection, get_db, get_user_db, purge_user
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException, Query, Request
+from fastapi.responses import RedirectResponse, Response
+from models.sync_job import SyncJob, SyncStatus
+from models.webhook import StravaWebhookEvent
+from models.workout import Workout
+from repositories.auth_repository import TOKEN_ENCRYPTION_KEY, AuthRepository
+from repositories.plan_cache_repository import PlanCacheRepository
+from repositories.sync_job_repository import FAILED, SyncJobRepository
+from repositories.workout_repository import WorkoutRepository
+from services.strava_service import AsyncStravaService
+from services.sync_service import SyncWorker, TokenRefresher, WorkoutSyncService
+
+try:
+    import orjson
+
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
 
 router = APIRouter(tags=["strava"])
 
@@ -15,11 +32,26 @@ STRAVA_CLIENT_ID = os.environ.get("STRAVA_CLIENT_ID")
 STRAVA_CLIENT_SECRET = os.environ.get("STRAVA_CLIENT_SECRET")
 STRAVA_REDIRECT_URI = os.environ.get("STRAVA_REDIRECT_URI")
 FRONTEND_URL = os.environ.get("FRONTEND_URL")
+STRAVA_WEBHOOK_VERIFY_TOKEN = os.environ.get("STRAVA_WEBHOOK_VERIFY_TOKEN")
+STRAVA_WEBHOOK_SUBSCRIPTION_ID = os.environ.get("STRAVA_WEBHOOK_SUBSCRIPTION_ID")
+WORKOUTS_FRESHNESS_SECONDS = int(os.environ.get("WORKOUTS_FRESHNESS_SECONDS", "900"))
+# Fields of each workout in /workouts responses, in the Workout model's order
+WORKOUT_FIELDS = tuple(Workout.model_fields)
 
 if not STRAVA_CLIENT_ID or not STRAVA_CLIENT_SECRET:
     raise ValueError("STRAVA_CLIENT_ID and STRAVA_CLIENT_SECRET must be set")
 
-strava_service = StravaService(STRAVA_CLIENT_ID, STRAVA_CLIENT_SECRET)
+if not TOKEN_ENCRYPTION_KEY:
+    raise ValueError(
+        "TOKEN_ENCRYPTION_KEY must be set; generate one with "
+        'python -c "from cryptography.fernet import Fernet; '
+        'print(Fernet.generate_key().decode())"'
+    )
+
+strava_service = AsyncStravaService(STRAVA_CLIENT_ID, STRAVA_CLIENT_SECRET)
+sync_service = WorkoutSyncService(strava_service)
+sync_worker = SyncWorker(sync_service)
+token_refresher = TokenRefresher(sync_service)
 
 
 @router.get("/auth")
@@ -34,18 +66,27 @@ async def authorize_strava():
 async def strava_callback(
     request: Request,
     code: str,
+    db=Depends(get_db),
 ):
     try:
-        token_data = strava_service.exchange_token(code)
-
-        request.session["access_token"] = token_data["access_token"]
-        request.session["refresh_token"] = token_data["refresh_token"]
-        request.session["expires_at"] = token_data["expires_at"]
+        token_data = await strava_service.exchange_token(code)
 
         athlete = token_data.get("athlete", {})
         user_id = f"strava_{athlete.get('id', 'default')}"
         request.session["user_id"] = user_id
 
+        # Tokens are only stored server-side, encrypted, where the background
+        # sync and token refresher can use them; the session cookie just
+        # identifies the user. Import in the background instead of inside
+        # this redirect.
+        AuthRepository(db).save_tokens(
+            user_id,
+            token_data["access_token"],
+            token_data["refresh_token"],
+            token_data["expires_at"],
+        )
+        sync_worker.enqueue(db, user_id)
+
         return RedirectResponse(
             f"{FRONTEND_URL}?strava_connected=true&view=history", status_code=303
         )
@@ -63,131 +104,218 @@ async def disconnect_strava(request: Request, db=Depends(get_db)):
     if not user_id:
         raise HTTPException(status_code=401, detail="Not authenticated")
 
-    # Delete Strava auth from database
-    db.execute("DELETE FROM strava_auth WHERE user_id = :user_id", {"user_id": user_id})
-    db.execute("DELETE FROM workouts")
+    _forget_user(db, user_id)
     db.commit()
 
     return {"message": "Strava disconnected successfully"}
 
 
-@router.get("/workouts", response_model=List[Workout])
+@router.get("/workouts")
 async def get_workouts(
     request: Request,
-
+    limit: Optional[int] = Query(None, ge=1, le=1000),
+    offset: int = Query(0, ge=0),
+    start_date: Optional[date] = None,
+    end_date: Optional[date] = None,
+    activity_type: Optional[str] = Query(None, alias="type"),
+    refresh: bool = False,
+    full_sync: bool = False,
+    response_format: str = Query("rows", alias="format", pattern="^(rows|columnar)$"),
     db=Depends(get_db),
+    user_db=Depends(get_user_db),
 ):
-    access_token = request.session.get("access_token")
-    refresh_token = request.session.get("refresh_token")
-    expires_at = request.session.get("expires_at")
-    user_id = request.session.get("user_id")
+    """Return stored workouts, syncing from Strava only when the cache is stale.
 
-    if not access_token or not refresh_token or not expires_at or not user_id:
+    Workouts are a list of Workout objects, or with format=columnar one array
+    per field, e.g. {"count": 2, "columns": {"distance": [5.1, 10.2], ...}}.
+    Responses carry an ETag, so an unchanged history is answered with 304.
+    """
+    user_id = request.session.get("user_id")
+    if not user_id:
         raise HTTPException(
             status_code=401, detail="Missing authentication session data"
         )
 
-    if strava_service.is_token_expired(expires_at):
-        token_data = strava_service.refresh_access_token(refresh_token)
+    if request.session.get("refresh_token"):
+        # Sessions from before tokens were only stored server-side
+        auth = AuthRepository(db)
+        if not auth.get(user_id):
+            auth.save_tokens(
+                user_id,
+                request.session["access_token"],
+                request.session["refresh_token"],
+                request.session["expires_at"],
+            )
+            db.commit()
+        for key in ("access_token", "refresh_token", "expires_at"):
+            request.session.pop(key, None)
+
+    workouts = WorkoutRepository(user_db)
+    sync_state = workouts.get_sync_state(user_id)
+
+    # Serve what is stored now; a stale cache is refreshed in the background.
+    # A sync that just failed isn't retried on every read, only once the
+    # freshness window has passed or when a refresh is asked for.
+    stale = _is_stale(sync_state) and not _failed_recently(
+        SyncJobRepository(db).latest_for_user(user_id)
+    )
+    if refresh or full_sync or stale:
+        sync_worker.enqueue(db, user_id, full_sync)
+
+    rows = workouts.list_for_user(
+        user_id,
+        limit=limit,
+        offset=offset,
+        start_date=start_date,
+        end_date=end_date,
+        activity_type=activity_type,
+        columns=WORKOUT_FIELDS,
+    )
+
+    # Rows are stored already validated, so they are serialized directly
+    # rather than through a Workout model per row
+    if response_format == "columnar":
+        columns = list(zip(*rows)) or [()] * len(WORKOUT_FIELDS)
+        content = {
+            "count": len(rows),
+            "columns": dict(zip(WORKOUT_FIELDS, map(list, columns))),
+        }
+    else:
+        content = [dict(zip(WORKOUT_FIELDS, row)) for row in rows]
+
+    return _etag_response(request, _dumps(content))
+
+
+@router.get("/sync/status", response_model=SyncStatus)
+async def get_sync_status(
+    request: Request, db=Depends(get_db), user_db=Depends(get_user_db)
+):
+    """Status of the user's most recent background sync, for polling"""
+    user_id = request.session.get("user_id")
+    if not user_id:
+        raise HTTPException(status_code=401, detail="Not authenticated")
 
-        access_token = token_data.get("access_token")
-        refresh_token = token_data.get("refresh_token")
-        expires_at = token_data.get("expires_at")
+    sync_state = WorkoutRepository(user_db).get_sync_state(user_id)
+    job = SyncJobRepository(db).latest_for_user(user_id)
 
-        if not access_token or not refresh_token or not expires_at:
-            raise HTTPException(
-                status_code=500, detail="Invalid token refresh response"
-            )
+    return SyncStatus(
+        last_synced_at=sync_state["last_synced_at"] if sync_state else None,
+        job=SyncJob(**dict(job)) if job else None,
+    )
 
-        request.session["access_token"] = access_token
-        request.session["refresh_token"] = refresh_token
-        request.session["expires_at"] = expires_at
-
-        db.execute(
-            """
-            UPDATE strava_auth 
-            SET access_token = :access_token, 
-                refresh_token = :refresh_token, 
-                expires_at = :expires_at
-            WHERE user_id = :user_id
-            """,
-            {
-                "access_token": access_token,
-                "refresh_token": refresh_token,
-                "expires_at": expires_at,
-                "user_id": user_id,
-            },
-        )
-        db.commit()
 
-    all_activities = []
-    page = 1
-    per_page = 200  # Maximum allowed by Strava API
+@router.get("/webhook")
+async def verify_webhook(
+    mode: str = Query(..., alias="hub.mode"),
+    verify_token: str = Query(..., alias="hub.verify_token"),
+    challenge: str = Query(..., alias="hub.challenge"),
+):
+    """Answer Strava's subscription validation handshake"""
+    if (
+        mode != "subscribe"
+        or not STRAVA_WEBHOOK_VERIFY_TOKEN
+        or verify_token != STRAVA_WEBHOOK_VERIFY_TOKEN
+    ):
+        raise HTTPException(status_code=403, detail="Invalid verify token")
 
-    while True:
-        strava_activities = strava_service.get_athlete_activities(
-            access_token=access_token, per_page=per_page, page=page
-        )
+    return {"hub.challenge": challenge}
 
-        if not strava_activities:
-            break
-
-        all_activities.extend(strava_activities)
-        page += 1
-
-    workouts = []
-    for activity in all_activities:
-        workout_data = WorkoutCreate(
-            strava_id=str(activity["id"]),
-            user_id=user_id,
-            name=activity["name"],
-            distance=activity["distance"] / 1000,
-            moving_time=activity["moving_time"] / 60,
-            total_elevation_gain=activity["total_elevation_gain"],
-            type=activity["type"],
-            start_date=datetime.fromisoformat(
-                activity["start_date"].replace("Z", "+00:00")
-            ).date(),
-            average_pace=(
-                (activity["moving_time"] / 60) / (activity["distance"] / 1000)
-                if activity["distance"]
-                else 0
-            ),
-            average_heartrate=activity.get("average_heartrate"),
-            max_heartrate=activity.get("max_heartrate"),
-        )
 
-        existing = db.execute(
-            "SELECT id FROM workouts WHERE strava_id = :strava_id",
-            {"strava_id": workout_data.strava_id},
-        ).fetchone()
+@router.post("/webhook")
+async def receive_webhook(event: StravaWebhookEvent, background_tasks: BackgroundTasks):
+    """Receive a pushed activity or athlete event.
 
-        if existing:
-            workout_id = existing["id"]
-            db.execute(
-                "UPDATE workouts SET name = :name WHERE id = :id",
-                {"name": workout_data.name, "id": workout_id},
-            )
-            workout = Workout(id=workout_id, **workout_data.dict())
-        else:
-            result = db.execute(
-                """
-                INSERT INTO workouts (
-                    strava_id, user_id, name, distance, moving_time, 
-                    total_elevation_gain, type, start_date,
-                    average_pace, average_heartrate, max_heartrate
-                ) VALUES (
-                    :strava_id, :user_id, :name, :distance, :moving_time, 
-                    :total_elevation_gain, :type, :start_date,
-                    :average_pace, :average_heartrate, :max_heartrate
-                ) RETURNING id
-                """,
-                workout_data.dict(),
-            )
-            workout_id = result.fetchone()["id"]
-            workout = Workout(id=workout_id, **workout_data.dict())
+    Strava expects a response within two seconds, so the event is applied
+    after the response is sent.
+    """
+    if STRAVA_WEBHOOK_SUBSCRIPTION_ID and str(event.subscription_id) != (
+        STRAVA_WEBHOOK_SUBSCRIPTION_ID
+    ):
+        raise HTTPException(status_code=403, detail="Unknown subscription")
 
-        workouts.append(workout)
+    background_tasks.add_task(_handle_webhook_event, event)
+    return {"message": "Event received"}
 
-    db.commit()
-    return workouts
+
+@router.get("/ratelimit")
+async def get_rate_limit():
+    """Current Strava API budget usage, for monitoring"""
+    return strava_service.rate_limiter.snapshot()
+
+
+def _dumps(content: Any) -> bytes:
+    if ORJSON_AVAILABLE:
+        return orjson.dumps(content)
+    return json.dumps(content, separators=(",", ":")).encode()
+
+
+def _etag_response(request: Request, body: bytes) -> Response:
+    """A JSON response with an ETag, or 304 if the client already has it"""
+    # Weak, since GZipMiddleware may change the bytes on the wire
+    etag = f'W/"{hashlib.blake2b(body, digest_size=16).hexdigest()}"'
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+
+    if_none_match = request.headers.get("If-None-Match", "")
+    if etag in (tag.strip() for tag in if_none_match.split(",")):
+        return Response(status_code=304, headers=headers)
+
+    return Response(body, media_type="application/json", headers=headers)
+
+
+def _forget_user(db, user_id: str) -> None:
+    """Delete a user's Strava auth, sync jobs, all of their workouts data and
+    the plans cached from it. The caller commits.
+
+    A sync already running stops at its next write, once it finds the auth
+    row gone.
+    """
+    AuthRepository(db).delete(user_id)
+    SyncJobRepository(db).delete_for_user(user_id)
+    PlanCacheRepository(db).delete_for_user(user_id)
+    purge_user(db, user_id)
+
+
+def _is_stale(sync_state) -> bool:
+    """Check whether a user's cached workouts are older than the freshness window"""
+    if not sync_state:
+        return True
+
+    age = datetime.now().timestamp() - sync_state["last_synced_at"]
+    return age >= WORKOUTS_FRESHNESS_SECONDS
+
+
+def _failed_recently(job) -> bool:
+    """Check whether a user's latest sync failed within the freshness window"""
+    if not job or job["status"] != FAILED:
+        return False
+
+    age = datetime.now().timestamp() - job["finished_at"]
+    return age < WORKOUTS_FRESHNESS_SECONDS
+
+
+async def _handle_webhook_event(event: StravaWebhookEvent) -> None:
+    """Apply a webhook event to the stored data for its athlete"""
+    user_id = f"strava_{event.owner_id}"
+
+    try:
+        async with async_connection() as db:
+            if not AuthRepository(db).get(user_id):
+                # Not connected to this app (anymore)
+                return
+
+            if (
+                event.object_type == "athlete"
+                and (event.updates or {}).get("authorized") == "false"
+            ):
+                # The athlete revoked access to the app
+                _forget_user(db, user_id)
+                db.commit()
+                return
+
+        # Released first: applying an activity calls the Strava API
+        if event.object_type == "activity":
+            await sync_service.apply_activity_event(
+                user_id, str(event.object_id), event.aspect_type
+            )
+    except Exception:
+        traceback.print_exc()
@@ -1,5 +1,17 @@
-from fastapi import APIRouter, Request
-from services.training_plan_service import create_plan
+from database import get_db
+from fastapi import APIRouter, Depends, HTTPException, Request
+from fastapi.responses import StreamingResponse
+from models.training_plan import PlanRevision, StoredPlan
+from services.training_plan_service import (
+    PlanCapacityError,
+    create_plan,
+    generation_stats,
+    get_plan,
+    plan_cache,
+    plan_payload,
+    revise_plan,
+    stream_plan,
+)
 
 router = APIRouter()
 
@@ -10,5 +22,64 @@ async def plan_endpoint(request: Request):
     prompt = data.get("message", "")
     preferences = data.get("preferences", {})
     goals = data.get("goals", {})
-    response = create_plan(prompt, preferences, goals)
-    return {"response": response}
+    user_id = request.session.get("user_id")
+    try:
+        stored, tokens = await create_plan(prompt, preferences, goals, user_id)
+    except PlanCapacityError as e:
+        raise HTTPException(
+            status_code=503, detail=str(e), headers={"Retry-After": "30"}
+        )
+    return plan_payload(stored, tokens)
+
+
+@router.post("/createplan/stream")
+async def plan_stream_endpoint(request: Request):
+    """Stream plan generation to the client as Server-Sent Events"""
+    data = await request.json()
+    prompt = data.get("message", "")
+    preferences = data.get("preferences", {})
+    goals = data.get("goals", {})
+    user_id = request.session.get("user_id")
+    return StreamingResponse(
+        stream_plan(prompt, preferences, goals, user_id),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@router.get("/createplan/cache/stats")
+async def plan_cache_stats(db=Depends(get_db)):
+    """Plan cache hit/miss counts and size"""
+    return plan_cache.stats(db)
+
+
+@router.get("/createplan/stats")
+async def plan_generation_stats():
+    """Plans currently being generated and queued, and total token usage"""
+    return generation_stats()
+
+
+@router.get("/plans/{plan_id}", response_model=StoredPlan)
+async def get_plan_endpoint(plan_id: int, request: Request, db=Depends(get_db)):
+    """A stored plan with its structure and server-rendered HTML"""
+    stored = get_plan(db, plan_id, request.session.get("user_id"))
+    if stored is None:
+        raise HTTPException(status_code=404, detail="Plan not found")
+    return stored
+
+
+@router.post("/plans/{plan_id}/revise")
+async def revise_plan_endpoint(plan_id: int, revision: PlanRevision, request: Request):
+    """Change a stored plan's goal, preferences or skipped weeks, regenerating
+    only the weeks the change affects"""
+    try:
+        result = await revise_plan(plan_id, revision, request.session.get("user_id"))
+    except PlanCapacityError as e:
+        raise HTTPException(
+            status_code=503, detail=str(e), headers={"Retry-After": "30"}
+        )
+    if result is None:
+        raise HTTPException(status_code=404, detail="Plan not found")
+
+    stored, revised_weeks, tokens = result
+    return {**plan_payload(stored, tokens), "revised_weeks": revised_weeks}
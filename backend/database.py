@@ -1,42 +1,310 @@
+import asyncio
 import os
+import queue
+import re
 import sqlite3
+import threading
+from contextlib import asynccontextmanager, contextmanager
 from pathlib import Path
-from sqlite3 import Connection
+from sqlite3 import Connection, Cursor
+from typing import AsyncIterator, Dict, Iterator, Optional
+
+from fastapi import Depends, Request
 
 project_root = Path(__file__).resolve().parents[1]
 db_path = os.getenv("DATABASE_PATH", "backend/strava_app.db")
 full_path = project_root / db_path
 
+POOL_SIZE = int(os.getenv("DATABASE_POOL_SIZE", "8"))
+POOL_TIMEOUT_SECONDS = float(os.getenv("DATABASE_POOL_TIMEOUT", "30"))
+
+# Users whose workouts data lives in a database file of its own rather than
+# the shared one, e.g. athletes with very long histories
+DEDICATED_TENANTS = frozenset(
+    user_id.strip()
+    for user_id in os.getenv("DEDICATED_TENANTS", "").split(",")
+    if user_id.strip()
+)
+tenant_dir = project_root / os.getenv("TENANT_DATABASE_DIR", "backend/tenants")
+TENANT_POOL_SIZE = int(os.getenv("TENANT_DATABASE_POOL_SIZE", "2"))
+
+# Tables holding a user's workouts data, all keyed by user_id. They live in
+# the user's partition: the shared database, or the user's own file for a
+# dedicated tenant. Auth tokens, sync jobs and plans are always shared.
+USER_DATA_TABLES = (
+    "workouts",
+    "strava_sync_state",
+    "fitness_summaries",
+    "activity_streams",
+    "best_efforts",
+)
+
+# Applied to every pooled connection. journal_mode=WAL is persistent and is
+# set once in init_db.
+CONNECTION_PRAGMAS = (
+    "PRAGMA synchronous = NORMAL",
+    "PRAGMA cache_size = -16000",  # 16 MB page cache
+    "PRAGMA mmap_size = 268435456",  # 256 MB memory-mapped I/O
+    "PRAGMA temp_store = MEMORY",
+)
+
+
+class ConnectionPool:
+    """Thread-safe pool of SQLite connections to a single database file"""
+
+    def __init__(self, path: Path, size: int = POOL_SIZE):
+        self.path = path
+        self.size = size
+        self._idle: "queue.LifoQueue[Connection]" = queue.LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
+
+    def _connect(self) -> Connection:
+        conn = sqlite3.connect(
+            self.path, check_same_thread=False, timeout=POOL_TIMEOUT_SECONDS
+        )
+        conn.row_factory = sqlite3.Row
+        for pragma in CONNECTION_PRAGMAS:
+            conn.execute(pragma)
+        return conn
+
+    def acquire(self) -> Connection:
+        """Take an idle connection, opening a new one while under the pool size"""
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+
+        with self._lock:
+            if self._created < self.size:
+                self._created += 1
+                create = True
+            else:
+                create = False
+
+        if create:
+            try:
+                return self._connect()
+            except Exception:
+                with self._lock:
+                    self._created -= 1
+                raise
+
+        try:
+            return self._idle.get(timeout=POOL_TIMEOUT_SECONDS)
+        except queue.Empty:
+            raise TimeoutError("Timed out waiting for a database connection")
+
+    async def acquire_async(self) -> Connection:
+        """acquire() for coroutines: waiting for a connection to be released
+        happens in a worker thread, so the event loop keeps running"""
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+
+        waiter = asyncio.ensure_future(asyncio.to_thread(self.acquire))
+        try:
+            return await asyncio.shield(waiter)
+        except asyncio.CancelledError:
+            # The thread may still get a connection; hand it straight back
+            waiter.add_done_callback(self._release_acquired)
+            raise
+
+    def _release_acquired(self, waiter: "asyncio.Future[Connection]") -> None:
+        if not waiter.cancelled() and waiter.exception() is None:
+            self.release(waiter.result())
+
+    def release(self, conn: Connection) -> None:
+        """Return a connection to the pool, discarding any uncommitted work"""
+        if conn.in_transaction:
+            conn.rollback()
+        self._idle.put(conn)
+
+    @contextmanager
+    def connection(self) -> Iterator[Connection]:
+        conn = self.acquire()
+        try:
+            yield conn
+        finally:
+            self.release(conn)
+
+    @asynccontextmanager
+    async def async_connection(self) -> AsyncIterator[Connection]:
+        conn = await self.acquire_async()
+        try:
+            yield conn
+        finally:
+            self.release(conn)
+
+    def close(self) -> None:
+        """Close all idle connections"""
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            conn.close()
+            with self._lock:
+                self._created -= 1
+
+
+_pool: Optional[ConnectionPool] = None
+_tenant_pools: Dict[str, ConnectionPool] = {}
+_pool_lock = threading.Lock()
+
+
+def init_db() -> ConnectionPool:
+    """Create the connection pool and set up the schema. Called once at startup."""
+    global _pool
+
+    with _pool_lock:
+        if _pool is None:
+            pool = ConnectionPool(full_path)
+            with pool.connection() as conn:
+                conn.execute("PRAGMA journal_mode = WAL")
+                _init_db(conn)
+            _pool = pool
+
+    return _pool
+
+
+def close_db() -> None:
+    """Close pooled connections. Called at shutdown."""
+    global _pool
+
+    with _pool_lock:
+        if _pool is not None:
+            _pool.close()
+            _pool = None
+        for pool in _tenant_pools.values():
+            pool.close()
+        _tenant_pools.clear()
+
+
+def path_for(user_id: Optional[str]) -> Path:
+    """The database file holding a user's workouts data"""
+    if user_id in DEDICATED_TENANTS:
+        return tenant_dir / (re.sub(r"[^\w-]", "_", user_id) + ".db")
+    return full_path
+
+
+def _tenant_pool(user_id: str) -> ConnectionPool:
+    with _pool_lock:
+        pool = _tenant_pools.get(user_id)
+        if pool is None:
+            path = path_for(user_id)
+            path.parent.mkdir(parents=True, exist_ok=True)
+            pool = ConnectionPool(path, TENANT_POOL_SIZE)
+            # Every file gets the full schema; only USER_DATA_TABLES are used
+            with pool.connection() as conn:
+                conn.execute("PRAGMA journal_mode = WAL")
+                _init_db(conn)
+            _tenant_pools[user_id] = pool
+    return pool
+
+
+def _pool_for(user_id: Optional[str]) -> ConnectionPool:
+    if user_id in DEDICATED_TENANTS:
+        return _tenant_pool(user_id)
+    return _pool or init_db()
+
+
+@contextmanager
+def connection(user_id: Optional[str] = None) -> Iterator[Connection]:
+    """Borrow a pooled connection outside of a request (e.g. from LLM tools).
+
+    With a user_id, the connection is to that user's data partition, for
+    the USER_DATA_TABLES; otherwise it is to the shared database.
+    """
+    with _pool_for(user_id).connection() as conn:
+        yield conn
+
+
+@asynccontextmanager
+async def async_connection(
+    user_id: Optional[str] = None,
+) -> AsyncIterator[Connection]:
+    """connection() for coroutines such as the background workers, which
+    must not block the event loop while the pool is exhausted"""
+    async with _pool_for(user_id).async_connection() as conn:
+        yield conn
+
 
 def get_db():
-    conn = sqlite3.connect(full_path, check_same_thread=False)
-    conn.row_factory = sqlite3.Row
-    _init_db(conn)
-    try:
+    with connection() as conn:
+        yield conn
+
+
+def get_user_db(request: Request, db: Connection = Depends(get_db)):
+    """The signed-in user's data partition, for the USER_DATA_TABLES.
+
+    Unless the user is a dedicated tenant this is the request's get_db
+    connection itself: taking a second connection from the pool while
+    holding the first can deadlock once concurrent requests exhaust it.
+    """
+    user_id = request.session.get("user_id")
+    if user_id not in DEDICATED_TENANTS:
+        yield db
+        return
+    with connection(user_id) as conn:
         yield conn
-    finally:
-        conn.close()
+
+
+def purge_user(db: Connection, user_id: str) -> None:
+    """Delete a user's workouts data, using `db`, a connection to the shared
+    database, so no second connection is taken. The caller commits.
+
+    A dedicated tenant's file is simply removed. In the shared database each
+    table is cleared with a delete on its user_id index, so the cost is
+    proportional to the user's rows rather than the table.
+    """
+    if user_id in DEDICATED_TENANTS:
+        with _pool_lock:
+            pool = _tenant_pools.pop(user_id, None)
+        if pool is not None:
+            pool.close()
+        path = path_for(user_id)
+        for suffix in ("", "-wal", "-shm"):
+            Path(f"{path}{suffix}").unlink(missing_ok=True)
+        return
+
+    for table in USER_DATA_TABLES:
+        db.execute(
+            f"DELETE FROM {table} WHERE user_id = :user_id", {"user_id": user_id}
+        )
 
 
 def _init_db(conn: Connection) -> None:
-    """Initialize database tables if they don't exist"""
-    cursor = conn.cursor()
+    """Bring the database schema up to date by applying pending migrations"""
+    for version, migration in enumerate(MIGRATIONS, start=1):
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            # Re-read inside the write lock in case another process migrated
+            current = conn.execute("PRAGMA user_version").fetchone()[0]
+            if current < version:
+                migration(conn.cursor())
+                conn.execute(f"PRAGMA user_version = {version}")
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+
 
+def _migrate_v1(cursor: Cursor) -> None:
+    """Initial schema. Uses IF NOT EXISTS so pre-migration databases upgrade cleanly."""
     # Create strava_auth table
-    cursor.execute(
-        """
+    cursor.execute("""
     CREATE TABLE IF NOT EXISTS strava_auth (
         user_id TEXT PRIMARY KEY,
         access_token TEXT NOT NULL,
         refresh_token TEXT NOT NULL,
         expires_at INTEGER NOT NULL
     )
-    """
-    )
+    """)
 
     # Create workouts table
-    cursor.execute(
-        """
+    cursor.execute("""
     CREATE TABLE IF NOT EXISTS workouts (
         id INTEGER PRIMARY KEY AUTOINCREMENT,
         strava_id TEXT NOT NULL UNIQUE,
@@ -51,7 +319,175 @@ def _init_db(conn: Connection) -> None:
         average_heartrate REAL,
         max_heartrate REAL
     )
-    """
+    """)
+
+    # Create sync state table (per-user high-water mark for incremental syncs)
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS strava_sync_state (
+        user_id TEXT PRIMARY KEY,
+        last_start_date TEXT,
+        last_strava_id TEXT,
+        last_synced_at INTEGER NOT NULL
     )
+    """)
+
+
+def _migrate_v2(cursor: Cursor) -> None:
+    """Per-user indexes for history listing and pace/volume queries"""
+    cursor.execute("""
+    CREATE INDEX IF NOT EXISTS idx_workouts_user_type_date
+    ON workouts (user_id, type, start_date)
+    """)
+    cursor.execute("""
+    CREATE INDEX IF NOT EXISTS idx_workouts_user_date
+    ON workouts (user_id, start_date)
+    """)
+
+
+def _migrate_v3(cursor: Cursor) -> None:
+    """Persistent queue of background Strava sync jobs"""
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS sync_jobs (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id TEXT NOT NULL,
+        status TEXT NOT NULL,
+        full_sync INTEGER NOT NULL DEFAULT 0,
+        activities_synced INTEGER NOT NULL DEFAULT 0,
+        error TEXT,
+        created_at INTEGER NOT NULL,
+        started_at INTEGER,
+        finished_at INTEGER
+    )
+    """)
+    cursor.execute("""
+    CREATE INDEX IF NOT EXISTS idx_sync_jobs_status
+    ON sync_jobs (status, id)
+    """)
+    cursor.execute("""
+    CREATE INDEX IF NOT EXISTS idx_sync_jobs_user
+    ON sync_jobs (user_id, id)
+    """)
+
+
+def _migrate_v4(cursor: Cursor) -> None:
+    """Materialized per-user fitness summaries for the plan generator"""
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS fitness_summaries (
+        user_id TEXT PRIMARY KEY,
+        summary TEXT NOT NULL,
+        as_of TEXT NOT NULL,
+        updated_at INTEGER NOT NULL
+    )
+    """)
+
+
+def _migrate_v5(cursor: Cursor) -> None:
+    """Cache of generated training plans"""
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS plan_cache (
+        cache_key TEXT PRIMARY KEY,
+        user_id TEXT,
+        response TEXT NOT NULL,
+        created_at INTEGER NOT NULL,
+        last_accessed_at INTEGER NOT NULL,
+        hits INTEGER NOT NULL DEFAULT 0
+    )
+    """)
+    cursor.execute("""
+    CREATE INDEX IF NOT EXISTS idx_plan_cache_last_accessed
+    ON plan_cache (last_accessed_at)
+    """)
+
+
+def _migrate_v6(cursor: Cursor) -> None:
+    """Structured training plans; the plan cache now points at stored plans"""
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS training_plans (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id TEXT,
+        request TEXT NOT NULL,
+        commentary TEXT NOT NULL,
+        plan TEXT NOT NULL,
+        created_at INTEGER NOT NULL,
+        updated_at INTEGER NOT NULL
+    )
+    """)
+    cursor.execute("""
+    CREATE INDEX IF NOT EXISTS idx_training_plans_user
+    ON training_plans (user_id, created_at)
+    """)
+    # Cached HTML responses can't be linked to a plan, so start the cache over
+    cursor.execute("DROP TABLE IF EXISTS plan_cache")
+    cursor.execute("""
+    CREATE TABLE plan_cache (
+        cache_key TEXT PRIMARY KEY,
+        user_id TEXT,
+        plan_id INTEGER NOT NULL,
+        created_at INTEGER NOT NULL,
+        last_accessed_at INTEGER NOT NULL,
+        hits INTEGER NOT NULL DEFAULT 0
+    )
+    """)
+    cursor.execute("""
+    CREATE INDEX IF NOT EXISTS idx_plan_cache_last_accessed
+    ON plan_cache (last_accessed_at)
+    """)
+
+
+def _migrate_v7(cursor: Cursor) -> None:
+    """Compressed per-second activity streams, kept apart from the workouts rows"""
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS activity_streams (
+        strava_id TEXT PRIMARY KEY,
+        user_id TEXT NOT NULL,
+        samples INTEGER NOT NULL,
+        data BLOB,
+        fetched_at INTEGER NOT NULL
+    )
+    """)
+    cursor.execute("""
+    CREATE INDEX IF NOT EXISTS idx_activity_streams_user
+    ON activity_streams (user_id)
+    """)
+
+
+def _migrate_v8(cursor: Cursor) -> None:
+    """Per-activity best efforts and splits computed from the streams"""
+    cursor.execute("ALTER TABLE activity_streams ADD COLUMN splits TEXT")
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS best_efforts (
+        strava_id TEXT NOT NULL,
+        user_id TEXT NOT NULL,
+        effort TEXT NOT NULL,
+        elapsed_time REAL NOT NULL,
+        start_date TEXT NOT NULL,
+        PRIMARY KEY (strava_id, effort)
+    )
+    """)
+    cursor.execute("""
+    CREATE INDEX IF NOT EXISTS idx_best_efforts_user
+    ON best_efforts (user_id, effort, elapsed_time)
+    """)
+
+
+def _migrate_v9(cursor: Cursor) -> None:
+    """Find the tokens due for a proactive refresh without a table scan"""
+    cursor.execute("""
+    CREATE INDEX IF NOT EXISTS idx_strava_auth_expires_at
+    ON strava_auth (expires_at)
+    """)
+
 
-    conn.commit()
+# Ordered schema migrations; the database's user_version records how many
+# have been applied. Append new migrations, never edit applied ones.
+MIGRATIONS = [
+    _migrate_v1,
+    _migrate_v2,
+    _migrate_v3,
+    _migrate_v4,
+    _migrate_v5,
+    _migrate_v6,
+    _migrate_v7,
+    _migrate_v8,
+    _migrate_v9,
+]
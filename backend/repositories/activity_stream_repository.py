@@ -0,0 +1,75 @@
+from sqlite3 import Connection, Row
+from typing import List, Optional
+
+
+class ActivityStreamRepository:
+    """Data access for the activity_streams table"""
+
+    def __init__(self, db: Connection):
+        self.db = db
+
+    def save(
+        self,
+        user_id: str,
+        strava_id: str,
+        samples: int,
+        data: Optional[bytes],
+        now: int,
+    ) -> None:
+        """Store an activity's encoded streams. A None blob records that Strava
+        has none, so the activity isn't fetched again. The caller commits."""
+        self.db.execute(
+            """
+            INSERT INTO activity_streams (
+                strava_id, user_id, samples, data, fetched_at
+            ) VALUES (
+                :strava_id, :user_id, :samples, :data, :now
+            )
+            ON CONFLICT(strava_id) DO UPDATE SET
+                samples = excluded.samples,
+                data = excluded.data,
+                fetched_at = excluded.fetched_at
+            """,
+            {
+                "strava_id": strava_id,
+                "user_id": user_id,
+                "samples": samples,
+                "data": data,
+                "now": now,
+            },
+        )
+
+    def get(self, user_id: str, strava_id: str) -> Optional[Row]:
+        return self.db.execute(
+            """
+            SELECT samples, data, fetched_at FROM activity_streams
+            WHERE strava_id = :strava_id AND user_id = :user_id
+            """,
+            {"user_id": user_id, "strava_id": strava_id},
+        ).fetchone()
+
+    def missing(self, user_id: str, activity_type: str, limit: int) -> List[str]:
+        """Strava ids of a user's activities without stored streams, newest first"""
+        rows = self.db.execute(
+            """
+            SELECT strava_id FROM workouts
+            WHERE user_id = :user_id AND type = :type
+              AND NOT EXISTS (
+                  SELECT 1 FROM activity_streams
+                  WHERE activity_streams.strava_id = workouts.strava_id
+              )
+            ORDER BY start_date DESC, id DESC
+            LIMIT :limit
+            """,
+            {"user_id": user_id, "type": activity_type, "limit": limit},
+        ).fetchall()
+        return [row["strava_id"] for row in rows]
+
+    def delete_activity(self, user_id: str, strava_id: str) -> None:
+        self.db.execute(
+            """
+            DELETE FROM activity_streams
+            WHERE user_id = :user_id AND strava_id = :strava_id
+            """,
+            {"user_id": user_id, "strava_id": strava_id},
+        )
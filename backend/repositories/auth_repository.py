@@ -0,0 +1,132 @@
+import os
+from sqlite3 import Connection
+from typing import Any, Dict, List, Optional, Tuple
+
+from cryptography.fernet import Fernet, InvalidToken, MultiFernet
+
+# Fernet keys for the stored tokens, comma separated. The first encrypts;
+# the others still decrypt, so keys can be rotated.
+TOKEN_ENCRYPTION_KEY = os.getenv("TOKEN_ENCRYPTION_KEY")
+
+# Every Fernet token starts with its version byte, 0x80, base64 encoded
+_FERNET_PREFIX = "gAAAAA"
+
+_cipher: Optional[MultiFernet] = None
+
+
+class AuthRepository:
+    """Data access for the strava_auth table. Tokens are encrypted at rest."""
+
+    def __init__(self, db: Connection):
+        self.db = db
+
+    def get(self, user_id: str) -> Optional[Dict[str, Any]]:
+        row = self.db.execute(
+            """
+            SELECT user_id, access_token, refresh_token, expires_at
+            FROM strava_auth WHERE user_id = :user_id
+            """,
+            {"user_id": user_id},
+        ).fetchone()
+        if not row:
+            return None
+
+        return {
+            **dict(row),
+            "access_token": _decrypt(row["access_token"]),
+            "refresh_token": _decrypt(row["refresh_token"]),
+        }
+
+    def exists(self, user_id: str) -> bool:
+        """Whether the user is connected, without decrypting their tokens"""
+        row = self.db.execute(
+            "SELECT 1 FROM strava_auth WHERE user_id = :user_id", {"user_id": user_id}
+        ).fetchone()
+        return row is not None
+
+    def expiring(self, before: int) -> List[Tuple[str, int]]:
+        """(user_id, expires_at) of the access tokens expiring before the given
+        unix time, soonest first"""
+        rows = self.db.execute(
+            """
+            SELECT user_id, expires_at FROM strava_auth
+            WHERE expires_at < :before
+            ORDER BY expires_at
+            """,
+            {"before": before},
+        ).fetchall()
+        return [(row["user_id"], row["expires_at"]) for row in rows]
+
+    def save_tokens(
+        self, user_id: str, access_token: str, refresh_token: str, expires_at: int
+    ) -> None:
+        """Insert or replace the stored tokens for a user"""
+        self.db.execute(
+            """
+            INSERT INTO strava_auth (
+                user_id, access_token, refresh_token, expires_at
+            ) VALUES (
+                :user_id, :access_token, :refresh_token, :expires_at
+            )
+            ON CONFLICT(user_id) DO UPDATE SET
+                access_token = excluded.access_token,
+                refresh_token = excluded.refresh_token,
+                expires_at = excluded.expires_at
+            """,
+            {
+                "access_token": _encrypt(access_token),
+                "refresh_token": _encrypt(refresh_token),
+                "expires_at": expires_at,
+                "user_id": user_id,
+            },
+        )
+
+    def update_tokens(
+        self, user_id: str, access_token: str, refresh_token: str, expires_at: int
+    ) -> None:
+        self.db.execute(
+            """
+            UPDATE strava_auth
+            SET access_token = :access_token,
+                refresh_token = :refresh_token,
+                expires_at = :expires_at
+            WHERE user_id = :user_id
+            """,
+            {
+                "access_token": _encrypt(access_token),
+                "refresh_token": _encrypt(refresh_token),
+                "expires_at": expires_at,
+                "user_id": user_id,
+            },
+        )
+
+    def delete(self, user_id: str) -> None:
+        self.db.execute(
+            "DELETE FROM strava_auth WHERE user_id = :user_id", {"user_id": user_id}
+        )
+
+
+def _get_cipher() -> MultiFernet:
+    global _cipher
+
+    if _cipher is None:
+        keys = [key.strip() for key in (TOKEN_ENCRYPTION_KEY or "").split(",")]
+        if not any(keys):
+            raise ValueError("TOKEN_ENCRYPTION_KEY must be set")
+        _cipher = MultiFernet([Fernet(key) for key in keys if key])
+    return _cipher
+
+
+def _encrypt(token: str) -> str:
+    return _get_cipher().encrypt(token.encode()).decode()
+
+
+def _decrypt(value: str) -> str:
+    # Rows written before encryption hold the plain token; they are
+    # encrypted the next time the token is refreshed
+    if not value.startswith(_FERNET_PREFIX):
+        return value
+    try:
+        return _get_cipher().decrypt(value.encode()).decode()
+    except InvalidToken:
+        raise ValueError("Stored token can't be decrypted with TOKEN_ENCRYPTION_KEY")
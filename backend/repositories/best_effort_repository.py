@@ -0,0 +1,102 @@
+import json
+from sqlite3 import Connection, Row
+from typing import Dict, List, Optional
+
+
+class BestEffortRepository:
+    """Data access for the best_efforts table and cached activity splits"""
+
+    def __init__(self, db: Connection):
+        self.db = db
+
+    def pending(self, user_id: str, limit: int) -> List[Row]:
+        """Stored streams that haven't been analyzed yet, with their run date"""
+        return self.db.execute(
+            """
+            SELECT activity_streams.strava_id, activity_streams.data,
+                   workouts.start_date
+            FROM activity_streams
+            JOIN workouts ON workouts.strava_id = activity_streams.strava_id
+            WHERE activity_streams.user_id = :user_id
+              AND activity_streams.data IS NOT NULL
+              AND activity_streams.splits IS NULL
+            LIMIT :limit
+            """,
+            {"user_id": user_id, "limit": limit},
+        ).fetchall()
+
+    def save(
+        self,
+        user_id: str,
+        strava_id: str,
+        start_date: str,
+        efforts: Dict[str, float],
+        splits: List[float],
+    ) -> None:
+        """Store an activity's best efforts and splits. The caller commits."""
+        self.db.execute(
+            "DELETE FROM best_efforts WHERE strava_id = :strava_id",
+            {"strava_id": strava_id},
+        )
+        self.db.executemany(
+            """
+            INSERT INTO best_efforts (
+                strava_id, user_id, effort, elapsed_time, start_date
+            ) VALUES (
+                :strava_id, :user_id, :effort, :elapsed_time, :start_date
+            )
+            """,
+            [
+                {
+                    "strava_id": strava_id,
+                    "user_id": user_id,
+                    "effort": effort,
+                    "elapsed_time": elapsed_time,
+                    "start_date": start_date,
+                }
+                for effort, elapsed_time in efforts.items()
+            ],
+        )
+        self.db.execute(
+            "UPDATE activity_streams SET splits = :splits WHERE strava_id = :strava_id",
+            {"strava_id": strava_id, "splits": json.dumps(splits)},
+        )
+
+    def personal_bests(self, user_id: str, days: Optional[int] = None) -> List[Row]:
+        """Fastest effort per distance, optionally over the last `days` days"""
+        query = """
+            SELECT effort, MIN(elapsed_time) AS elapsed_time, strava_id, start_date
+            FROM best_efforts
+            WHERE user_id = :user_id
+        """
+        params = {"user_id": user_id}
+
+        if days:
+            query += " AND start_date > date('now', :since)"
+            params["since"] = f"-{days} days"
+
+        # SQLite takes the other columns from the row holding the MIN
+        query += " GROUP BY effort"
+
+        return self.db.execute(query, params).fetchall()
+
+    def get_splits(self, user_id: str, strava_id: str) -> Optional[List[float]]:
+        row = self.db.execute(
+            """
+            SELECT splits FROM activity_streams
+            WHERE strava_id = :strava_id AND user_id = :user_id
+            """,
+            {"user_id": user_id, "strava_id": strava_id},
+        ).fetchone()
+        if not row or row["splits"] is None:
+            return None
+        return json.loads(row["splits"])
+
+    def delete_activity(self, user_id: str, strava_id: str) -> None:
+        self.db.execute(
+            """
+            DELETE FROM best_efforts
+            WHERE user_id = :user_id AND strava_id = :strava_id
+            """,
+            {"user_id": user_id, "strava_id": strava_id},
+        )
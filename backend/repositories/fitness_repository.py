@@ -0,0 +1,125 @@
+import json
+import time
+from sqlite3 import Connection
+from typing import Any, Dict, List, Optional
+
+RUN_TYPE = "Run"
+
+# Distance buckets (km) for pace comparisons: (label, min inclusive, max exclusive)
+DISTANCE_BUCKETS = [
+    ("up to 7.5 km", 0, 7.5),
+    ("7.5-15 km", 7.5, 15),
+    ("15-30 km", 15, 30),
+    ("30 km and over", 30, 1000000),
+]
+
+
+class FitnessRepository:
+    """Aggregate queries over a user's runs and the fitness_summaries table"""
+
+    def __init__(self, db: Connection):
+        self.db = db
+
+    def window_stats(self, user_id: str, days: int) -> Dict[str, Any]:
+        """Volume, pace, long run and heart rate over the last `days` days"""
+        row = self.db.execute(
+            """
+            SELECT COUNT(*) AS runs,
+                   COALESCE(SUM(distance), 0) AS distance,
+                   COALESCE(SUM(moving_time), 0) AS moving_time,
+                   AVG(NULLIF(average_pace, 0)) AS average_pace,
+                   MAX(distance) AS longest_run,
+                   AVG(average_heartrate) AS average_heartrate,
+                   COUNT(DISTINCT CAST(
+                       (julianday(date('now')) - julianday(start_date)) / 7
+                       AS INTEGER
+                   )) AS active_weeks
+            FROM workouts
+            WHERE user_id = :user_id AND type = :type
+              AND start_date > date('now', :since)
+            """,
+            {"user_id": user_id, "type": RUN_TYPE, "since": f"-{days} days"},
+        ).fetchone()
+        return dict(row)
+
+    def pace_by_distance(self, user_id: str, days: int) -> List[Dict[str, Any]]:
+        """Average and best pace per distance bucket over the last `days` days"""
+        buckets = []
+        for label, low, high in DISTANCE_BUCKETS:
+            row = self.db.execute(
+                """
+                SELECT COUNT(*) AS runs,
+                       AVG(average_pace) AS average_pace,
+                       MIN(average_pace) AS best_pace
+                FROM workouts
+                WHERE user_id = :user_id AND type = :type
+                  AND start_date > date('now', :since)
+                  AND distance >= :low AND distance < :high
+                  AND average_pace > 0
+                """,
+                {
+                    "user_id": user_id,
+                    "type": RUN_TYPE,
+                    "since": f"-{days} days",
+                    "low": low,
+                    "high": high,
+                },
+            ).fetchone()
+            if row["runs"]:
+                buckets.append({"bucket": label, **dict(row)})
+        return buckets
+
+    def run_columns(self, user_id: str) -> List[tuple]:
+        """All of a user's runs in date order as (day, distance, moving_time,
+        average_heartrate) tuples, with day counted from 1970-01-01"""
+        return self.db.execute(
+            """
+            SELECT CAST(julianday(start_date) - 2440587.5 AS INTEGER),
+                   distance, moving_time, average_heartrate
+            FROM workouts
+            WHERE user_id = :user_id AND type = :type
+            ORDER BY start_date
+            """,
+            {"user_id": user_id, "type": RUN_TYPE},
+        ).fetchall()
+
+    def data_version(self, user_id: str) -> tuple:
+        """Cheap signature that changes whenever a user's runs change"""
+        row = self.db.execute(
+            """
+            SELECT COUNT(*) AS runs, MAX(start_date) AS latest,
+                   (SELECT updated_at FROM fitness_summaries
+                    WHERE user_id = :user_id) AS summary_updated_at
+            FROM workouts
+            WHERE user_id = :user_id AND type = :type
+            """,
+            {"user_id": user_id, "type": RUN_TYPE},
+        ).fetchone()
+        return tuple(row)
+
+    def get_summary(self, user_id: str) -> Optional[Dict[str, Any]]:
+        row = self.db.execute(
+            "SELECT summary, as_of FROM fitness_summaries WHERE user_id = :user_id",
+            {"user_id": user_id},
+        ).fetchone()
+        if not row:
+            return None
+        return json.loads(row["summary"])
+
+    def save_summary(self, user_id: str, summary: Dict[str, Any]) -> None:
+        self.db.execute(
+            """
+            INSERT INTO fitness_summaries (user_id, summary, as_of, updated_at)
+            VALUES (:user_id, :summary, :as_of, :updated_at)
+            ON CONFLICT(user_id) DO UPDATE SET
+                summary = excluded.summary,
+                as_of = excluded.as_of,
+                updated_at = excluded.updated_at
+            """,
+            {
+                "user_id": user_id,
+                "summary": json.dumps(summary),
+                "as_of": summary["as_of"],
+                "updated_at": int(time.time()),
+            },
+        )
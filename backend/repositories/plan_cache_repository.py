@@ -0,0 +1,83 @@
+from sqlite3 import Connection, Row
+from typing import Optional
+
+
+class PlanCacheRepository:
+    """Data access for the plan_cache table"""
+
+    def __init__(self, db: Connection):
+        self.db = db
+
+    def get(self, cache_key: str) -> Optional[Row]:
+        return self.db.execute(
+            "SELECT * FROM plan_cache WHERE cache_key = :cache_key",
+            {"cache_key": cache_key},
+        ).fetchone()
+
+    def touch(self, cache_key: str, now: int) -> None:
+        """Record a cache hit"""
+        self.db.execute(
+            """
+            UPDATE plan_cache
+            SET last_accessed_at = :now, hits = hits + 1
+            WHERE cache_key = :cache_key
+            """,
+            {"cache_key": cache_key, "now": now},
+        )
+
+    def put(
+        self, cache_key: str, user_id: Optional[str], plan_id: int, now: int
+    ) -> None:
+        self.db.execute(
+            """
+            INSERT INTO plan_cache (
+                cache_key, user_id, plan_id, created_at, last_accessed_at
+            ) VALUES (
+                :cache_key, :user_id, :plan_id, :now, :now
+            )
+            ON CONFLICT(cache_key) DO UPDATE SET
+                plan_id = excluded.plan_id,
+                created_at = excluded.created_at,
+                last_accessed_at = excluded.last_accessed_at,
+                hits = 0
+            """,
+            {
+                "cache_key": cache_key,
+                "user_id": user_id,
+                "plan_id": plan_id,
+                "now": now,
+            },
+        )
+
+    def delete(self, cache_key: str) -> None:
+        self.db.execute(
+            "DELETE FROM plan_cache WHERE cache_key = :cache_key",
+            {"cache_key": cache_key},
+        )
+
+    def delete_expired(self, created_before: int) -> None:
+        self.db.execute(
+            "DELETE FROM plan_cache WHERE created_at < :created_before",
+            {"created_before": created_before},
+        )
+
+    def evict_least_recently_used(self, max_entries: int) -> None:
+        """Delete the least recently used entries beyond max_entries"""
+        self.db.execute(
+            """
+            DELETE FROM plan_cache WHERE cache_key IN (
+                SELECT cache_key FROM plan_cache
+                ORDER BY last_accessed_at DESC
+                LIMIT -1 OFFSET :max_entries
+            )
+            """,
+            {"max_entries": max_entries},
+        )
+
+    def count(self) -> int:
+        return self.db.execute("SELECT COUNT(*) FROM plan_cache").fetchone()[0]
+
+    def delete_for_user(self, user_id: str) -> None:
+        self.db.execute(
+            "DELETE FROM plan_cache WHERE user_id = :user_id", {"user_id": user_id}
+        )
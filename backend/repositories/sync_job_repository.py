@@ -0,0 +1,131 @@
+import time
+from sqlite3 import Connection, Row
+from typing import Optional
+
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+
+
+class SyncJobRepository:
+    """Data access for the sync_jobs queue table"""
+
+    def __init__(self, db: Connection):
+        self.db = db
+
+    def enqueue(self, user_id: str, full_sync: bool = False) -> Row:
+        """Queue a sync for a user, reusing their pending job if there is one"""
+        queued = self._pending(user_id, QUEUED)
+        if queued:
+            if full_sync and not queued["full_sync"]:
+                self.db.execute(
+                    "UPDATE sync_jobs SET full_sync = 1 WHERE id = :id",
+                    {"id": queued["id"]},
+                )
+                return self.get(queued["id"])
+            return queued
+
+        # A running sync already covers an incremental request; a full sync
+        # is queued behind it
+        running = self._pending(user_id, RUNNING)
+        if running and (running["full_sync"] or not full_sync):
+            return running
+
+        return self.db.execute(
+            """
+            INSERT INTO sync_jobs (user_id, status, full_sync, created_at)
+            VALUES (:user_id, :status, :full_sync, :created_at)
+            RETURNING *
+            """,
+            {
+                "user_id": user_id,
+                "status": QUEUED,
+                "full_sync": int(full_sync),
+                "created_at": int(time.time()),
+            },
+        ).fetchone()
+
+    def claim_next(self) -> Optional[Row]:
+        """Atomically mark the oldest queued job as running and return it"""
+        return self.db.execute(
+            """
+            UPDATE sync_jobs
+            SET status = :running, started_at = :now
+            WHERE id = (
+                SELECT id FROM sync_jobs
+                WHERE status = :queued
+                  AND user_id NOT IN (
+                      SELECT user_id FROM sync_jobs WHERE status = :running
+                  )
+                ORDER BY id LIMIT 1
+            )
+            RETURNING *
+            """,
+            {"running": RUNNING, "queued": QUEUED, "now": int(time.time())},
+        ).fetchone()
+
+    def mark_succeeded(self, job_id: int, activities_synced: int) -> None:
+        self.db.execute(
+            """
+            UPDATE sync_jobs
+            SET status = :status, activities_synced = :activities_synced,
+                finished_at = :now
+            WHERE id = :id
+            """,
+            {
+                "status": SUCCEEDED,
+                "activities_synced": activities_synced,
+                "now": int(time.time()),
+                "id": job_id,
+            },
+        )
+
+    def mark_failed(self, job_id: int, error: str) -> None:
+        self.db.execute(
+            """
+            UPDATE sync_jobs
+            SET status = :status, error = :error, finished_at = :now
+            WHERE id = :id
+            """,
+            {"status": FAILED, "error": error, "now": int(time.time()), "id": job_id},
+        )
+
+    def requeue_running(self) -> int:
+        """Return jobs interrupted by a restart to the queue"""
+        return self.db.execute(
+            """
+            UPDATE sync_jobs SET status = :queued, started_at = NULL
+            WHERE status = :running
+            """,
+            {"queued": QUEUED, "running": RUNNING},
+        ).rowcount
+
+    def _pending(self, user_id: str, status: str) -> Optional[Row]:
+        return self.db.execute(
+            """
+            SELECT * FROM sync_jobs
+            WHERE user_id = :user_id AND status = :status
+            ORDER BY id DESC LIMIT 1
+            """,
+            {"user_id": user_id, "status": status},
+        ).fetchone()
+
+    def get(self, job_id: int) -> Optional[Row]:
+        return self.db.execute(
+            "SELECT * FROM sync_jobs WHERE id = :id", {"id": job_id}
+        ).fetchone()
+
+    def latest_for_user(self, user_id: str) -> Optional[Row]:
+        return self.db.execute(
+            """
+            SELECT * FROM sync_jobs WHERE user_id = :user_id
+            ORDER BY id DESC LIMIT 1
+            """,
+            {"user_id": user_id},
+        ).fetchone()
+
+    def delete_for_user(self, user_id: str) -> None:
+        self.db.execute(
+            "DELETE FROM sync_jobs WHERE user_id = :user_id", {"user_id": user_id}
+        )
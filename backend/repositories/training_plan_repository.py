@@ -0,0 +1,42 @@
+import json
+from sqlite3 import Connection, Row
+from typing import Any, Dict, Optional
+
+
+class TrainingPlanRepository:
+    """Data access for the training_plans table"""
+
+    def __init__(self, db: Connection):
+        self.db = db
+
+    def create(
+        self,
+        user_id: Optional[str],
+        request: Dict[str, Any],
+        commentary: str,
+        plan: str,
+        now: int,
+    ) -> int:
+        """Store a plan, given as JSON, and return its id"""
+        cursor = self.db.execute(
+            """
+            INSERT INTO training_plans (
+                user_id, request, commentary, plan, created_at, updated_at
+            ) VALUES (
+                :user_id, :request, :commentary, :plan, :now, :now
+            )
+            """,
+            {
+                "user_id": user_id,
+                "request": json.dumps(request, separators=(",", ":")),
+                "commentary": commentary,
+                "plan": plan,
+                "now": now,
+            },
+        )
+        return cursor.lastrowid
+
+    def get(self, plan_id: int) -> Optional[Row]:
+        return self.db.execute(
+            "SELECT * FROM training_plans WHERE id = :id", {"id": plan_id}
+        ).fetchone()
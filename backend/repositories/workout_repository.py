@@ -0,0 +1,113 @@
+from datetime import date
+from sqlite3 import Connection, Row
+from typing import Any, Dict, Iterable, List, Optional, Sequence
+
+
+class WorkoutRepository:
+    """Data access for the workouts and strava_sync_state tables"""
+
+    def __init__(self, db: Connection):
+        self.db = db
+
+    def list_for_user(
+        self,
+        user_id: str,
+        limit: Optional[int] = None,
+        offset: int = 0,
+        start_date: Optional[date] = None,
+        end_date: Optional[date] = None,
+        activity_type: Optional[str] = None,
+        columns: Sequence[str] = ("*",),
+    ) -> List[Row]:
+        """List a user's workouts, newest first"""
+        query = f"SELECT {', '.join(columns)} FROM workouts WHERE user_id = :user_id"
+        params = {"user_id": user_id, "limit": limit or -1, "offset": offset}
+
+        if activity_type:
+            query += " AND type = :type"
+            params["type"] = activity_type
+
+        if start_date:
+            query += " AND start_date >= :start_date"
+            params["start_date"] = start_date.isoformat()
+
+        if end_date:
+            query += " AND start_date <= :end_date"
+            params["end_date"] = end_date.isoformat()
+
+        query += " ORDER BY start_date DESC, id DESC LIMIT :limit OFFSET :offset"
+
+        return self.db.execute(query, params).fetchall()
+
+    def upsert_many(self, rows: Iterable[Dict[str, Any]]) -> None:
+        """Insert or update workouts by strava_id. The caller commits."""
+        self.db.executemany(
+            """
+            INSERT INTO workouts (
+                strava_id, user_id, name, distance, moving_time,
+                total_elevation_gain, type, start_date,
+                average_pace, average_heartrate, max_heartrate
+            ) VALUES (
+                :strava_id, :user_id, :name, :distance, :moving_time,
+                :total_elevation_gain, :type, :start_date,
+                :average_pace, :average_heartrate, :max_heartrate
+            )
+            ON CONFLICT(strava_id) DO UPDATE SET
+                name = excluded.name,
+                distance = excluded.distance,
+                moving_time = excluded.moving_time,
+                total_elevation_gain = excluded.total_elevation_gain,
+                type = excluded.type,
+                start_date = excluded.start_date,
+                average_pace = excluded.average_pace,
+                average_heartrate = excluded.average_heartrate,
+                max_heartrate = excluded.max_heartrate
+            """,
+            rows,
+        )
+
+    def delete_activity(self, user_id: str, strava_id: str) -> None:
+        self.db.execute(
+            """
+            DELETE FROM workouts
+            WHERE user_id = :user_id AND strava_id = :strava_id
+            """,
+            {"user_id": user_id, "strava_id": strava_id},
+        )
+
+    def get_sync_state(self, user_id: str) -> Optional[Row]:
+        return self.db.execute(
+            """
+            SELECT last_start_date, last_strava_id, last_synced_at
+            FROM strava_sync_state WHERE user_id = :user_id
+            """,
+            {"user_id": user_id},
+        ).fetchone()
+
+    def save_sync_state(
+        self,
+        user_id: str,
+        last_start_date: Optional[str],
+        last_strava_id: Optional[str],
+        last_synced_at: int,
+    ) -> None:
+        """Record the sync high-water mark. A None strava_id keeps the stored one."""
+        self.db.execute(
+            """
+            INSERT INTO strava_sync_state (
+                user_id, last_start_date, last_strava_id, last_synced_at
+            ) VALUES (
+                :user_id, :last_start_date, :last_strava_id, :last_synced_at
+            )
+            ON CONFLICT(user_id) DO UPDATE SET
+                last_start_date = excluded.last_start_date,
+                last_strava_id = COALESCE(excluded.last_strava_id, last_strava_id),
+                last_synced_at = excluded.last_synced_at
+            """,
+            {
+                "user_id": user_id,
+                "last_start_date": last_start_date,
+                "last_strava_id": last_strava_id,
+                "last_synced_at": last_synced_at,
+            },
+        )
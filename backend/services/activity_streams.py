@@ -0,0 +1,109 @@
+import struct
+import zlib
+from typing import Iterator, Mapping, Optional, Sequence, Tuple
+
+import numpy as np
+from repositories.activity_stream_repository import ActivityStreamRepository
+
+STREAM_FORMAT_VERSION = 1
+# (name, Strava stream type, storage dtype, stored unit in SI units). Values
+# are quantized to the unit and delta-encoded, so consecutive samples become
+# small integers that compress well. 32-bit channels come first so every
+# channel starts aligned in the decompressed buffer.
+STREAM_CHANNELS = (
+    ("time", "time", np.int32, 1.0),  # seconds
+    ("distance", "distance", np.int32, 0.1),  # meters
+    ("altitude", "altitude", np.int32, 0.1),  # meters
+    ("velocity", "velocity_smooth", np.int16, 0.01),  # meters per second
+    ("heartrate", "heartrate", np.int16, 1.0),  # beats per minute
+)
+STREAM_KEYS = tuple(key for _, key, _, _ in STREAM_CHANNELS)
+
+# Format version, bitmask of the channels present, sample count
+_HEADER = struct.Struct("<BBxxI")
+
+
+def encode_streams(
+    streams: Mapping[str, Sequence[Optional[float]]],
+) -> Tuple[int, bytes]:
+    """Pack Strava streams, keyed by stream type, into a compressed blob.
+
+    Returns the sample count and the blob. Missing samples are stored as 0.
+    """
+    mask = 0
+    samples = None
+    parts = []
+
+    for bit, (name, key, dtype, unit) in enumerate(STREAM_CHANNELS):
+        data = streams.get(key)
+        if not data:
+            continue
+        if samples is None:
+            samples = len(data)
+        elif len(data) != samples:
+            raise ValueError(f"Stream {key} has {len(data)} samples, not {samples}")
+
+        info = np.iinfo(dtype)
+        values = np.nan_to_num(np.array(data, dtype=np.float64) / unit)
+        quantized = np.clip(np.rint(values), info.min, info.max).astype(np.int64)
+        # Deltas wrap around in the storage type; the cumulative sum on
+        # decoding wraps back, so the round trip is exact
+        parts.append(np.diff(quantized, prepend=0).astype(dtype).tobytes())
+        mask |= 1 << bit
+
+    samples = samples or 0
+    header = _HEADER.pack(STREAM_FORMAT_VERSION, mask, samples)
+    return samples, header + zlib.compress(b"".join(parts))
+
+
+class ActivityStreams:
+    """Decoded per-second streams of one activity.
+
+    The blob is decompressed into a single buffer and delta-decoded in place,
+    so each channel is a NumPy view into that buffer rather than a copy.
+    """
+
+    def __init__(self, blob: bytes):
+        version, mask, samples = _HEADER.unpack_from(blob)
+        if version != STREAM_FORMAT_VERSION:
+            raise ValueError(f"Unsupported stream format version {version}")
+
+        # A bytearray so the views are writable for the in-place decode
+        buffer = bytearray(zlib.decompress(memoryview(blob)[_HEADER.size :]))
+        self.samples = samples
+        self._channels = {}
+
+        offset = 0
+        for bit, (name, _, dtype, unit) in enumerate(STREAM_CHANNELS):
+            if not mask & (1 << bit):
+                continue
+            view = np.frombuffer(buffer, dtype=dtype, count=samples, offset=offset)
+            np.cumsum(view, dtype=dtype, out=view)
+            self._channels[name] = (view, unit)
+            offset += view.nbytes
+
+    def __len__(self) -> int:
+        return self.samples
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._channels
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._channels)
+
+    def raw(self, name: str) -> np.ndarray:
+        """A channel as stored: an integer view in units of STREAM_CHANNELS"""
+        return self._channels[name][0]
+
+    def __getitem__(self, name: str) -> np.ndarray:
+        """A channel in SI units; channels stored at unit 1 are not copied"""
+        view, unit = self._channels[name]
+        return view if unit == 1.0 else view * unit
+
+
+def load_streams(db, user_id: str, strava_id: str) -> Optional[ActivityStreams]:
+    """A user's stored streams for an activity; None if there are none"""
+    row = ActivityStreamRepository(db).get(user_id, strava_id)
+    if row is None or row["data"] is None:
+        return None
+    return ActivityStreams(row["data"])
@@ -0,0 +1,272 @@
+import threading
+from collections import OrderedDict
+from datetime import date, datetime, timedelta, timezone
+from typing import Any, Dict, Optional, Tuple
+
+import numpy as np
+from repositories.fitness_repository import FitnessRepository
+
+ACUTE_DAYS = 7
+CHRONIC_DAYS = 28
+RIEGEL_EXPONENT = 1.06
+# Runs shorter than this are too noisy to predict race times from
+MIN_PREDICTION_DISTANCE_KM = 3.0
+RACE_DISTANCES_KM = {
+    "5K": 5.0,
+    "10K": 10.0,
+    "Half Marathon": 21.0975,
+    "Marathon": 42.195,
+}
+# Pace zones as multiples of threshold pace (min/km); slower paces are larger
+PACE_ZONES = [
+    ("Repetition", 0.0, 0.90),
+    ("Interval", 0.90, 0.97),
+    ("Threshold", 0.97, 1.06),
+    ("Steady", 1.06, 1.20),
+    ("Easy", 1.20, np.inf),
+]
+CACHE_SIZE = 64
+
+_EPOCH = date(1970, 1, 1)
+
+
+class RunHistory:
+    """A user's runs as columnar NumPy arrays, in date order"""
+
+    def __init__(self, rows):
+        data = np.array(rows, dtype=np.float64).reshape(-1, 4)
+        self.day = data[:, 0].astype(np.int64)  # days since 1970-01-01
+        self.distance = data[:, 1]  # km
+        self.moving_time = data[:, 2]  # minutes
+        self.average_heartrate = data[:, 3]  # NaN when not recorded
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            self.pace = np.where(
+                self.distance > 0, self.moving_time / self.distance, np.nan
+            )
+
+    def __len__(self) -> int:
+        return len(self.day)
+
+    def recent(self, days: int, today: int) -> np.ndarray:
+        """Boolean mask of runs within the last `days` days"""
+        return (self.day > today - days) & (self.day <= today)
+
+
+class AnalyticsService:
+    """Vectorized training-load, volume, pace-zone and race-time analytics.
+
+    A user's runs are loaded into arrays once and cached in process until
+    their data changes, so every metric is a handful of NumPy passes rather
+    than per-row Python.
+    """
+
+    def __init__(self, cache_size: int = CACHE_SIZE):
+        self.cache_size = cache_size
+        self._cache: "OrderedDict[str, Tuple[tuple, RunHistory]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def load(self, db, user_id: str) -> RunHistory:
+        fitness = FitnessRepository(db)
+        version = fitness.data_version(user_id)
+
+        with self._lock:
+            cached = self._cache.get(user_id)
+            if cached and cached[0] == version:
+                self._cache.move_to_end(user_id)
+                return cached[1]
+
+        history = RunHistory(fitness.run_columns(user_id))
+
+        with self._lock:
+            self._cache[user_id] = (version, history)
+            self._cache.move_to_end(user_id)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+        return history
+
+    def threshold_pace(self, history: RunHistory, today: int) -> Optional[float]:
+        """Estimate threshold pace (min/km) as the 10th percentile pace of the
+        last 90 days of runs, i.e. the pace of the user's harder efforts"""
+        paces = history.pace[history.recent(90, today) & (history.distance >= 3)]
+        paces = paces[np.isfinite(paces)]
+        if len(paces) == 0:
+            paces = history.pace[np.isfinite(history.pace)]
+        if len(paces) == 0:
+            return None
+        return float(np.percentile(paces, 10))
+
+    def session_loads(self, history: RunHistory, threshold: float) -> np.ndarray:
+        """Running stress per session: hours x intensity factor^2 x 100, where
+        the intensity factor is threshold pace over session pace (rTSS)"""
+        with np.errstate(divide="ignore", invalid="ignore"):
+            intensity = np.where(history.pace > 0, threshold / history.pace, 0.0)
+        return np.nan_to_num(history.moving_time / 60 * intensity**2 * 100)
+
+    def training_load(self, history: RunHistory, days: int) -> Dict[str, Any]:
+        """Daily load with 7-day acute and 28-day chronic averages and ACWR"""
+        today = _today()
+        threshold = self.threshold_pace(history, today)
+        start = today - days + 1
+        dates = [_to_date(start + i).isoformat() for i in range(days)]
+
+        if threshold is None:
+            zeros = [0.0] * days
+            return {
+                "threshold_pace": None,
+                "dates": dates,
+                "daily_load": zeros,
+                "acute_load": zeros,
+                "chronic_load": zeros,
+                "acwr": [None] * days,
+            }
+
+        # Pad the series so the chronic average is complete at the first day
+        first = start - CHRONIC_DAYS
+        mask = (history.day >= first) & (history.day <= today)
+        daily = np.bincount(
+            history.day[mask] - first,
+            weights=self.session_loads(history, threshold)[mask],
+            minlength=today - first + 1,
+        )
+
+        cumulative = np.concatenate(([0.0], np.cumsum(daily)))
+        end = np.arange(CHRONIC_DAYS, len(daily)) + 1
+        acute = (cumulative[end] - cumulative[end - ACUTE_DAYS]) / ACUTE_DAYS
+        chronic = (cumulative[end] - cumulative[end - CHRONIC_DAYS]) / CHRONIC_DAYS
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            acwr = np.where(chronic > 0, acute / chronic, np.nan)
+
+        return {
+            "threshold_pace": round(threshold, 2),
+            "dates": dates,
+            "daily_load": _rounded(daily[CHRONIC_DAYS:]),
+            "acute_load": _rounded(acute),
+            "chronic_load": _rounded(chronic),
+            "acwr": _rounded(acwr),
+        }
+
+    def weekly_volume(self, history: RunHistory, weeks: int) -> Dict[str, Any]:
+        """Distance, time and run count per Monday-starting week"""
+        # 1970-01-01 was a Thursday, so shifting by 3 days aligns to Mondays
+        week = (history.day + 3) // 7
+        current = (_today() + 3) // 7
+        first = current - weeks + 1
+        mask = (week >= first) & (week <= current)
+        index = week[mask] - first
+
+        return {
+            "week_start": [
+                _to_date((first + i) * 7 - 3).isoformat() for i in range(weeks)
+            ],
+            "distance": _rounded(
+                np.bincount(index, weights=history.distance[mask], minlength=weeks)
+            ),
+            "moving_time": _rounded(
+                np.bincount(index, weights=history.moving_time[mask], minlength=weeks)
+            ),
+            "runs": np.bincount(index, minlength=weeks).tolist(),
+        }
+
+    def pace_zones(self, history: RunHistory, days: int) -> Dict[str, Any]:
+        """Time spent in each pace zone, relative to threshold pace"""
+        today = _today()
+        threshold = self.threshold_pace(history, today)
+        if threshold is None:
+            return {"threshold_pace": None, "zones": []}
+
+        mask = history.recent(days, today) & np.isfinite(history.pace)
+        edges = np.array([zone[2] for zone in PACE_ZONES[:-1]]) * threshold
+        zone_index = np.digitize(history.pace[mask], edges)
+        minutes = np.bincount(
+            zone_index,
+            weights=history.moving_time[mask],
+            minlength=len(PACE_ZONES),
+        )
+        total = minutes.sum()
+
+        return {
+            "threshold_pace": round(threshold, 2),
+            "zones": [
+                {
+                    "zone": name,
+                    "min_pace": round(low * threshold, 2),
+                    "max_pace": None if np.isinf(high) else round(high * threshold, 2),
+                    "minutes": round(float(minutes[i]), 1),
+                    "share": round(float(minutes[i] / total), 3) if total else 0.0,
+                }
+                for i, (name, low, high) in enumerate(PACE_ZONES)
+            ],
+        }
+
+    def race_predictions(self, history: RunHistory, days: int) -> Dict[str, Any]:
+        """Predicted race times (minutes) from Riegel's formula and Daniels' VDOT,
+        using the best qualifying run of the last `days` days"""
+        mask = (
+            history.recent(days, _today())
+            & (history.distance >= MIN_PREDICTION_DISTANCE_KM)
+            & (history.moving_time > 0)
+        )
+        distance = history.distance[mask]
+        time = history.moving_time[mask]
+
+        if len(distance) == 0:
+            return {"vdot": None, "riegel": {}, "vdot_predictions": {}}
+
+        targets = np.array(list(RACE_DISTANCES_KM.values()))
+
+        # Every run predicts every target at once; keep the fastest per target
+        riegel = (
+            time[:, None] * (targets[None, :] / distance[:, None]) ** RIEGEL_EXPONENT
+        ).min(axis=0)
+
+        vdot = float(_vdot(distance * 1000, time).max())
+
+        return {
+            "vdot": round(vdot, 1),
+            "riegel": dict(zip(RACE_DISTANCES_KM, _rounded(riegel))),
+            "vdot_predictions": dict(
+                zip(RACE_DISTANCES_KM, _rounded(_time_for_vdot(vdot, targets * 1000)))
+            ),
+        }
+
+
+def _vdot(meters: np.ndarray, minutes: np.ndarray) -> np.ndarray:
+    """Daniels & Gilbert VDOT for performances of `meters` in `minutes`"""
+    velocity = meters / minutes
+    vo2 = -4.60 + 0.182258 * velocity + 0.000104 * velocity**2
+    fraction = (
+        0.8
+        + 0.1894393 * np.exp(-0.012778 * minutes)
+        + 0.2989558 * np.exp(-0.1932605 * minutes)
+    )
+    return vo2 / fraction
+
+
+def _time_for_vdot(vdot: float, meters: np.ndarray) -> np.ndarray:
+    """Solve VDOT(meters, t) = vdot for t by vectorized bisection"""
+    low = np.full(meters.shape, 1.0)
+    high = np.full(meters.shape, 1000.0)
+    for _ in range(60):
+        mid = (low + high) / 2
+        # VDOT falls as time rises, so too high a VDOT means too fast a time
+        too_fast = _vdot(meters, mid) > vdot
+        low = np.where(too_fast, mid, low)
+        high = np.where(too_fast, high, mid)
+    return (low + high) / 2
+
+
+def _rounded(values: np.ndarray, digits: int = 2) -> list:
+    """Round for JSON, mapping NaN to None"""
+    return [None if np.isnan(v) else round(float(v), digits) for v in values]
+
+
+def _today() -> int:
+    # Workouts are stored by their UTC start date, so today is a UTC day too
+    return (datetime.now(timezone.utc).date() - _EPOCH).days
+
+
+def _to_date(day: int) -> date:
+    return _EPOCH + timedelta(days=int(day))
@@ -0,0 +1,110 @@
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+from repositories.best_effort_repository import BestEffortRepository
+from services.activity_streams import ActivityStreams
+
+# Segment lengths (meters) to find each run's fastest effort over
+BEST_EFFORT_DISTANCES = {
+    "1K": 1000.0,
+    "5K": 5000.0,
+    "10K": 10000.0,
+    "Half Marathon": 21097.5,
+}
+SPLIT_METERS = 1000.0
+# Activities analyzed per pass, bounding memory for long backfills
+ANALYZE_BATCH_SIZE = 500
+
+
+def best_effort(
+    distance: np.ndarray, elapsed: np.ndarray, length: float
+) -> Optional[float]:
+    """Fastest time in seconds to cover `length` meters anywhere in a run.
+
+    For every sample taken as the end of a window, the window start is the
+    point `length` meters earlier. Distance never decreases, so the starts
+    advance monotonically with the ends; they are found for all ends at once
+    with one vectorized search, and the start time is interpolated between
+    the two samples around it. None if the run is shorter than `length`.
+    """
+    if len(distance) < 2 or distance[-1] - distance[0] < length:
+        return None
+
+    ends = np.flatnonzero(distance - distance[0] >= length)
+    targets = distance[ends] - length
+    # Last sample at or before each window start
+    starts = np.searchsorted(distance, targets, side="right") - 1
+
+    gap = distance[starts + 1] - distance[starts]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        fraction = np.where(gap > 0, (targets - distance[starts]) / gap, 0.0)
+    start_times = elapsed[starts] + fraction * (elapsed[starts + 1] - elapsed[starts])
+
+    return float(np.min(elapsed[ends] - start_times))
+
+
+def km_splits(distance: np.ndarray, elapsed: np.ndarray) -> np.ndarray:
+    """Seconds taken for each whole kilometer of a run"""
+    if len(distance) < 2:
+        return np.empty(0)
+
+    marks = np.arange(1, int((distance[-1] - distance[0]) // SPLIT_METERS) + 1)
+    times = np.interp(distance[0] + marks * SPLIT_METERS, distance, elapsed)
+    return np.diff(times, prepend=elapsed[0])
+
+
+def analyze(streams: ActivityStreams) -> Tuple[Dict[str, float], List[float]]:
+    """An activity's best efforts, by BEST_EFFORT_DISTANCES label, and splits"""
+    if "distance" not in streams or "time" not in streams:
+        return {}, []
+
+    distance = streams["distance"]
+    elapsed = streams["time"].astype(np.float64)
+    # GPS glitches can step distance backwards; searching needs it sorted
+    distance = np.maximum.accumulate(distance)
+
+    efforts = {}
+    for label, length in BEST_EFFORT_DISTANCES.items():
+        seconds = best_effort(distance, elapsed, length)
+        if seconds is not None:
+            efforts[label] = round(seconds, 1)
+
+    splits = [round(float(s), 1) for s in km_splits(distance, elapsed)]
+    return efforts, splits
+
+
+def refresh_best_efforts(db, user_id: str) -> int:
+    """Analyze a user's stored streams that haven't been analyzed yet.
+
+    Results are cached per activity, so each stream is only decoded once and
+    the personal bests are an index lookup afterwards. The caller commits.
+    Returns the number of activities analyzed.
+    """
+    efforts = BestEffortRepository(db)
+    analyzed = 0
+
+    while True:
+        pending = efforts.pending(user_id, ANALYZE_BATCH_SIZE)
+        for row in pending:
+            best, splits = analyze(ActivityStreams(row["data"]))
+            efforts.save(user_id, row["strava_id"], row["start_date"], best, splits)
+        analyzed += len(pending)
+
+        if len(pending) < ANALYZE_BATCH_SIZE:
+            return analyzed
+
+
+def get_personal_bests(
+    db, user_id: str, days: Optional[int] = None
+) -> List[Dict[str, Any]]:
+    """A user's fastest effort per distance, over the last `days` days or all
+    time, in BEST_EFFORT_DISTANCES order"""
+    bests = {
+        row["effort"]: dict(row)
+        for row in BestEffortRepository(db).personal_bests(user_id, days)
+    }
+    return [
+        {**bests[label], "distance": BEST_EFFORT_DISTANCES[label] / 1000}
+        for label in BEST_EFFORT_DISTANCES
+        if label in bests
+    ]
@@ -0,0 +1,117 @@
+from datetime import datetime, timezone
+from typing import Any, Dict, Optional
+
+from repositories.fitness_repository import FitnessRepository
+from services.best_efforts import get_personal_bests
+
+SUMMARY_WINDOWS_WEEKS = (4, 12, 26)
+
+
+def refresh_fitness_summary(db, user_id: str) -> Dict[str, Any]:
+    """Recompute and store a user's fitness summary. The caller commits.
+
+    Every query is an index range scan over one user's recent runs, so this is
+    cheap enough to run after each sync or webhook upsert.
+    """
+    fitness = FitnessRepository(db)
+
+    windows = {}
+    for weeks in SUMMARY_WINDOWS_WEEKS:
+        stats = fitness.window_stats(user_id, weeks * 7)
+        stats["weeks"] = weeks
+        stats["weekly_distance"] = stats["distance"] / weeks
+        stats["runs_per_week"] = stats["runs"] / weeks
+        windows[str(weeks)] = stats
+
+    summary = {
+        "as_of": _today(),
+        "windows": windows,
+        "pace_by_distance": fitness.pace_by_distance(
+            user_id, SUMMARY_WINDOWS_WEEKS[-1] * 7
+        ),
+        "best_efforts": get_personal_bests(db, user_id, SUMMARY_WINDOWS_WEEKS[-1] * 7),
+    }
+    fitness.save_summary(user_id, summary)
+    return summary
+
+
+def get_fitness_summary(db, user_id: str) -> Optional[Dict[str, Any]]:
+    """Return the stored summary, recomputing it if it was made on an earlier day"""
+    summary = FitnessRepository(db).get_summary(user_id)
+    if summary is None or summary["as_of"] != _today():
+        summary = refresh_fitness_summary(db, user_id)
+        db.commit()
+
+    if not summary["windows"][str(SUMMARY_WINDOWS_WEEKS[-1])]["runs"]:
+        return None
+
+    return summary
+
+
+def format_fitness_summary(summary: Optional[Dict[str, Any]]) -> str:
+    """Render a fitness summary as compact text for the coach prompt"""
+    if not summary:
+        return "Running history: no runs in the last 6 months."
+
+    lines = [f"Running history (as of {summary['as_of']}):"]
+
+    for stats in summary["windows"].values():
+        if not stats["runs"]:
+            lines.append(f"- Last {stats['weeks']} weeks: no runs")
+            continue
+
+        line = (
+            f"- Last {stats['weeks']} weeks: {stats['runs']} runs in "
+            f"{stats['active_weeks']} of {stats['weeks']} weeks, "
+            f"{stats['distance']:.0f} km ({stats['weekly_distance']:.1f} km/week, "
+            f"{stats['runs_per_week']:.1f} runs/week), "
+            f"average pace {_format_pace(stats['average_pace'])}, "
+            f"longest run {stats['longest_run']:.1f} km"
+        )
+        if stats["average_heartrate"]:
+            line += f", average heart rate {stats['average_heartrate']:.0f} bpm"
+        lines.append(line)
+
+    if summary["pace_by_distance"]:
+        lines.append("- Pace by run distance (last 26 weeks):")
+        for bucket in summary["pace_by_distance"]:
+            lines.append(
+                f"  - {bucket['bucket']}: {bucket['runs']} runs, average "
+                f"{_format_pace(bucket['average_pace'])}, best "
+                f"{_format_pace(bucket['best_pace'])}"
+            )
+
+    # Missing from summaries stored before best efforts were tracked
+    if summary.get("best_efforts"):
+        lines.append("- Best efforts within runs (last 26 weeks):")
+        for effort in summary["best_efforts"]:
+            lines.append(
+                f"  - {effort['effort']}: {_format_duration(effort['elapsed_time'])} "
+                f"({_format_pace(effort['elapsed_time'] / 60 / effort['distance'])}) "
+                f"on {effort['start_date']}"
+            )
+
+    return "\n".join(lines)
+
+
+def _format_pace(pace: Optional[float]) -> str:
+    """Format a pace in decimal min/km as m:ss min/km"""
+    if not pace:
+        return "n/a"
+
+    minutes, seconds = divmod(round(pace * 60), 60)
+    return f"{minutes}:{seconds:02d} min/km"
+
+
+def _format_duration(seconds: float) -> str:
+    """Format a duration in seconds as h:mm:ss, or m:ss under an hour"""
+    minutes, seconds = divmod(round(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    if hours:
+        return f"{hours}:{minutes:02d}:{seconds:02d}"
+    return f"{minutes}:{seconds:02d}"
+
+
+def _today() -> str:
+    # SQLite's date('now') is UTC, so the summary day is too
+    return datetime.now(timezone.utc).date().isoformat()
@@ -0,0 +1,168 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from datetime import date
+from typing import Any, Dict, Optional
+
+from repositories.plan_cache_repository import PlanCacheRepository
+from services.plan_skeleton import parse_weekday
+
+PLAN_CACHE_TTL_SECONDS = int(os.getenv("PLAN_CACHE_TTL_SECONDS", str(7 * 24 * 3600)))
+PLAN_CACHE_MAX_ENTRIES = int(os.getenv("PLAN_CACHE_MAX_ENTRIES", "1000"))
+
+
+class PlanCache:
+    """SQLite-backed cache of generated plans with TTL and LRU eviction.
+
+    Keys hash the normalized request (goals, preferences and message), the
+    ISO week it was made in and a coarsened fitness summary, so resubmitting
+    the same goal, or one that differs only in formatting, is served from the
+    cache. Keys are scoped per user.
+    """
+
+    def __init__(
+        self,
+        ttl_seconds: int = PLAN_CACHE_TTL_SECONDS,
+        max_entries: int = PLAN_CACHE_MAX_ENTRIES,
+    ):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def make_key(
+        self,
+        user_id: Optional[str],
+        message: str,
+        preferences: Optional[dict],
+        goals: Optional[dict],
+        summary: Optional[Dict[str, Any]],
+        today: Optional[date] = None,
+    ) -> str:
+        year, week, _ = (today or date.today()).isocalendar()
+        payload = {
+            "user_id": user_id,
+            "message": _normalize_text(message),
+            "preferences": _normalize_preferences(preferences),
+            "goals": _normalize_goals(goals),
+            "week": f"{year}-W{week:02d}",
+            "fitness": _coarsen_summary(summary),
+        }
+        encoded = json.dumps(payload, sort_keys=True, separators=(",", ":"))
+        return hashlib.sha256(encoded.encode()).hexdigest()
+
+    def get(self, db, cache_key: str) -> Optional[int]:
+        """Return the id of the cached plan, if any"""
+        cache = PlanCacheRepository(db)
+        now = int(time.time())
+        entry = cache.get(cache_key)
+
+        if entry and entry["created_at"] < now - self.ttl_seconds:
+            cache.delete(cache_key)
+            db.commit()
+            entry = None
+
+        if entry is None:
+            self._count(hit=False)
+            return None
+
+        cache.touch(cache_key, now)
+        db.commit()
+        self._count(hit=True)
+        return entry["plan_id"]
+
+    def put(self, db, cache_key: str, user_id: Optional[str], plan_id: int) -> None:
+        cache = PlanCacheRepository(db)
+        now = int(time.time())
+        cache.put(cache_key, user_id, plan_id, now)
+        cache.delete_expired(now - self.ttl_seconds)
+        cache.evict_least_recently_used(self.max_entries)
+        db.commit()
+
+    def stats(self, db) -> Dict[str, Any]:
+        with self._lock:
+            hits, misses = self.hits, self.misses
+
+        lookups = hits + misses
+        return {
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": round(hits / lookups, 3) if lookups else None,
+            "entries": PlanCacheRepository(db).count(),
+            "max_entries": self.max_entries,
+            "ttl_seconds": self.ttl_seconds,
+        }
+
+    def _count(self, hit: bool) -> None:
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+
+def _normalize_text(value: Any) -> str:
+    return " ".join(str(value or "").lower().split())
+
+
+def _normalize_preferences(preferences: Optional[dict]) -> Optional[dict]:
+    if not preferences:
+        return None
+
+    days = {parse_weekday(day) for day in preferences.get("availableDays", [])}
+    return {
+        "long_run_day": parse_weekday(preferences.get("preferredLongRunDay")),
+        "strength_training": bool(preferences.get("strengthTraining")),
+        "available_days": sorted(day for day in days if day is not None),
+    }
+
+
+def _normalize_goals(goals: Optional[dict]) -> Optional[dict]:
+    if not goals:
+        return None
+
+    try:
+        target = round(float(goals.get("target")), 2)
+    except (TypeError, ValueError):
+        target = _normalize_text(goals.get("target"))
+
+    return {
+        "type": _normalize_text(goals.get("type")),
+        "target": target,
+        "goal_time": _normalize_goal_time(goals.get("goalTime")),
+        "end_date": _normalize_text(goals.get("endDate")),
+        "notes": _normalize_text(goals.get("notes")),
+    }
+
+
+def _normalize_goal_time(value: Any) -> str:
+    """Normalize h:mm:ss style goal times so 3:30:00 and 03:30:00 match"""
+    parts = str(value or "").strip().split(":")
+    try:
+        return ":".join(f"{int(part):02d}" for part in parts)
+    except ValueError:
+        return _normalize_text(value)
+
+
+def _coarsen_summary(summary: Optional[Dict[str, Any]]) -> Optional[dict]:
+    """Round fitness figures so day-to-day noise doesn't change the key"""
+    if not summary:
+        return None
+
+    windows = {}
+    for weeks, stats in summary["windows"].items():
+        windows[weeks] = {
+            "weekly_distance": round((stats["weekly_distance"] or 0) / 5) * 5,
+            "runs_per_week": round(stats["runs_per_week"] or 0),
+            "average_pace": round(stats["average_pace"] or 0, 1),
+            "longest_run": round(stats["longest_run"] or 0),
+        }
+    if summary.get("best_efforts"):
+        windows["best_efforts"] = {
+            effort["effort"]: round(effort["elapsed_time"] / 10) * 10
+            for effort in summary["best_efforts"]
+        }
+    return windows
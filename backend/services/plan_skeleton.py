@@ -0,0 +1,561 @@
+import html
+import math
+from datetime import date, timedelta
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from models.training_plan import PlanSession, PlanWeek, TrainingPlan
+
+MAX_PLAN_WEEKS = 16
+WEEKDAYS = [
+    "Monday",
+    "Tuesday",
+    "Wednesday",
+    "Thursday",
+    "Friday",
+    "Saturday",
+    "Sunday",
+]
+# Used when no preferences were saved
+DEFAULT_DAYS = [1, 3, 5, 6]
+DEFAULT_LONG_RUN_DAY = 6
+DEFAULT_RACE_KM = 10.0
+
+# Typical weekly volume (km) for runners with no recent history, and the peak
+# weekly volume and long run the plan builds towards, by race distance
+STARTING_VOLUME = [(5, 15), (10, 20), (21.1, 25), (math.inf, 30)]
+PEAK_VOLUME = [(5, 35), (10, 45), (21.1, 55), (math.inf, 70)]
+PEAK_LONG_RUN = [(5, 10), (10, 14), (21.1, 19), (42.2, 32), (math.inf, 38)]
+TAPER_WEEKS = [(10, 1), (math.inf, 2)]
+# Most a single run day can carry, so short schedules aren't overloaded
+MAX_KM_PER_RUN_DAY = 15
+WEEKLY_GROWTH = 1.1
+CUTBACK_EVERY = 4
+CUTBACK_FACTOR = 0.8
+MIN_RUN_KM = 3
+STRENGTH_MINUTES = {"base": 45, "build": 50, "peak": 45, "taper": 30}
+
+CELL_CLASSES = {
+    "rest": "rest-day",
+    "long": "long-run",
+    "quality": "speed-work",
+    "strength": "strength",
+    "race": "race-day",
+}
+
+
+def build_skeleton(
+    goals: Optional[dict],
+    preferences: Optional[dict],
+    summary: Optional[Dict[str, Any]] = None,
+    today: Optional[date] = None,
+    skip_weeks: Iterable[int] = (),
+    baseline: Optional[TrainingPlan] = None,
+) -> TrainingPlan:
+    """Lay out a periodized plan (base, build, peak and taper) from the goal,
+    preferences and fitness summary.
+
+    Every week puts a session on each available day and nowhere else, with
+    the long run on the preferred day, so the hard constraints always hold.
+    Skipped weeks are rest weeks and the week after one is eased back into.
+    Passing a baseline plan reuses its start date and starting fitness, so
+    the same inputs lay out the same weeks.
+    """
+    goals = goals or {}
+    today = baseline.start_date if baseline else today or date.today()
+    skip_weeks = set(skip_weeks)
+
+    race_km = _race_distance(goals)
+    race_date = _parse_date(goals.get("endDate"))
+    if race_date is not None and race_date < today:
+        race_date = None
+
+    # Plans start next Monday, unless the race comes first
+    start = today + timedelta(days=-today.weekday() % 7)
+    if race_date is not None and race_date < start:
+        start = today - timedelta(days=today.weekday())
+
+    weeks = MAX_PLAN_WEEKS
+    race_in_plan = False
+    if race_date is not None:
+        race_week = (race_date - start).days // 7 + 1
+        if race_week <= MAX_PLAN_WEEKS:
+            weeks = race_week
+            race_in_plan = True
+
+    days, long_day, strength = _schedule_days(preferences)
+    strength_day = _farthest_day(days, long_day, exclude=[long_day])
+    if not strength or strength_day is None:
+        strength_day = None
+    run_days = [day for day in days if day != strength_day]
+    quality_day = _farthest_day(run_days, long_day, exclude=[long_day])
+
+    phases = _phases(weeks, race_km, race_in_plan)
+    ramp_weeks = sum(1 for phase in phases if phase in ("base", "build"))
+
+    recent = (summary or {}).get("windows", {}).get("4") or {}
+    if baseline and baseline.base_volume:
+        recent = {
+            "weekly_distance": baseline.base_volume,
+            "longest_run": baseline.base_long_run,
+            "average_pace": baseline.easy_pace,
+        }
+    base_volume = recent.get("weekly_distance") or _by_distance(
+        STARTING_VOLUME, race_km
+    )
+    start_volume = max(base_volume, MIN_RUN_KM * len(run_days))
+    peak_volume = min(
+        _by_distance(PEAK_VOLUME, race_km),
+        MAX_KM_PER_RUN_DAY * len(run_days),
+        start_volume * WEEKLY_GROWTH ** max(ramp_weeks, 1),
+    )
+    peak_volume = max(peak_volume, start_volume)
+
+    base_long = recent.get("longest_run") or start_volume * 0.3
+    start_long = base_long
+    peak_long = max(_by_distance(PEAK_LONG_RUN, race_km), start_long)
+    start_long = min(start_long, peak_long)
+
+    race_pace = _goal_pace(goals, race_km)
+    # Durations assume easy running at the recent average pace
+    easy_pace = recent.get("average_pace") or (race_pace and race_pace * 1.15)
+    plan_weeks = []
+    for index, phase in enumerate(phases):
+        factor = _volume_factor(phases, index, ramp_weeks)
+        if index in skip_weeks:
+            # Ease back in after a week away
+            factor = min(factor, CUTBACK_FACTOR)
+        progress = min(index / max(ramp_weeks, 1), 1.0)
+        volume = (start_volume + (peak_volume - start_volume) * progress) * factor
+        long_run = (start_long + (peak_long - start_long) * progress) * factor
+
+        is_race_week = race_in_plan and index == weeks - 1
+        if index + 1 in skip_weeks and not is_race_week:
+            sessions = [
+                _session("rest", None, ["Rest", "(week off)"]) for _ in WEEKDAYS
+            ]
+        else:
+            sessions = _week_sessions(
+                week=index + 1,
+                phase=phase,
+                days=days,
+                long_day=long_day,
+                strength_day=strength_day,
+                quality_day=quality_day,
+                volume=volume,
+                long_run=long_run,
+                race_km=race_km,
+                race_pace=race_pace,
+                race_day=race_date.weekday() if is_race_week else None,
+            )
+        for session in sessions:
+            if session.distance and session.duration is None:
+                pace = race_pace if session.type == "race" else easy_pace
+                session.duration = round(session.distance * pace) if pace else None
+
+        plan_weeks.append(
+            PlanWeek(
+                week=index + 1,
+                phase=phase,
+                start_date=start + timedelta(weeks=index),
+                distance=round(sum(s.distance or 0 for s in sessions), 1),
+                days=sessions,
+            )
+        )
+
+    return TrainingPlan(
+        start_date=start,
+        race_date=race_date if race_in_plan else None,
+        race_distance=race_km,
+        goal_pace=race_pace,
+        available_days=[WEEKDAYS[day] for day in days],
+        long_run_day=WEEKDAYS[long_day],
+        strength_day=WEEKDAYS[strength_day] if strength_day is not None else None,
+        base_volume=base_volume,
+        base_long_run=base_long,
+        easy_pace=easy_pace or None,
+        skipped_weeks=sorted(week for week in skip_weeks if week <= weeks),
+        weeks=plan_weeks,
+    )
+
+
+def revise_skeleton(
+    plan: TrainingPlan,
+    goals: Optional[dict],
+    preferences: Optional[dict],
+    skip_weeks: Iterable[int],
+    from_week: int,
+) -> Tuple[TrainingPlan, List[int]]:
+    """Re-lay a plan after a change to its goal, preferences or skipped weeks.
+
+    Weeks before from_week are kept as they were. Returns the revised plan
+    and the numbers of the weeks that changed.
+    """
+    rebuilt = build_skeleton(goals, preferences, skip_weeks=skip_weeks, baseline=plan)
+    keep = min(max(from_week, 1) - 1, len(rebuilt.weeks))
+    weeks = plan.weeks[:keep] + rebuilt.weeks[keep:]
+
+    revised = [
+        week.week
+        for week in weeks[keep:]
+        if week.week > len(plan.weeks) or week != plan.weeks[week.week - 1]
+    ]
+    return rebuilt.model_copy(update={"weeks": weeks}), revised
+
+
+def describe_weeks(plan: TrainingPlan, numbers: List[int]) -> str:
+    """List the sessions of the given weeks, one line per week"""
+    lines = []
+    for week in plan.weeks:
+        if week.week not in numbers:
+            continue
+        sessions = [
+            f"{WEEKDAYS[day][:3]} {' '.join(session.description)}"
+            for day, session in enumerate(week.days)
+            if session.type != "rest"
+        ]
+        lines.append(
+            f"Week {week.week} ({week.phase}, {week.distance:g} km): "
+            + ("; ".join(sessions) or "rest")
+        )
+    return "\n".join(lines)
+
+
+def describe_plan(plan: TrainingPlan) -> str:
+    """Summarize a plan in a few lines for the coach prompt"""
+    weeks = plan.weeks
+    start = plan.start_date
+
+    phases = []
+    for phase in ("base", "build", "peak", "taper"):
+        numbers = [w.week for w in weeks if w.phase == phase]
+        if numbers:
+            span = (
+                f"{numbers[0]}" if len(numbers) == 1 else f"{numbers[0]}-{numbers[-1]}"
+            )
+            phases.append(f"{phase} week{'s' if len(numbers) > 1 else ''} {span}")
+
+    distances = [w.distance for w in weeks]
+    long_runs = [s.distance for w in weeks for s in w.days if s.type == "long"] or [0]
+
+    lines = [
+        f"Plan: {len(weeks)} weeks starting {start.strftime('%A, %B %d, %Y')} "
+        f"({', '.join(phases)}).",
+        f"Runs on {', '.join(plan.available_days)}, long runs on "
+        f"{plan.long_run_day}"
+        + (
+            f", strength training on {plan.strength_day}."
+            if plan.strength_day
+            else ", no strength training."
+        ),
+        f"Weekly volume {distances[0]:g} km in week 1, peaking at {max(distances):g} km; "
+        f"long run {long_runs[0]:g} km in week 1, peaking at {max(long_runs):g} km.",
+    ]
+    if plan.race_date:
+        lines.append(
+            f"Race: {_race_label(plan.race_distance).lower()} of "
+            f"{plan.race_distance:g} km on {plan.race_date.strftime('%A, %B %d, %Y')}."
+        )
+    else:
+        lines.append("The goal date is beyond the plan, so there is no taper yet.")
+    if plan.goal_pace:
+        lines.append(f"Goal pace: {_format_pace(plan.goal_pace)}.")
+
+    return "\n".join(lines)
+
+
+def render_plan_html(plan: TrainingPlan) -> str:
+    """Render a plan as the week-by-day HTML table shown to the user"""
+    header = "".join(f"<th>{day}</th>" for day in WEEKDAYS)
+    rows = []
+    for week in plan.weeks:
+        cells = []
+        for session in week.days:
+            classes = CELL_CLASSES.get(session.type)
+            if week.phase == "taper" and session.type in (
+                "easy",
+                "quality",
+                "long",
+            ):
+                classes = "taper"
+            text = "<br>".join(html.escape(line) for line in session.description)
+            attribute = f' class="{classes}"' if classes else ""
+            cells.append(f"<td{attribute}>{text}</td>")
+        rows.append(f"<tr><td>{week.week}</td>{''.join(cells)}</tr>")
+
+    return (
+        f"<table><thead><tr><th>Week</th>{header}</tr></thead>"
+        f"<tbody>{''.join(rows)}</tbody></table>"
+    )
+
+
+def parse_weekday(value: Any) -> Optional[int]:
+    """Map day names and abbreviations (Mon, Tues, Thurs, ...) to 0-6"""
+    text = str(value or "").strip().lower()
+    if len(text) < 2:
+        return None
+    for index, name in enumerate(WEEKDAYS):
+        if name.lower().startswith(text[:3]):
+            return index
+    return None
+
+
+def _schedule_days(preferences: Optional[dict]):
+    preferences = preferences or {}
+    days = sorted(
+        {
+            day
+            for day in map(parse_weekday, preferences.get("availableDays") or [])
+            if day is not None
+        }
+    )
+    if not days:
+        days = list(DEFAULT_DAYS)
+
+    long_day = parse_weekday(preferences.get("preferredLongRunDay"))
+    if long_day not in days:
+        long_day = DEFAULT_LONG_RUN_DAY if DEFAULT_LONG_RUN_DAY in days else days[-1]
+
+    # Strength needs its own day, so it's dropped for single-day schedules
+    strength = bool(preferences.get("strengthTraining")) and len(days) > 1
+    return days, long_day, strength
+
+
+def _farthest_day(days: List[int], anchor: int, exclude: List[int]) -> Optional[int]:
+    """The day furthest (around the week) from the anchor day, earliest first"""
+    candidates = [day for day in days if day not in exclude]
+    if not candidates:
+        return None
+    return max(candidates, key=lambda day: (_day_gap(day, anchor), -day))
+
+
+def _day_gap(a: int, b: int) -> int:
+    gap = abs(a - b) % 7
+    return min(gap, 7 - gap)
+
+
+def _phases(weeks: int, race_km: float, race_in_plan: bool) -> List[str]:
+    taper = min(_by_distance(TAPER_WEEKS, race_km), weeks) if race_in_plan else 0
+    training = weeks - taper
+    peak = max(1, round(training * 0.15)) if training >= 3 else 0
+    base = round((training - peak) * 0.45) if training >= 3 else training
+    build = training - peak - base
+    return ["base"] * base + ["build"] * build + ["peak"] * peak + ["taper"] * taper
+
+
+def _volume_factor(phases: List[str], index: int, ramp_weeks: int) -> float:
+    phase = phases[index]
+    if phase == "taper":
+        taper_weeks = phases.count("taper")
+        position = index - phases.index("taper") + 1
+        return 1 - 0.5 * position / taper_weeks
+    # Ease off every few weeks to absorb the training, but never right
+    # before the peak
+    if (
+        phase in ("base", "build")
+        and (index + 1) % CUTBACK_EVERY == 0
+        and index + 1 < ramp_weeks
+    ):
+        return CUTBACK_FACTOR
+    return 1.0
+
+
+def _week_sessions(
+    week: int,
+    phase: str,
+    days: List[int],
+    long_day: int,
+    strength_day: Optional[int],
+    quality_day: Optional[int],
+    volume: float,
+    long_run: float,
+    race_km: float,
+    race_pace: Optional[float],
+    race_day: Optional[int],
+) -> List[PlanSession]:
+    sessions = [_session("rest", None, ["Rest"]) for _ in WEEKDAYS]
+
+    # In race week the race replaces the long run and nothing follows it
+    if race_day is not None:
+        days = [day for day in days if day < race_day]
+        long_day = None
+
+    run_days = [day for day in days if day != strength_day]
+    long_km = 0
+    if long_day is not None and long_day in run_days:
+        others = len(run_days) - 1
+        if others:
+            # The long run is never shorter than an even share of the week
+            long_run = max(long_run, volume / len(run_days))
+            long_run = min(long_run, volume - MIN_RUN_KM * others)
+        else:
+            long_run = max(long_run, volume)
+        long_km = max(round(long_run), MIN_RUN_KM)
+        sessions[long_day] = _session(
+            "long", long_km, [f"{long_km} km Long Run"], "easy"
+        )
+
+    other_days = [day for day in run_days if day != long_day]
+    if other_days:
+        weights = {day: 1.2 if day == quality_day else 1.0 for day in other_days}
+        remaining = max(volume - long_km - (race_km if race_day is not None else 0), 0)
+        for day in other_days:
+            km = max(
+                round(remaining * weights[day] / sum(weights.values())), MIN_RUN_KM
+            )
+            if day == quality_day and race_day is None:
+                sessions[day] = _quality_session(week, phase, km, race_km, race_pace)
+            elif race_day is not None and day == max(other_days):
+                km = min(km, 5)
+                sessions[day] = _session(
+                    "easy", km, [f"{km} km Easy", "+ 4×100m strides"], "easy"
+                )
+            else:
+                sessions[day] = _session("easy", km, [f"{km} km Easy"], "easy")
+
+    if strength_day is not None and strength_day in days:
+        minutes = 20 if race_day is not None else STRENGTH_MINUTES[phase]
+        sessions[strength_day] = _session(
+            "strength",
+            None,
+            ["Strength Training", f"({minutes} min)"],
+            "moderate",
+            minutes,
+        )
+
+    if race_day is not None:
+        label = _race_label(race_km)
+        sessions[race_day] = _session(
+            "race", race_km, [label, f"{race_km:g} km"], "race"
+        )
+
+    return sessions
+
+
+def _quality_session(
+    week: int, phase: str, km: int, race_km: float, race_pace: Optional[float]
+) -> PlanSession:
+    easy = 2 if km < 8 else 3
+    work = max(km - easy, 1)
+
+    if phase == "base":
+        if week % 2:
+            return _session(
+                "quality", km, [f"{km} km Easy", "+ 6×100m strides"], "moderate"
+            )
+        reps = min(max(work * 2, 6), 10)
+        return _session(
+            "quality",
+            km,
+            [f"Hills: {reps}×200m", "hill repeats", f"+ {easy} km Easy"],
+            "hard",
+        )
+
+    if phase == "build" and week % 2:
+        rep = 400 if race_km <= 5 else 800 if race_km <= 21.1 else 1000
+        reps = min(max(round(work * 1000 / (rep * 2)), 4), 12)
+        pace = "5K pace" if rep < 1000 else "10K pace"
+        return _session(
+            "quality",
+            km,
+            [f"Speed: {reps}×{rep}m", f"@ {pace}", f"+ {easy} km Easy"],
+            "hard",
+        )
+
+    if phase == "build":
+        return _session(
+            "quality",
+            km,
+            [f"Tempo: {work} km", f"@ {_tempo_pace(race_km)}", f"+ {easy} km Easy"],
+            "moderate",
+        )
+
+    target = (
+        f"@ goal pace ({_format_pace(race_pace)})"
+        if race_pace
+        else f"@ {_race_label(race_km).title()} pace"
+    )
+    # Race pace work is capped well short of the race itself
+    work = min(work, max(round(race_km * 0.6), 2))
+    if phase == "taper":
+        work = max(work // 2, 1)
+    return _session(
+        "quality", km, [f"Race pace: {work} km", target, f"+ {easy} km Easy"], "race"
+    )
+
+
+def _session(
+    kind: str,
+    distance: Optional[float],
+    description: List[str],
+    intensity: Optional[str] = None,
+    duration: Optional[int] = None,
+) -> PlanSession:
+    return PlanSession(
+        type=kind,
+        distance=distance,
+        duration=duration,
+        intensity=intensity,
+        description=description,
+    )
+
+
+def _race_distance(goals: dict) -> float:
+    try:
+        target = float(goals.get("target"))
+    except (TypeError, ValueError):
+        target = 0
+    if target > 0:
+        return target
+
+    kind = str(goals.get("type") or "").lower().replace(" ", "")
+    return {"5k": 5.0, "10k": 10.0, "halfmarathon": 21.1, "marathon": 42.2}.get(
+        kind, DEFAULT_RACE_KM
+    )
+
+
+def _race_label(race_km: float) -> str:
+    if abs(race_km - 42.2) < 0.5:
+        return "MARATHON"
+    if abs(race_km - 21.1) < 0.5:
+        return "HALF MARATHON"
+    return "RACE"
+
+
+def _tempo_pace(race_km: float) -> str:
+    if race_km > 21.1 + 0.5:
+        return "Marathon pace"
+    if race_km > 10:
+        return "Half Marathon pace"
+    return "Threshold pace"
+
+
+def _goal_pace(goals: dict, race_km: float) -> Optional[float]:
+    """Goal pace in decimal min/km from an h:mm:ss goal time"""
+    parts = str(goals.get("goalTime") or "").split(":")
+    try:
+        seconds = sum(int(part) * 60**i for i, part in enumerate(reversed(parts)))
+    except ValueError:
+        return None
+    if seconds <= 0 or race_km <= 0:
+        return None
+    return seconds / 60 / race_km
+
+
+def _format_pace(pace: float) -> str:
+    minutes, seconds = divmod(round(pace * 60), 60)
+    return f"{minutes}:{seconds:02d} min/km"
+
+
+def _by_distance(table, race_km: float):
+    """Look up the first row of a (max distance, value) table that fits"""
+    for limit, value in table:
+        if race_km <= limit + 0.5:
+            return value
+    return table[-1][1]
+
+
+def _parse_date(value: Any) -> Optional[date]:
+    try:
+        return date.fromisoformat(str(value)[:10])
+    except ValueError:
+        return None
@@ -0,0 +1,229 @@
+import os
+import re
+import sqlite3
+import time
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+import database
+
+QUERY_TIMEOUT_SECONDS = float(os.getenv("QUERY_TIMEOUT_SECONDS", "2"))
+QUERY_MAX_ROWS = int(os.getenv("QUERY_MAX_ROWS", "100"))
+# SQLite virtual machine steps between timeout checks
+PROGRESS_STEPS = 10_000
+
+# Columns of the per-user workouts view; user_id is implied
+WORKOUT_COLUMNS = (
+    "strava_id",
+    "name",
+    "distance",
+    "moving_time",
+    "total_elevation_gain",
+    "type",
+    "start_date",
+    "average_pace",
+    "average_heartrate",
+    "max_heartrate",
+)
+
+# Whitelisted metrics over the user's runs in the last :days days
+CANNED_METRICS = {
+    "summary": (
+        "Run count, total and longest distance (km), average pace (min/km) "
+        "and average heart rate",
+        """
+        SELECT COUNT(*) AS runs, ROUND(SUM(distance), 1) AS distance,
+            ROUND(MAX(distance), 1) AS longest_run,
+            ROUND(AVG(average_pace), 2) AS average_pace,
+            ROUND(AVG(average_heartrate)) AS average_heartrate
+        FROM workouts
+        WHERE type = 'Run' AND start_date >= date('now', :since)
+        """,
+    ),
+    "weekly_distance": (
+        "Distance (km) and run count per week",
+        """
+        SELECT strftime('%Y-%W', start_date) AS week, COUNT(*) AS runs,
+            ROUND(SUM(distance), 1) AS distance
+        FROM workouts
+        WHERE type = 'Run' AND start_date >= date('now', :since)
+        GROUP BY week ORDER BY week
+        """,
+    ),
+    "monthly_pace": (
+        "Average pace (min/km) and distance (km) per month",
+        """
+        SELECT strftime('%Y-%m', start_date) AS month, COUNT(*) AS runs,
+            ROUND(AVG(average_pace), 2) AS average_pace,
+            ROUND(SUM(distance), 1) AS distance
+        FROM workouts
+        WHERE type = 'Run' AND start_date >= date('now', :since)
+        GROUP BY month ORDER BY month
+        """,
+    ),
+    "longest_runs": (
+        "The 5 longest runs with their date, distance (km) and pace (min/km)",
+        """
+        SELECT date(start_date) AS date, ROUND(distance, 1) AS distance,
+            ROUND(average_pace, 2) AS average_pace
+        FROM workouts
+        WHERE type = 'Run' AND start_date >= date('now', :since)
+        ORDER BY distance DESC LIMIT 5
+        """,
+    ),
+    "fastest_runs": (
+        "The 5 fastest runs of at least 3 km with their date, distance (km) "
+        "and pace (min/km)",
+        """
+        SELECT date(start_date) AS date, ROUND(distance, 1) AS distance,
+            ROUND(average_pace, 2) AS average_pace
+        FROM workouts
+        WHERE type = 'Run' AND distance >= 3 AND average_pace > 0
+            AND start_date >= date('now', :since)
+        ORDER BY average_pace LIMIT 5
+        """,
+    ),
+}
+
+# Unqualified names resolve to temp objects first, so qualifying a name with
+# the main schema (quoted or not) is the only way past the per-user view
+_MAIN_SCHEMA = re.compile(r"[\"`\[]?\bmain\b[\"`\]]?\s*\.", re.IGNORECASE)
+
+# A query plan step reading every row of its source: a scan, or a search of
+# the view on nothing narrower than the user_id it is restricted to
+_FULL_PASS = re.compile(r"^SCAN |^SEARCH .*\(user_id=\?\)$")
+
+
+class QueryRejectedError(ValueError):
+    """Raised when a query is not allowed or exceeds its limits"""
+
+
+class ReadOnlyQueryExecutor:
+    """Runs model-written SELECTs against one user's workouts.
+
+    Each query gets its own read-only connection on which `workouts` is a
+    temporary view over the user's rows. An authorizer denies every other
+    table, pragma and write. Queries are rejected up front if their plan
+    reads the whole history once per row, as a cross join does, interrupted
+    after a time limit and cut off at a row cap, so a bad query can't stall
+    a worker or flood the prompt.
+    """
+
+    def __init__(
+        self,
+        path: Optional[Path] = None,
+        timeout: float = QUERY_TIMEOUT_SECONDS,
+        max_rows: int = QUERY_MAX_ROWS,
+    ):
+        self.path = path
+        self.timeout = timeout
+        self.max_rows = max_rows
+
+    def execute(
+        self, user_id: str, query: str, params: Optional[Dict[str, Any]] = None
+    ) -> Dict[str, Any]:
+        """Run a single SELECT and return its columns, rows and whether the
+        rows were truncated at the cap"""
+        if not query.strip().lower().startswith(("select", "with")):
+            raise QueryRejectedError("Only SELECT queries are allowed.")
+        if _MAIN_SCHEMA.search(query):
+            raise QueryRejectedError("Query the workouts table without a schema.")
+
+        conn = self._connect(user_id)
+        try:
+            self._check_plan(conn, query, params or {})
+
+            deadline = time.monotonic() + self.timeout
+            conn.set_progress_handler(
+                lambda: time.monotonic() > deadline, PROGRESS_STEPS
+            )
+            try:
+                cursor = conn.execute(query, params or {})
+                rows = cursor.fetchmany(self.max_rows + 1)
+            except sqlite3.OperationalError as e:
+                if "interrupted" in str(e):
+                    raise QueryRejectedError(
+                        f"Query took longer than {self.timeout:g} seconds."
+                    )
+                raise QueryRejectedError(str(e))
+            except sqlite3.DatabaseError as e:
+                raise QueryRejectedError(str(e))
+
+            return {
+                "columns": [column[0] for column in cursor.description or []],
+                "rows": [tuple(row) for row in rows[: self.max_rows]],
+                "truncated": len(rows) > self.max_rows,
+            }
+        finally:
+            conn.close()
+
+    def metric(self, user_id: str, name: str, days: int) -> Dict[str, Any]:
+        """Run one of the CANNED_METRICS over the last `days` days"""
+        if name not in CANNED_METRICS:
+            raise QueryRejectedError(
+                f"Unknown metric {name!r}. Choose one of: {', '.join(CANNED_METRICS)}."
+            )
+        days = min(max(int(days), 1), 3650)
+        return self.execute(
+            user_id, CANNED_METRICS[name][1], {"since": f"-{days} days"}
+        )
+
+    def _connect(self, user_id: str) -> sqlite3.Connection:
+        path = self.path or database.path_for(user_id)
+        conn = sqlite3.connect(
+            f"{Path(path).as_uri()}?mode=ro", uri=True, check_same_thread=False
+        )
+        # Temp objects shadow main ones, so `workouts` resolves to the view
+        conn.execute(
+            f"CREATE TEMP VIEW workouts AS SELECT {', '.join(WORKOUT_COLUMNS)} "
+            "FROM main.workouts WHERE user_id = " + _quote(user_id)
+        )
+        conn.execute("PRAGMA query_only = ON")
+        conn.set_authorizer(_authorize)
+        return conn
+
+    def _check_plan(self, conn: sqlite3.Connection, query: str, params: dict) -> None:
+        try:
+            plan = conn.execute(f"EXPLAIN QUERY PLAN {query}", params).fetchall()
+        except sqlite3.DatabaseError as e:
+            raise QueryRejectedError(str(e))
+
+        # One pass over the user's history is fine. A full pass repeated for
+        # every row of another, as the inner loop of a join or in a
+        # correlated subquery, is quadratic: a few cross joins won't finish.
+        repeated = {0: False}
+        accessed = set()
+        for step_id, parent, _, detail in plan:
+            access = detail.startswith(("SCAN ", "SEARCH "))
+            # A table read after another at the same level is a join's inner
+            # loop
+            nested = repeated.get(parent, False) or (access and parent in accessed)
+            if access and nested and _FULL_PASS.match(detail):
+                raise QueryRejectedError(
+                    "Query would read every workout once per row of another "
+                    "table; join on strava_id or filter the inner table instead."
+                )
+            repeated[step_id] = nested or detail.startswith("CORRELATED ")
+            if access:
+                accessed.add(parent)
+
+
+def _authorize(action, table, column, db_name, source) -> int:
+    if action in (
+        sqlite3.SQLITE_SELECT,
+        sqlite3.SQLITE_FUNCTION,
+        sqlite3.SQLITE_RECURSIVE,
+    ):
+        return sqlite3.SQLITE_OK
+    if action == sqlite3.SQLITE_READ and db_name is None:
+        # A CTE rather than a table
+        return sqlite3.SQLITE_OK
+    if action == sqlite3.SQLITE_READ and table == "workouts":
+        # The view itself, or main.workouts when read through the view
+        if db_name == "temp" or source == "workouts":
+            return sqlite3.SQLITE_OK
+    return sqlite3.SQLITE_DENY
+
+
+def _quote(value: str) -> str:
+    return "'" + str(value).replace("'", "''") + "'"
@@ -0,0 +1,214 @@
+import asyncio
+import os
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Mapping, Optional, Tuple
+
+SHORT_WINDOW_SECONDS = 15 * 60
+
+STRAVA_RATE_LIMIT_SHORT = int(os.getenv("STRAVA_RATE_LIMIT_SHORT", "100"))
+STRAVA_RATE_LIMIT_DAILY = int(os.getenv("STRAVA_RATE_LIMIT_DAILY", "1000"))
+
+
+class StravaAPIError(Exception):
+    """Raised when the Strava API returns an error response"""
+
+    def __init__(self, message: str, status_code: Optional[int] = None):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class StravaRateLimitError(StravaAPIError):
+    """Raised when the Strava rate limit budget is exhausted"""
+
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message, status_code=429)
+        self.retry_after = retry_after
+
+
+class StravaRateLimiter:
+    """Token bucket shared by every outgoing Strava call, across all users.
+
+    Tokens refill continuously at the 15-minute limit spread over the window,
+    so bursts from several concurrent syncs are smoothed rather than draining
+    the budget in the first seconds. The bucket is kept in line with Strava's
+    X-RateLimit-* (and stricter X-ReadRateLimit-*) response headers, which
+    report the real usage shared with any other process using the same app.
+    Callers queue in FIFO order on an asyncio lock while waiting for a token.
+    """
+
+    def __init__(
+        self,
+        short_limit: int = STRAVA_RATE_LIMIT_SHORT,
+        daily_limit: int = STRAVA_RATE_LIMIT_DAILY,
+    ):
+        self.short_limit = short_limit
+        self.daily_limit = daily_limit
+        self.short_usage = 0
+        self.daily_usage = 0
+        self.tokens = float(short_limit)
+        self.throttled_requests = 0
+        self.rate_limited_responses = 0
+        self._refilled_at = time.monotonic()
+        self._short_window = self._short_window_start(_utcnow())
+        self._day = _utcnow().date()
+        self._blocked_until = 0.0
+        self._lock = asyncio.Lock()
+
+    async def acquire(self, max_wait: Optional[float] = None) -> None:
+        """Wait for a request slot.
+
+        Raises StravaRateLimitError if the daily budget is spent or the wait,
+        including the time queued behind other callers, would exceed
+        max_wait seconds.
+        """
+        deadline = None if max_wait is None else time.monotonic() + max_wait
+        try:
+            await asyncio.wait_for(self._lock.acquire(), max_wait)
+        except asyncio.TimeoutError:
+            raise StravaRateLimitError(
+                "Strava 15-minute rate limit reached", max_wait or 0.0
+            )
+
+        try:
+            while True:
+                self._roll_windows()
+
+                if self.daily_usage >= self.daily_limit:
+                    raise StravaRateLimitError(
+                        "Strava daily rate limit reached", self.seconds_until_reset()
+                    )
+
+                if self.short_usage >= self.short_limit:
+                    wait = self._seconds_until_short_reset()
+                else:
+                    wait = self._blocked_until - time.monotonic()
+
+                if wait <= 0:
+                    self._refill()
+                    if self.tokens >= 1:
+                        self.tokens -= 1
+                        self.short_usage += 1
+                        self.daily_usage += 1
+                        return
+                    wait = (1 - self.tokens) / self._refill_rate
+
+                if deadline is not None and time.monotonic() + wait > deadline:
+                    raise StravaRateLimitError(
+                        "Strava 15-minute rate limit reached", wait
+                    )
+
+                self.throttled_requests += 1
+                await asyncio.sleep(wait)
+        finally:
+            self._lock.release()
+
+    def update_from_headers(self, headers: Mapping[str, str]) -> None:
+        """Sync limits and usage with the headers of a Strava response"""
+        limits = _parse_pair(headers.get("X-ReadRateLimit-Limit")) or _parse_pair(
+            headers.get("X-RateLimit-Limit")
+        )
+        usage = _parse_pair(headers.get("X-ReadRateLimit-Usage")) or _parse_pair(
+            headers.get("X-RateLimit-Usage")
+        )
+
+        if limits:
+            self.short_limit, self.daily_limit = limits
+
+        if usage:
+            self._roll_windows()
+            self.short_usage, self.daily_usage = usage
+            self._refill()
+            self.tokens = max(
+                0.0, min(self.tokens, float(self.short_limit - self.short_usage))
+            )
+
+    def on_rate_limited(self) -> None:
+        """Block all callers until the current 15-minute window resets"""
+        self.rate_limited_responses += 1
+        self.tokens = 0.0
+        self._blocked_until = time.monotonic() + self.seconds_until_reset()
+
+    def seconds_until_reset(self) -> float:
+        """Seconds until the budget that is currently exhausted resets"""
+        now = _utcnow()
+
+        if self.daily_usage >= self.daily_limit:
+            midnight = datetime.combine(
+                now.date() + timedelta(days=1), datetime.min.time(), timezone.utc
+            )
+            return (midnight - now).total_seconds()
+
+        return self._seconds_until_short_reset()
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Current budget usage, for monitoring"""
+        self._roll_windows()
+        self._refill()
+        return {
+            "short_limit": self.short_limit,
+            "short_usage": self.short_usage,
+            "daily_limit": self.daily_limit,
+            "daily_usage": self.daily_usage,
+            "tokens_available": round(self.tokens, 2),
+            "seconds_until_short_reset": round(self._seconds_until_short_reset()),
+            "blocked_for_seconds": round(
+                max(0.0, self._blocked_until - time.monotonic())
+            ),
+            "throttled_requests": self.throttled_requests,
+            "rate_limited_responses": self.rate_limited_responses,
+        }
+
+    def _seconds_until_short_reset(self) -> float:
+        now = _utcnow()
+        window_end = self._short_window_start(now) + timedelta(
+            seconds=SHORT_WINDOW_SECONDS
+        )
+        return (window_end - now).total_seconds()
+
+    @property
+    def _refill_rate(self) -> float:
+        return self.short_limit / SHORT_WINDOW_SECONDS
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(
+            float(self.short_limit),
+            self.tokens + (now - self._refilled_at) * self._refill_rate,
+        )
+        self._refilled_at = now
+
+    def _roll_windows(self) -> None:
+        """Reset usage counters when Strava's fixed windows roll over"""
+        now = _utcnow()
+
+        window = self._short_window_start(now)
+        if window != self._short_window:
+            self._short_window = window
+            self.short_usage = 0
+
+        if now.date() != self._day:
+            self._day = now.date()
+            self.daily_usage = 0
+
+    @staticmethod
+    def _short_window_start(now: datetime) -> datetime:
+        """Strava's short windows start at :00, :15, :30 and :45 UTC"""
+        return now.replace(minute=now.minute - now.minute % 15, second=0, microsecond=0)
+
+
+def _utcnow() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+def _parse_pair(value: Optional[str]) -> Optional[Tuple[int, int]]:
+    """Parse a "short,daily" header value"""
+    if not value:
+        return None
+
+    try:
+        short, daily = (int(part) for part in value.split(",")[:2])
+    except ValueError:
+        return None
+
+    return short, daily
@@ -1,18 +1,75 @@
+import asyncio
+import itertools
+import os
+import random
 from datetime import datetime
-from typing import Any, Dict, List, Optional
+from typing import Any, AsyncIterator, Dict, List, Optional, Sequence
 
-import requests
+import httpx
+from services.strava_rate_limiter import (
+    StravaAPIError,
+    StravaRateLimiter,
+    StravaRateLimitError,
+)
 
+try:
+    import h2  # noqa: F401
 
-class StravaService:
-    """Service for interacting with the Strava API"""
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+STRAVA_TIMEOUT_SECONDS = float(os.getenv("STRAVA_TIMEOUT_SECONDS", "30"))
+STRAVA_CONNECT_TIMEOUT_SECONDS = float(os.getenv("STRAVA_CONNECT_TIMEOUT_SECONDS", "5"))
+STRAVA_MAX_CONNECTIONS = int(os.getenv("STRAVA_MAX_CONNECTIONS", "20"))
+STRAVA_PAGE_CONCURRENCY = int(os.getenv("STRAVA_PAGE_CONCURRENCY", "4"))
+STRAVA_MAX_RETRIES = int(os.getenv("STRAVA_MAX_RETRIES", "4"))
+STRAVA_BACKOFF_BASE_SECONDS = float(os.getenv("STRAVA_BACKOFF_BASE_SECONDS", "0.5"))
+# Longest a single call will wait for rate-limit budget before giving up
+STRAVA_MAX_WAIT_SECONDS = float(os.getenv("STRAVA_MAX_WAIT_SECONDS", "60"))
+
+
+class AsyncStravaService:
+    """Async Strava API client backed by a pooled, keep-alive HTTP client.
+
+    All API calls go through a shared StravaRateLimiter and are retried with
+    jittered exponential backoff on 429, 5xx and transport errors.
+    """
 
     BASE_URL = "https://www.strava.com/api/v3"
     AUTH_URL = "https://www.strava.com/oauth/token"
 
-    def __init__(self, client_id: str, client_secret: str):
+    def __init__(
+        self,
+        client_id: str,
+        client_secret: str,
+        rate_limiter: Optional[StravaRateLimiter] = None,
+    ):
         self.client_id = client_id
         self.client_secret = client_secret
+        self.rate_limiter = rate_limiter or StravaRateLimiter()
+        self._client: Optional[httpx.AsyncClient] = None
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                http2=HTTP2_AVAILABLE,
+                timeout=httpx.Timeout(
+                    STRAVA_TIMEOUT_SECONDS, connect=STRAVA_CONNECT_TIMEOUT_SECONDS
+                ),
+                limits=httpx.Limits(
+                    max_connections=STRAVA_MAX_CONNECTIONS,
+                    max_keepalive_connections=STRAVA_MAX_CONNECTIONS,
+                ),
+            )
+        return self._client
+
+    async def aclose(self) -> None:
+        """Close the underlying HTTP client. Called at shutdown."""
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
 
     def get_authorization_url(self, redirect_uri: str) -> str:
         """Generate the Strava authorization URL for OAuth flow"""
@@ -25,37 +82,119 @@ class StravaService:
             f"&scope=read,activity:read"
         )
 
-    def exchange_token(self, code: str) -> Dict[str, Any]:
-        """Exchange authorization code for access and refresh tokens"""
-        data = {
+    def is_token_expired(self, expires_at: int, buffer_seconds: int = 300) -> bool:
+        """Check if a token is expired, or will be within `buffer_seconds`"""
+        # The buffer ensures we refresh slightly before expiration
+        return datetime.now().timestamp() >= (expires_at - buffer_seconds)
+
+    def _exchange_token_data(self, code: str) -> Dict[str, Any]:
+        return {
             "client_id": self.client_id,
             "client_secret": self.client_secret,
             "code": code,
             "grant_type": "authorization_code",
         }
 
-        response = requests.post(self.AUTH_URL, data=data)
-        if response.status_code != 200:
-            raise Exception(f"Failed to exchange token: {response.text}")
-
-        return response.json()
-
-    def refresh_access_token(self, refresh_token: str) -> Dict[str, Any]:
-        """Refresh an expired access token"""
-        data = {
+    def _refresh_token_data(self, refresh_token: str) -> Dict[str, Any]:
+        return {
             "client_id": self.client_id,
             "client_secret": self.client_secret,
             "refresh_token": refresh_token,
             "grant_type": "refresh_token",
         }
 
-        response = requests.post(self.AUTH_URL, data=data)
-        if response.status_code != 200:
-            raise Exception(f"Failed to refresh token: {response.text}")
+    def _activities_params(
+        self,
+        after: Optional[datetime],
+        before: Optional[datetime],
+        page: int,
+        per_page: int,
+    ) -> Dict[str, Any]:
+        params = {"page": page, "per_page": per_page}
 
-        return response.json()
+        if after:
+            params["after"] = int(after.timestamp())
 
-    def get_athlete_activities(
+        if before:
+            params["before"] = int(before.timestamp())
+
+        return params
+
+    def _auth_headers(self, access_token: str) -> Dict[str, str]:
+        return {"Authorization": f"Bearer {access_token}"}
+
+    async def _request(
+        self,
+        method: str,
+        url: str,
+        error_message: str,
+        rate_limited: bool = True,
+        **kwargs: Any,
+    ) -> Any:
+        """Send a request through the rate limiter, retrying transient failures"""
+        for attempt in range(STRAVA_MAX_RETRIES + 1):
+            if rate_limited:
+                await self.rate_limiter.acquire(max_wait=STRAVA_MAX_WAIT_SECONDS)
+
+            try:
+                response = await self.client.request(method, url, **kwargs)
+            except httpx.TransportError as e:
+                if attempt == STRAVA_MAX_RETRIES:
+                    raise StravaAPIError(f"{error_message}: {e}") from e
+                await asyncio.sleep(_backoff(attempt))
+                continue
+
+            if rate_limited:
+                self.rate_limiter.update_from_headers(response.headers)
+
+            if response.status_code == 200:
+                return response.json()
+
+            if response.status_code == 429:
+                self.rate_limiter.on_rate_limited()
+                retry_after = self.rate_limiter.seconds_until_reset()
+                if (
+                    attempt == STRAVA_MAX_RETRIES
+                    or retry_after > STRAVA_MAX_WAIT_SECONDS
+                ):
+                    raise StravaRateLimitError(
+                        f"{error_message}: {response.text}", retry_after
+                    )
+                if not rate_limited:
+                    # Rate limited calls wait in acquire(); these don't go
+                    # through it, so they wait here
+                    await asyncio.sleep(retry_after)
+                continue
+
+            if response.status_code >= 500 and attempt < STRAVA_MAX_RETRIES:
+                await asyncio.sleep(_backoff(attempt))
+                continue
+
+            raise StravaAPIError(
+                f"{error_message}: {response.text}", response.status_code
+            )
+
+    async def exchange_token(self, code: str) -> Dict[str, Any]:
+        """Exchange authorization code for access and refresh tokens"""
+        return await self._request(
+            "POST",
+            self.AUTH_URL,
+            "Failed to exchange token",
+            rate_limited=False,
+            data=self._exchange_token_data(code),
+        )
+
+    async def refresh_access_token(self, refresh_token: str) -> Dict[str, Any]:
+        """Refresh an expired access token"""
+        return await self._request(
+            "POST",
+            self.AUTH_URL,
+            "Failed to refresh token",
+            rate_limited=False,
+            data=self._refresh_token_data(refresh_token),
+        )
+
+    async def get_athlete_activities(
         self,
         access_token: str,
         after: Optional[datetime] = None,
@@ -64,39 +203,79 @@ class StravaService:
         per_page: int = 200,
     ) -> List[Dict[str, Any]]:
         """Get athlete activities with optional date filtering"""
-        headers = {"Authorization": f"Bearer {access_token}"}
+        return await self._request(
+            "GET",
+            f"{self.BASE_URL}/athlete/activities",
+            "Failed to get activities",
+            headers=self._auth_headers(access_token),
+            params=self._activities_params(after, before, page, per_page),
+        )
 
-        params = {"page": page, "per_page": per_page}
+    async def iter_activity_pages(
+        self,
+        access_token: str,
+        after: Optional[datetime] = None,
+        per_page: int = 200,
+        concurrency: int = STRAVA_PAGE_CONCURRENCY,
+    ) -> AsyncIterator[List[Dict[str, Any]]]:
+        """Yield non-empty pages of activities in order, fetching several at once.
 
-        if after:
-            params["after"] = int(after.timestamp())
+        The number of pages in flight starts at one and doubles up to
+        `concurrency` while pages keep coming back full, so incremental syncs
+        with a handful of new activities still cost a single request.
+        Iteration stops at the first short or empty page.
+        """
+        pending: Dict[int, asyncio.Task] = {}
+        next_page = 1
+        window = 1
 
-        if before:
-            params["before"] = int(before.timestamp())
+        try:
+            for page in itertools.count(1):
+                while len(pending) < window:
+                    pending[next_page] = asyncio.create_task(
+                        self.get_athlete_activities(
+                            access_token, after=after, page=next_page, per_page=per_page
+                        )
+                    )
+                    next_page += 1
 
-        url = f"{self.BASE_URL}/athlete/activities"
-        response = requests.get(url, headers=headers, params=params)
+                activities = await pending.pop(page)
+                if activities:
+                    yield activities
 
-        if response.status_code != 200:
-            raise Exception(f"Failed to get activities: {response.text}")
+                if len(activities) < per_page:
+                    break
 
-        return response.json()
+                window = min(window * 2, concurrency)
+        finally:
+            for task in pending.values():
+                task.cancel()
+            await asyncio.gather(*pending.values(), return_exceptions=True)
 
-    def get_activity_detail(
+    async def get_activity_detail(
         self, access_token: str, activity_id: str
     ) -> Dict[str, Any]:
         """Get detailed information about a specific activity"""
-        headers = {"Authorization": f"Bearer {access_token}"}
-        url = f"{self.BASE_URL}/activities/{activity_id}"
+        return await self._request(
+            "GET",
+            f"{self.BASE_URL}/activities/{activity_id}",
+            "Failed to get activity detail",
+            headers=self._auth_headers(access_token),
+        )
 
-        response = requests.get(url, headers=headers)
-        if response.status_code != 200:
-            raise Exception(f"Failed to get activity detail: {response.text}")
+    async def get_activity_streams(
+        self, access_token: str, activity_id: str, keys: Sequence[str]
+    ) -> Dict[str, Any]:
+        """Get an activity's per-sample streams, keyed by stream type"""
+        return await self._request(
+            "GET",
+            f"{self.BASE_URL}/activities/{activity_id}/streams",
+            "Failed to get activity streams",
+            headers=self._auth_headers(access_token),
+            params={"keys": ",".join(keys), "key_by_type": "true"},
+        )
 
-        return response.json()
 
-    def is_token_expired(self, expires_at: int) -> bool:
-        """Check if a token is expired"""
-        # Add a small buffer to ensure we refresh slightly before expiration
-        buffer_seconds = 300  # 5 minutes
-        return datetime.now().timestamp() >= (expires_at - buffer_seconds)
+def _backoff(attempt: int) -> float:
+    """Exponential backoff with full jitter"""
+    return random.uniform(0, STRAVA_BACKOFF_BASE_SECONDS * 2**attempt)
@@ -0,0 +1,443 @@
+import asyncio
+import os
+import time
+import traceback
+from contextlib import asynccontextmanager
+from datetime import datetime
+from sqlite3 import Connection
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+from database import DEDICATED_TENANTS, async_connection, connection
+from repositories.activity_stream_repository import ActivityStreamRepository
+from repositories.auth_repository import AuthRepository
+from repositories.best_effort_repository import BestEffortRepository
+from repositories.fitness_repository import RUN_TYPE
+from repositories.sync_job_repository import SyncJobRepository
+from repositories.workout_repository import WorkoutRepository
+from services.activity_streams import STREAM_KEYS, encode_streams
+from services.best_efforts import refresh_best_efforts
+from services.fitness_service import refresh_fitness_summary
+from services.strava_rate_limiter import StravaAPIError
+from services.strava_service import STRAVA_PAGE_CONCURRENCY, AsyncStravaService
+
+SYNC_WORKER_CONCURRENCY = int(os.getenv("SYNC_WORKER_CONCURRENCY", "2"))
+SYNC_WORKER_POLL_SECONDS = float(os.getenv("SYNC_WORKER_POLL_SECONDS", "5"))
+# Runs whose streams are fetched per sync; later syncs backfill older runs
+STREAM_BACKFILL_LIMIT = int(os.getenv("STREAM_BACKFILL_LIMIT", "50"))
+TOKEN_REFRESH_INTERVAL_SECONDS = float(
+    os.getenv("TOKEN_REFRESH_INTERVAL_SECONDS", "300")
+)
+# Tokens expiring within this window are renewed ahead of time. Strava's
+# access tokens last six hours; the window spans several refresh passes so
+# a failed refresh is retried before the token lapses.
+TOKEN_REFRESH_MARGIN_SECONDS = int(os.getenv("TOKEN_REFRESH_MARGIN_SECONDS", "1800"))
+
+
+class WorkoutSyncService:
+    """Imports a user's Strava activities into the workouts table"""
+
+    def __init__(self, strava_service: AsyncStravaService):
+        self.strava_service = strava_service
+        self._refresh_locks: Dict[str, asyncio.Lock] = {}
+
+    async def get_access_token(self, user_id: str, buffer_seconds: int = 300) -> str:
+        """Return the user's stored access token, refreshing it if it expires
+        within `buffer_seconds`"""
+        # One refresh per user at a time; whoever waited reads the new token
+        lock = self._refresh_locks.setdefault(user_id, asyncio.Lock())
+        async with lock:
+            # Tokens are in the shared database, whatever the user's partition
+            async with async_connection() as db:
+                tokens = AuthRepository(db).get(user_id)
+            if not tokens:
+                raise StravaAPIError(
+                    "No stored Strava tokens, please reconnect Strava", status_code=401
+                )
+
+            if not self.strava_service.is_token_expired(
+                tokens["expires_at"], buffer_seconds
+            ):
+                return tokens["access_token"]
+
+            token_data = await self.strava_service.refresh_access_token(
+                tokens["refresh_token"]
+            )
+
+            access_token = token_data.get("access_token")
+            refresh_token = token_data.get("refresh_token")
+            expires_at = token_data.get("expires_at")
+
+            if not access_token or not refresh_token or not expires_at:
+                raise StravaAPIError("Invalid token refresh response")
+
+            async with async_connection() as db:
+                AuthRepository(db).update_tokens(
+                    user_id, access_token, refresh_token, expires_at
+                )
+                db.commit()
+
+            return access_token
+
+    async def sync(self, user_id: str, full_sync: bool = False) -> int:
+        """Fetch new activities from Strava and upsert them into the user's
+        data partition.
+
+        A connection is only borrowed for each write, never while waiting on
+        Strava. Returns the number of activities fetched.
+        """
+        access_token = await self.get_access_token(user_id)
+
+        async with async_connection(user_id) as db:
+            sync_state = WorkoutRepository(db).get_sync_state(user_id)
+
+        # Only fetch activities newer than the high-water mark unless a full
+        # resync was explicitly requested
+        after = None
+        if not full_sync and sync_state and sync_state["last_start_date"]:
+            after = parse_strava_date(sync_state["last_start_date"])
+
+        newest = None
+        synced = 0
+
+        # Upsert each page as it arrives while later pages are still in
+        # flight. Committing per page keeps the write lock short; the
+        # high-water mark only moves once every page is stored, so a failed
+        # sync is simply retried from the previous mark.
+        async for activities in self.strava_service.iter_activity_pages(
+            access_token=access_token, after=after
+        ):
+            async with self._writer(user_id) as db:
+                WorkoutRepository(db).upsert_many(
+                    activity_to_row(activity, user_id) for activity in activities
+                )
+                db.commit()
+
+            synced += len(activities)
+            newest = max(
+                activities + ([newest] if newest else []),
+                key=lambda a: parse_strava_date(a["start_date"]),
+            )
+
+        if newest:
+            last_start_date = newest["start_date"]
+            last_strava_id = str(newest["id"])
+        else:
+            last_start_date = sync_state["last_start_date"] if sync_state else None
+            last_strava_id = None
+
+        async with self._writer(user_id) as db:
+            WorkoutRepository(db).save_sync_state(
+                user_id,
+                last_start_date,
+                last_strava_id,
+                int(datetime.now().timestamp()),
+            )
+            db.commit()
+
+        # Before the summary, which includes the best efforts from the streams
+        await self.ingest_streams(user_id, access_token)
+        async with self._writer(user_id) as db:
+            refresh_fitness_summary(db, user_id)
+            db.commit()
+
+        return synced
+
+    async def ingest_streams(
+        self,
+        user_id: str,
+        access_token: str,
+        strava_ids: Optional[List[str]] = None,
+        limit: int = STREAM_BACKFILL_LIMIT,
+    ) -> int:
+        """Fetch and store streams for the given activities, or by default for
+        the user's newest runs that don't have them yet, then work out the
+        best efforts and splits of any streams not yet analyzed.
+
+        Streams are an extra on top of the summary rows, so an API error
+        stops the backfill quietly rather than failing the sync; what is
+        missing is picked up next time. Returns the number of activities
+        stored.
+        """
+        if strava_ids is None:
+            async with async_connection(user_id) as db:
+                strava_ids = ActivityStreamRepository(db).missing(
+                    user_id, RUN_TYPE, limit
+                )
+
+        stored = 0
+        for start in range(0, len(strava_ids), STRAVA_PAGE_CONCURRENCY):
+            batch = strava_ids[start : start + STRAVA_PAGE_CONCURRENCY]
+            results = await asyncio.gather(
+                *(self._fetch_streams(access_token, strava_id) for strava_id in batch),
+                return_exceptions=True,
+            )
+
+            failed = None
+            encoded = []
+            for strava_id, result in zip(batch, results):
+                if isinstance(result, StravaAPIError):
+                    failed = result
+                    continue
+                if isinstance(result, BaseException):
+                    raise result
+                samples, data = encode_streams(result) if result else (0, None)
+                encoded.append((strava_id, samples, data))
+
+            now = int(datetime.now().timestamp())
+            async with self._writer(user_id) as db:
+                streams = ActivityStreamRepository(db)
+                for strava_id, samples, data in encoded:
+                    streams.save(user_id, strava_id, samples, data, now)
+                db.commit()
+            stored += len(encoded)
+
+            if failed is not None:
+                print(f"Stopped fetching streams for user {user_id}: {failed}")
+                break
+
+        async with self._writer(user_id) as db:
+            refresh_best_efforts(db, user_id)
+            db.commit()
+
+        return stored
+
+    @asynccontextmanager
+    async def _writer(self, user_id: str) -> AsyncIterator[Connection]:
+        """A connection to the user's partition for one write, provided they
+        are still connected. A sync or webhook that outlives a disconnect
+        stops here rather than restoring the data that was just purged."""
+        async with async_connection() as db:
+            if not AuthRepository(db).exists(user_id):
+                raise StravaAPIError("Strava was disconnected", status_code=401)
+            if user_id not in DEDICATED_TENANTS:
+                # The shared database holds the partition, so the check and
+                # the write happen without yielding to a disconnect
+                yield db
+                return
+
+        async with async_connection(user_id) as db:
+            yield db
+
+    async def _fetch_streams(self, access_token: str, strava_id: str) -> dict:
+        """An activity's stream data keyed by stream type; empty if it has none"""
+        try:
+            streams = await self.strava_service.get_activity_streams(
+                access_token, strava_id, STREAM_KEYS
+            )
+        except StravaAPIError as e:
+            # Manual activities have no streams
+            if e.status_code == 404:
+                return {}
+            raise
+        return {key: stream["data"] for key, stream in streams.items()}
+
+    async def apply_activity_event(
+        self, user_id: str, activity_id: str, aspect_type: str
+    ) -> None:
+        """Apply a single activity create/update/delete pushed by a webhook"""
+        if aspect_type == "delete":
+            async with self._writer(user_id) as db:
+                WorkoutRepository(db).delete_activity(user_id, activity_id)
+                ActivityStreamRepository(db).delete_activity(user_id, activity_id)
+                BestEffortRepository(db).delete_activity(user_id, activity_id)
+                refresh_fitness_summary(db, user_id)
+                db.commit()
+            return
+
+        access_token = await self.get_access_token(user_id)
+        activity = await self.strava_service.get_activity_detail(
+            access_token, activity_id
+        )
+        async with self._writer(user_id) as db:
+            WorkoutRepository(db).upsert_many([activity_to_row(activity, user_id)])
+            db.commit()
+
+        if aspect_type == "create" and activity["type"] == RUN_TYPE:
+            await self.ingest_streams(user_id, access_token, [activity_id])
+
+        async with self._writer(user_id) as db:
+            refresh_fitness_summary(db, user_id)
+            db.commit()
+
+
+class SyncWorker:
+    """Background asyncio workers that drain the sync_jobs queue.
+
+    Jobs live in SQLite, so anything queued or interrupted mid-run is picked
+    up again after a restart.
+    """
+
+    def __init__(
+        self,
+        sync_service: WorkoutSyncService,
+        concurrency: int = SYNC_WORKER_CONCURRENCY,
+        poll_seconds: float = SYNC_WORKER_POLL_SECONDS,
+    ):
+        self.sync_service = sync_service
+        self.concurrency = concurrency
+        self.poll_seconds = poll_seconds
+        self._tasks: List[asyncio.Task] = []
+        self._wakeup: Optional[asyncio.Event] = None
+
+    def start(self) -> None:
+        with connection() as db:
+            requeued = SyncJobRepository(db).requeue_running()
+            db.commit()
+
+        if requeued:
+            print(f"Requeued {requeued} interrupted sync job(s)")
+
+        self._wakeup = asyncio.Event()
+        self._tasks = [
+            asyncio.create_task(self._run()) for _ in range(self.concurrency)
+        ]
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def enqueue(self, db, user_id: str, full_sync: bool = False) -> Dict[str, Any]:
+        """Queue a sync job for a user and wake an idle worker"""
+        job = SyncJobRepository(db).enqueue(user_id, full_sync)
+        db.commit()
+
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+        return dict(job)
+
+    async def _run(self) -> None:
+        while True:
+            # Clear before claiming so an enqueue that lands in between still
+            # wakes this worker
+            self._wakeup.clear()
+            async with async_connection() as db:
+                job = SyncJobRepository(db).claim_next()
+                db.commit()
+
+            if job is None:
+                await self._wait_for_work()
+                continue
+
+            await self._process(job)
+
+    async def _wait_for_work(self) -> None:
+        try:
+            await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_seconds)
+        except asyncio.TimeoutError:
+            pass
+
+    async def _process(self, job) -> None:
+        # No connection is held during the sync, which borrows one per write
+        synced, error = 0, None
+        try:
+            synced = await self.sync_service.sync(
+                job["user_id"], full_sync=bool(job["full_sync"])
+            )
+        except asyncio.CancelledError:
+            # Leave the job as running; it is requeued on next startup
+            raise
+        except Exception as e:
+            traceback.print_exc()
+            error = str(e)
+
+        async with async_connection() as db:
+            jobs = SyncJobRepository(db)
+            if error is None:
+                jobs.mark_succeeded(job["id"], synced)
+            else:
+                jobs.mark_failed(job["id"], error)
+            db.commit()
+
+
+class TokenRefresher:
+    """Background task that renews access tokens shortly before they expire.
+
+    Syncs then find a valid token waiting rather than making an OAuth round
+    trip first, and no request needs the user's session to get one.
+    """
+
+    def __init__(
+        self,
+        sync_service: WorkoutSyncService,
+        interval: float = TOKEN_REFRESH_INTERVAL_SECONDS,
+        margin: int = TOKEN_REFRESH_MARGIN_SECONDS,
+    ):
+        self.sync_service = sync_service
+        self.interval = interval
+        self.margin = margin
+        self._task: Optional[asyncio.Task] = None
+        # Users whose refresh was refused, with the expiry it was refused at,
+        # so a revoked token isn't retried every pass
+        self._refused: Dict[str, int] = {}
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await self.refresh_expiring()
+            except Exception:
+                traceback.print_exc()
+            await asyncio.sleep(self.interval)
+
+    async def refresh_expiring(self) -> int:
+        """Refresh every token expiring within the margin. Returns how many
+        were refreshed."""
+        async with async_connection() as db:
+            expiring = AuthRepository(db).expiring(int(time.time()) + self.margin)
+
+        refreshed = 0
+        for user_id, expires_at in expiring:
+            if self._refused.get(user_id) == expires_at:
+                continue
+            try:
+                await self.sync_service.get_access_token(user_id, self.margin)
+            except StravaAPIError as e:
+                print(f"Failed to refresh the token of user {user_id}: {e}")
+                if e.status_code and 400 <= e.status_code < 500:
+                    self._refused[user_id] = expires_at
+            except ValueError as e:
+                # Tokens encrypted with a key that is no longer configured;
+                # retrying won't help, and other users are still refreshed
+                print(f"Failed to refresh the token of user {user_id}: {e}")
+                self._refused[user_id] = expires_at
+            else:
+                self._refused.pop(user_id, None)
+                refreshed += 1
+
+        return refreshed
+
+
+def activity_to_row(activity: dict, user_id: str) -> dict:
+    """Convert a Strava activity summary into a workouts table row"""
+    distance = activity["distance"] / 1000
+    moving_time = activity["moving_time"] / 60
+
+    return {
+        "strava_id": str(activity["id"]),
+        "user_id": user_id,
+        "name": activity["name"],
+        "distance": distance,
+        "moving_time": moving_time,
+        "total_elevation_gain": activity["total_elevation_gain"],
+        "type": activity["type"],
+        "start_date": activity["start_date"][:10],
+        "average_pace": moving_time / distance if distance else 0,
+        "average_heartrate": activity.get("average_heartrate"),
+        "max_heartrate": activity.get("max_heartrate"),
+    }
+
+
+def parse_strava_date(value: str) -> datetime:
+    """Parse an ISO 8601 timestamp as returned by the Strava API"""
+    return datetime.fromisoformat(value.replace("Z", "+00:00"))
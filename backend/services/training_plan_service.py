@@ -1,473 +1,111 @@
+import asyncio
+import json
 import os
-import sqlite3
 import time
-from pathlib import Path
+import traceback
+import uuid
+from datetime import date
+from typing import AsyncIterator, Callable, List, Optional, Tuple
+from database import connection
 from dotenv import load_dotenv
 from langchain_anthropic import ChatAnthropic
-from langchain_core.messages import AIMessage, HumanMessage, SystemMessage
+from langchain_core.callbacks import BaseCallbackHandler, UsageMetadataCallbackHandler
+from langchain_core.messages import (
+    AIMessage,
+    AIMessageChunk,
+    HumanMessage,
+    SystemMessage,
+)
+from langchain_core.runnables import RunnableConfig
 from langchain_core.tools import tool
-from langgraph.checkpoint.memory import MemorySaver
 from langgraph.graph import START, MessagesState, StateGraph
 from langgraph.prebuilt import ToolNode, tools_condition
-from datetime import datetime
+from models.training_plan import PlanRevision, StoredPlan, TrainingPlan
+from repositories.training_plan_repository import TrainingPlanRepository
+from services.fitness_service import format_fitness_summary, get_fitness_summary
+from services.plan_cache import PlanCache
+from services.plan_skeleton import (
+    build_skeleton,
+    describe_plan,
+    describe_weeks,
+    render_plan_html,
+    revise_skeleton,
+)
+from services.query_sandbox import (
+    CANNED_METRICS,
+    QueryRejectedError,
+    ReadOnlyQueryExecutor,
+)
 
 load_dotenv()
 
 ANTHROPIC_KEY = os.getenv("ANTHROPIC_KEY")
+# Plans generated at once; further requests queue for a free slot
+PLAN_MAX_CONCURRENCY = int(os.getenv("PLAN_MAX_CONCURRENCY", "8"))
+PLAN_QUEUE_TIMEOUT_SECONDS = float(os.getenv("PLAN_QUEUE_TIMEOUT_SECONDS", "60"))
+TOKEN_FIELDS = (
+    "input_tokens",
+    "output_tokens",
+    "cache_read_input_tokens",
+    "cache_creation_input_tokens",
+)
 
-class TrainingPlanService:
-    def __init__(self):
-        current_date = datetime.now().strftime("%A, %B %d, %Y")
-        self.tools = [self.running_coach_tool()]
-        self.sys_msg = SystemMessage(
-            content=f"""
-You are a running coach. You're friendly, encouraging and succinct and your purpose is to create running plans for various distances, including a marathon, half marathon, 10K, 5K and custom distances. Your output should assume you are directly addressing the user, as you.
-                                     
-OUTPUT: Commentary and table of running plan
+SYSTEM_PROMPT = """You are a running coach. You're friendly, encouraging and succinct and your purpose is to help runners prepare for races, including a marathon, half marathon, 10K, 5K and custom distances. Your output should assume you are directly addressing the user, as you.
+
+The week-by-week plan table has already been built from my goal, preferences and running history, and is shown below your reply. My message summarizes it.
+
+OUTPUT: Short commentary only, in at most 5 numbered points and under 200 words. Do not write a table or list individual weeks.
 
 IMPORTANT STEPS:
-1. Query the workouts table to understand my running history by querying the running_coach tool. Tool call: Running_coach. SELECT AVG(average_pace) FROM workouts WHERE type = 'Run' AND start_date >= date('now', '-6 months'). A realistic goal shouldn't require reducing the average speed by more than 25%. If there is no running history, move on to step 3. Do not mention any queries in your response.
-2. Decide if my goal is realistic based on my running history from the running_coach tool. If I needs to improve his pace by 2 min/km, the goal is realistic.
-3. Based on my's goals and preferences, create a running plan. If no preferences are specified, then create a running plan based on the goal only.
-4. STRICTLY ENFORCE: The plan duration should be calculated as the number of weeks between {current_date} and the End Date, with a maximum limit of 16 weeks. If the Goal Date is more than 16 weeks away, the plan will still only cover the next 16 weeks.
-5. STRICTLY ENFORCE: Schedule workouts ONLY on my selected preferred days. No workouts should be scheduled on any other days.
-6. STRICTLY ENFORCE: The total number of weekly workout days (strength training + runs) must EXACTLY match my's preferred workout days per week. Never exceed this limit and always schedule exactly this many workouts each week. A "workout day" is ANY day with ANY type of training (running, strength, or both). If a day has both running and strength training, it counts as ONE workout day.
-7. STRICTLY ENFORCE: The weekly long run MUST be scheduled on my specified long run preferred day.
-8. If I did not select strength training, create a running-only plan.
-9. If I selected strength training, incorporate both running and strength/cross training sessions, while maintaining the exact total number of workout days specified in my preferences (if available).
-10. When allocating workouts to days, follow this priority order:
-a. First, schedule the long run on my preferred long run day
-b. Then distribute remaining workouts (running and strength if selected) ONLY on mys preferred available days
-c. If strength training is selected, balance it appropriately with running sessions
-9. In the final output, you MUST comment on how realistic you think I will achieve my goal. You MUST create a html table with the running plan with 16 weeks and 7 days for each week.
-11. Avoid decimals when referring to time. For example 5h 30 mins instead of 5.5 hours.
-
-        
-
-EXAMPLE 1: OUTPUT TABLE FOR RUNNING PLAN FOR USER WHO WANTS TO RUN A MARATHON of 42.2KM. I HAD CHOSEN PREFERENCES OF  AVAILABLE DAYS ON TUESDAY, WEDNESDAY, THURSDAY, SATURDAY, SUNDAY), SUNDAY AS THE LONG RUN DAY AND INCLUDED STRENGTH TRAINING. Goal Date is more than 16 weeks away from current date.
-
-Response: The training plan is designed to help you achieve your goal of running a marathon in 4:04:00. Here are some key points about the plan:
-
-1. The plan is 16 weeks long, which should give you enough time to properly train for the marathon on June 9, 2026.
-
-2. The plan adheres to your preferences of having a maximum of 5 workout days per week, with the long run on Sundays. It also includes strength training on your available days.
-
-3. The plan gradually builds up your mileage and intensity over the 16 weeks, with a peak week of 32 km in the 13th week. This should prepare you for the 42.2 km marathon distance.
-
-4. The final two weeks are a taper period, where the mileage and intensity are reduced to allow your body to recover and be fresh for the race.
-
-5. Based on your current average pace of 6.41 min/km, your goal time of 4:04:00 for the marathon is very achievable. This would require you to run at an average pace of around 5:45 min/km, which is only about a 1 min / km improvement from your current pace.
-
-Overall, I believe this training plan is well-suited to your preferences and goals, and should help you successfully complete the marathon in your target time.
-
-<table>
-    <thead>
-        <tr>
-            <th>Week</th>
-            <th>Monday</th>
-            <th>Tuesday</th>
-            <th>Wednesday</th>
-            <th>Thursday</th>
-            <th>Friday</th>
-            <th>Saturday</th>
-            <th>Sunday</th>
-        </tr>
-    </thead>
-    <tbody>
-        <!-- Base Building Phase (Weeks 1-4) -->
-        <tr>
-            <td>1</td>
-            <td class="rest-day">Rest</td>
-            <td>5 km Easy</td>
-            <td class="strength">Strength Training<br>(40 min)</td>
-            <td>6 km Easy</td>
-            <td class="rest-day">Rest</td>
-            <td class="speed-work">Speed: 4×400m<br>@ 5K pace<br>+ 3 km Easy</td>
-            <td class="long-run">10 km Long Run</td>
-        </tr>
-        <tr>
-            <td>2</td>
-            <td class="rest-day">Rest</td>
-            <td>6 km Easy</td>
-            <td class="strength">Strength Training<br>(40 min)</td>
-            <td>6 km Easy</td>
-            <td class="rest-day">Rest</td>
-            <td class="speed-work">Tempo: 2 km<br>@ 10K pace<br>+ 4 km Easy</td>
-            <td class="long-run">12 km Long Run</td>
-        </tr>
-        <tr>
-            <td>3</td>
-            <td class="rest-day">Rest</td>
-            <td>6 km Easy</td>
-            <td class="strength">Strength Training<br>(45 min)</td>
-            <td>7 km Easy</td>
-            <td class="rest-day">Rest</td>
-            <td class="speed-work">Hills: 6×200m<br>hill repeats<br>+ 3 km Easy</td>
-            <td class="long-run">14 km Long Run</td>
-        </tr>
-        <tr>
-            <td>4</td>
-            <td class="rest-day">Rest</td>
-            <td>7 km Easy</td>
-            <td class="strength">Strength Training<br>(45 min)</td>
-            <td>7 km Easy</td>
-            <td class="rest-day">Rest</td>
-            <td class="speed-work">Speed: 5×600m<br>@ 5K pace<br>+ 3 km Easy</td>
-            <td class="long-run">16 km Long Run</td>
-        </tr>
-
-        <!-- Early Marathon Phase (Weeks 5-8) -->
-        <tr>
-            <td>5</td>
-            <td class="rest-day">Rest</td>
-            <td>7 km Easy</td>
-            <td class="strength">Strength Training<br>(45 min)</td>
-            <td>8 km Easy</td>
-            <td class="rest-day">Rest</td>
-            <td class="speed-work">Tempo: 3 km<br>@ 10K pace<br>+ 4 km Easy</td>
-            <td class="long-run">18 km Long Run</td>
-        </tr>
-        <tr>
-            <td>6</td>
-            <td class="rest-day">Rest</td>
-            <td>8 km Easy</td>
-            <td class="strength">Strength Training<br>(50 min)</td>
-            <td class="rest-day">Rest</td>
-            <td>8 km Easy</td>
-            <td class="speed-work">Speed: 6×800m<br>@ 5K pace<br>+ 3 km Easy</td>
-            <td class="long-run">14 km Long Run</td>
-        </tr>
-        <tr>
-            <td>7</td>
-            <td class="rest-day">Rest</td>
-            <td>8 km Easy</td>
-            <td class="strength">Strength Training<br>(50 min)</td>
-            <td class="rest-day">Rest</td>
-            <td>9 km Easy</td>
-            <td class="speed-work">Tempo: 5 km<br>@ Half Marathon pace<br>+ 3 km Easy</td>
-            <td class="long-run">21 km Long Run</td>
-        </tr>
-        <tr>
-            <td>8</td>
-            <td class="rest-day">Rest</td>
-            <td>8 km Easy</td>
-            <td class="strength">Strength Training<br>(50 min)</td>
-            <td class="rest-day">Rest</td>
-            <td>9 km Easy</td>
-            <td class="speed-work">Speed: 8×400m<br>@ 5K pace<br>+ 3 km Easy</td>
-            <td class="long-run">16 km Long Run</td>
-        </tr>
-
-        <!-- Mid Marathon Phase (Weeks 9-12) -->
-        <tr>
-            <td>9</td>
-            <td class="rest-day">Rest</td>
-            <td>9 km Easy</td>
-            <td class="strength">Strength Training<br>(50 min)</td>
-            <td class="rest-day">Rest</td>
-            <td>10 km Easy</td>
-            <td class="speed-work">Tempo: 6 km<br>@ Half Marathon pace<br>+ 3 km Easy</td>
-            <td class="long-run">24 km Long Run</td>
-        </tr>
-        <tr>
-            <td>10</td>
-            <td class="rest-day">Rest</td>
-            <td>9 km Easy</td>
-            <td class="strength">Strength Training<br>(45 min)</td>
-            <td class="rest-day">Rest</td>
-            <td>10 km Easy</td>
-            <td class="speed-work">Speed: 5×1000m<br>@ 10K pace<br>+ 3 km Easy</td>
-            <td class="long-run">19 km Long Run</td>
-        </tr>
-        <tr>
-            <td>11</td>
-            <td class="rest-day">Rest</td>
-            <td>10 km Easy</td>
-            <td class="strength">Strength Training<br>(45 min)</td>
-            <td class="rest-day">Rest</td>
-            <td>11 km Easy</td>
-            <td class="speed-work">Tempo: 8 km<br>@ Marathon pace<br>+ 3 km Easy</td>
-            <td class="long-run">29 km Long Run</td>
-        </tr>
-        <tr>
-            <td>12</td>
-            <td class="rest-day">Rest</td>
-            <td>10 km Easy</td>
-            <td class="strength">Strength Training<br>(45 min)</td>
-            <td class="rest-day">Rest</td>
-            <td>11 km Easy</td>
-            <td class="speed-work">Speed: 10×400m<br>@ 5K pace<br>+ 3 km Easy</td>
-            <td class="long-run">21 km Long Run</td>
-        </tr>
-
-        <!-- Peak Phase (Weeks 13-14) -->
-        <tr>
-            <td>13</td>
-            <td class="rest-day">Rest</td>
-            <td>10 km Easy</td>
-            <td class="strength">Strength Training<br>(40 min)</td>
-            <td class="rest-day">Rest</td>
-            <td>11 km Easy</td>
-            <td class="speed-work">Tempo: 10 km<br>@ Marathon pace<br>+ 3 km Easy</td>
-            <td class="long-run">32 km Long Run</td>
-        </tr>
-        <tr>
-            <td>14</td>
-            <td class="rest-day">Rest</td>
-            <td>10 km Easy</td>
-            <td class="strength">Strength Training<br>(40 min)</td>
-            <td class="rest-day">Rest</td>
-            <td>11 km Easy</td>
-            <td class="speed-work">Speed: 6×800m<br>@ 10K pace<br>+ 3 km Easy</td>
-            <td class="long-run">24 km Long Run</td>
-        </tr>
-
-        <!-- Taper Phase (Weeks 15-16) -->
-        <tr>
-            <td>15</td>
-            <td class="rest-day">Rest</td>
-            <td class="taper">8 km Easy</td>
-            <td class="strength">Strength Training<br>(30 min)</td>
-            <td class="rest-day">Rest</td>
-            <td class="taper">8 km Easy</td>
-            <td class="taper">Tempo: 5 km<br>@ Marathon pace<br>+ 3 km Easy</td>
-            <td class="taper">16 km Long Run</td>
-        </tr>
-        <tr>
-            <td>16</td>
-            <td class="rest-day">Rest</td>
-            <td class="taper">6 km Easy</td>
-            <td class="strength">Strength Training<br>(20 min)</td>
-            <td class="rest-day">Rest</td>
-            <td class="taper">5 km Easy</td>
-            <td class="taper">3 km Easy</td>
-            <td class="race-day">MARATHON<br>42.2 km</td>
-        </tr>
-    </tbody>
-</table>
-
-     
-EXAMPLE 2: OUTPUT TABLE FOR RUNNING PLAN FOR YOU WHO WANTS TO RUN A MARATHON of 42.2KM. I HAD CHOSEN PREFERENCES OF AVAILABLE DAYS ON MONDAY, WEDNESDAY, FRIDAY AND SUNDAY), WITH FRIDAY AS THE LONG RUN DAY. YOU ALSO INCLUDED STRENGTH TRAINING. Goal Date is more than 16 weeks away from current date.                           
-        
-Response: The training plan is designed to help you achieve your goal of running a marathon in 3:30:00. Here are some key points about the plan:
-
-1. The plan is 16 weeks long, which should give you enough time to properly train for the marathon on October 10, 2027.
-
-2. The plan respects your preferences of 4 workout days per week (Monday, Wednesday, Friday, Sunday), with long runs on Sundays and strength training on Wednesdays. Be aware that this condensed schedule means each workout will need to be higher quality - there's less room for "easy" training days when you're limited to 4 days per week.
-
-3. This plan aggressively builds up your mileage and intensity over 16 weeks, pushing to a peak long run of 38 km by week 13. This demanding progression is necessary to adequately prepare your body for the full marathon distance. You'll need to commit fully to each workout - especially those long Sunday runs which are the backbone of marathon preparation.
-
-4. The final two weeks feature a strategic taper, where we carefully reduce mileage while maintaining intensity. This isn't a time to relax - these quality sessions are crucial for race-day performance and must be executed with precision.
-
-5. Your current pace of versus your goal time of 4 represents a challenging improvement of 2min/km. While achievable, this will demand consistent effort and mental toughness in every workout. You'll need to push yourself in those Friday speed sessions to develop the pace endurance required.
-
-Overall, this intensified plan is designed to push your limits while respecting your 4-day schedule. Marathon training requires sacrifice, and with fewer training days, each session becomes critically important. If you can commit to the quality and intensity of each workout, especially those long Sunday runs which peak at 38 km, your goal time is within reach. The plan is structured to maximize your limited training time, but success will depend on your dedication to executing each session with purpose and determination.
-                                     
- <table>
-        <thead>
-            <tr>
-                <th>Week</th>
-                <th>Monday</th>
-                <th>Tuesday</th>
-                <th>Wednesday</th>
-                <th>Thursday</th>
-                <th>Friday</th>
-                <th>Saturday</th>
-                <th>Sunday</th>
-            </tr>
-        </thead>
-        <tbody>
-            <!-- Base Building Phase (Weeks 1-4) -->
-            <tr>
-                <td>1</td>
-                <td>6 km Easy<br>+ 4×100m strides</td>
-                <td class="rest-day">Rest</td>
-                <td class="strength">Strength Training<br>(45 min)<br>Focus: Full body</td>
-                <td class="rest-day">Rest</td>
-                <td class="long-run">12 km Long Run</td>
-                <td class="rest-day">Rest</td>
-                <td>Speed: 5×400m<br>@ 5K pace<br>+ 4 km Easy</td>
-            </tr>
-            <tr>
-                <td>2</td>
-                <td>7 km Easy<br>+ 4×100m strides</td>
-                <td class="rest-day">Rest</td>
-                <td class="strength">Strength Training<br>(50 min)<br>Focus: Leg power</td>
-                <td class="rest-day">Rest</td>
-                <td class="long-run">14 km Long Run</td>
-                <td class="rest-day">Rest</td>
-                <td>Tempo: 3 km<br>@ 10K pace<br>+ 5 km Easy</td>
-            </tr>
-            <tr>
-                <td>3</td>
-                <td>7 km Easy<br>+ 5×100m strides</td>
-                <td class="rest-day">Rest</td>
-                <td class="strength">Strength Training<br>(55 min)<br>Focus: Core & stability</td>
-                <td class="rest-day">Rest</td>
-                <td class="long-run">17 km Long Run</td>
-                <td class="rest-day">Rest</td>
-                <td>Hills: 8×200m<br>hill repeats<br>+ 4 km Easy</td>
-            </tr>
-            <tr>
-                <td>4</td>
-                <td>8 km Easy<br>+ 6×100m strides</td>
-                <td class="rest-day">Rest</td>
-                <td class="strength">Strength Training<br>(55 min)<br>Focus: Power & endurance</td>
-                <td class="rest-day">Rest</td>
-                <td class="long-run">19 km Long Run</td>
-                <td class="rest-day">Rest</td>
-                <td>Speed: 6×600m<br>@ 5K pace<br>+ 4 km Easy</td>
-            </tr>
-
-            <!-- Early Marathon Phase (Weeks 5-8) -->
-            <tr>
-                <td>5</td>
-                <td>8 km Easy<br>+ 6×100m strides</td>
-                <td class="rest-day">Rest</td>
-                <td class="strength">Strength Training<br>(55 min)<br>Focus: Lower body power</td>
-                <td class="rest-day">Rest</td>
-                <td class="long-run">22 km Long Run</td>
-                <td class="rest-day">Rest</td>
-                <td>Tempo: 4 km<br>@ 10K pace<br>+ 5 km Easy</td>
-            </tr>
-            <tr>
-                <td>6</td>
-                <td>10 km Easy<br>+ 6×100m strides</td>
-                <td class="rest-day">Rest</td>
-                <td class="strength">Strength Training<br>(60 min)<br>Focus: Explosive power</td>
-                <td class="rest-day">Rest</td>
-                <td class="long-run">16 km Long Run</td>
-                <td class="rest-day">Rest</td>
-                <td>Speed: 7×800m<br>@ 5K pace<br>+ 4 km Easy</td>
-            </tr>
-            <tr>
-                <td>7</td>
-                <td>10 km Easy<br>+ 8×100m strides</td>
-                <td class="rest-day">Rest</td>
-                <td class="strength">Strength Training<br>(60 min)<br>Focus: Core & hip strength</td>
-                <td class="rest-day">Rest</td>
-                <td class="long-run">25 km Long Run</td>
-                <td class="rest-day">Rest</td>
-                <td>Tempo: 6 km<br>@ Half Marathon pace<br>+ 4 km Easy</td>
-            </tr>
-            <tr>
-                <td>8</td>
-                <td>10 km Easy<br>+ 8×100m strides</td>
-                <td class="rest-day">Rest</td>
-                <td class="strength">Strength Training<br>(60 min)<br>Focus: Endurance circuit</td>
-                <td class="rest-day">Rest</td>
-                <td class="long-run">19 km Long Run</td>
-                <td class="rest-day">Rest</td>
-                <td>Speed: 10×400m<br>@ 5K pace<br>+ 4 km Easy</td>
-            </tr>
-
-            <!-- Mid Marathon Phase (Weeks 9-12) -->
-            <tr>
-                <td>9</td>
-                <td>11 km Easy<br>+ 8×100m strides</td>
-                <td class="rest-day">Rest</td>
-                <td class="strength">Strength Training<br>(60 min)<br>Focus: Power endurance</td>
-                <td class="rest-day">Rest</td>
-                <td class="long-run">29 km Long Run</td>
-                <td class="rest-day">Rest</td>
-                <td>Tempo: 7 km<br>@ Half Marathon pace<br>+ 4 km Easy</td>
-            </tr>
-            <tr>
-                <td>10</td>
-                <td>11 km Easy<br>+ 8×100m strides</td>
-                <td class="rest-day">Rest</td>
-                <td class="strength">Strength Training<br>(55 min)<br>Focus: Running-specific</td>
-                <td class="rest-day">Rest</td>
-                <td class="long-run">23 km Long Run</td>
-                <td class="rest-day">Rest</td>
-                <td>Speed: 6×1000m<br>@ 10K pace<br>+ 4 km Easy</td>
-            </tr>
-            <tr>
-                <td>11</td>
-                <td>12 km Easy<br>+ 8×100m strides</td>
-                <td class="rest-day">Rest</td>
-                <td class="strength">Strength Training<br>(55 min)<br>Focus: Power & stability</td>
-                <td class="rest-day">Rest</td>
-                <td class="long-run">35 km Long Run</td>
-                <td class="rest-day">Rest</td>
-                <td>Tempo: 10 km<br>@ Marathon pace<br>+ 3 km Easy</td>
-            </tr>
-            <tr>
-                <td>12</td>
-                <td>12 km Easy<br>+ 8×100m strides</td>
-                <td class="rest-day">Rest</td>
-                <td class="strength">Strength Training<br>(55 min)<br>Focus: Explosive endurance</td>
-                <td class="rest-day">Rest</td>
-                <td class="long-run">25 km Long Run</td>
-                <td class="rest-day">Rest</td>
-                <td>Speed: 12×400m<br>@ 5K pace<br>+ 4 km Easy</td>
-            </tr>
-
-            <!-- Peak Phase (Weeks 13-14) -->
-            <tr>
-                <td>13</td>
-                <td>12 km Easy<br>+ 8×100m strides</td>
-                <td class="rest-day">Rest</td>
-                <td class="strength">Strength Training<br>(50 min)<br>Focus: Power maintenance</td>
-                <td class="rest-day">Rest</td>
-                <td class="long-run">38 km Long Run</td>
-                <td class="rest-day">Rest</td>
-                <td>Tempo: 12 km<br>@ Marathon pace<br>+ 3 km Easy</td>
-            </tr>
-            <tr>
-                <td>14</td>
-                <td>12 km Easy<br>+ 6×100m strides</td>
-                <td class="rest-day">Rest</td>
-                <td class="strength">Strength Training<br>(50 min)<br>Focus: Race-specific</td>
-                <td class="rest-day">Rest</td>
-                <td class="long-run">29 km Long Run</td>
-                <td class="rest-day">Rest</td>
-                <td>Speed: 8×800m<br>@ 10K pace<br>+ 3 km Easy</td>
-            </tr>
-
-            <!-- Taper Phase (Weeks 15-16) -->
-            <tr>
-                <td>15</td>
-                <td class="taper">10 km Easy<br>+ 4×100m strides</td>
-                <td class="rest-day">Rest</td>
-                <td class="strength">Strength Training<br>(40 min)<br>Focus: Light maintenance</td>
-                <td class="rest-day">Rest</td>
-                <td class="taper">19 km Long Run</td>
-                <td class="rest-day">Rest</td>
-                <td class="taper">Tempo: 6 km<br>@ Marathon pace<br>+ 3 km Easy</td>
-            </tr>
-            <tr>
-                <td>16</td>
-                <td class="taper">7 km Easy<br>+ 4×100m strides</td>
-                <td class="rest-day">Rest</td>
-                <td class="strength">Strength Training<br>(30 min)<br>Focus: Activation</td>
-                <td class="rest-day">Rest</td>
-                <td class="taper">Rest</td>
-                <td class="rest-day">Rest</td>
-                <td class="taper">MARATHON<br>42.2 km</td>
-            </tr>
-        </tbody>
-    </table>
-
-                                     
-                                     """
+1. Use the running history summary included in my message to understand my running history. Only call a tool if you need something the summary doesn't cover, and prefer running_metric over writing SQL with running_coach. Do not mention any queries in your response.
+2. Comment on how realistic my goal is. When the summary lists best efforts, judge the goal against my best effort at or near the goal distance; otherwise a realistic goal shouldn't require improving my average pace by more than 25%. If there is no running history, say so and base your advice on the goal only.
+3. Explain how the plan is structured (phases, volume and long run progression, taper) and how it fits my preferences.
+4. Give one or two practical tips for the key sessions.
+5. Avoid decimals when referring to time. For example 5h 30 mins instead of 5.5 hours.
+"""
+
+
+class PlanCapacityError(Exception):
+    """Raised when a plan request waits too long for a generation slot"""
+
+
+class TrainingPlanService:
+    def __init__(
+        self,
+        max_concurrency: int = PLAN_MAX_CONCURRENCY,
+        queue_timeout: float = PLAN_QUEUE_TIMEOUT_SECONDS,
+    ):
+        self.tools = [self.running_metric_tool(), self.running_coach_tool()]
+        # Static, so it's marked for Anthropic prompt caching; anything that
+        # changes per request or per day goes in the user message instead
+        self.sys_msg = SystemMessage(
+            content=[
+                {
+                    "type": "text",
+                    "text": SYSTEM_PROMPT,
+                    "cache_control": {"type": "ephemeral"},
+                }
+            ]
         )
 
         self.llm = ChatAnthropic(
             model="claude-3-haiku-20240307",
             temperature=0.6,
-            max_tokens=4096,
+            max_tokens=1024,
             timeout=None,
             max_retries=2,
             anthropic_api_key=ANTHROPIC_KEY,
         ).bind_tools(self.tools)
 
-        self.memory = MemorySaver()
+        self.max_concurrency = max_concurrency
+        self.queue_timeout = queue_timeout
+        self.in_flight = 0
+        self.queued = 0
+        self._slots = asyncio.Semaphore(max_concurrency)
+        self.token_totals = dict.fromkeys(TOKEN_FIELDS, 0)
+        self.generations = 0
         self.graph = self._build_graph()
 
-    def _clear_memory(self):
-        self.memory = MemorySaver()
-
     def _build_graph(self):
         builder = StateGraph(MessagesState)
         builder.add_node("assistant", self._assistant)
@@ -475,25 +113,72 @@ Overall, this intensified plan is designed to push your limits while respecting
         builder.add_edge(START, "assistant")
         builder.add_conditional_edges("assistant", tools_condition)
         builder.add_edge("tools", "assistant")
-        return builder.compile(checkpointer=self.memory)
-
-    def _assistant(self, state: MessagesState):
-        return {"messages": [self.llm.invoke([self.sys_msg] + state["messages"])]}
+        # Each request is a single conversation passed in whole, so there is
+        # no checkpointer and no state shared between concurrent requests
+        return builder.compile()
+
+    async def _assistant(self, state: MessagesState):
+        message = await self.llm.ainvoke([self.sys_msg] + state["messages"])
+        return {"messages": [message]}
+
+    def _config(
+        self,
+        callbacks: Optional[List[BaseCallbackHandler]],
+        user_id: Optional[str] = None,
+    ) -> dict:
+        # The tools read user_id from here, so queries only see their rows
+        return {
+            "configurable": {"thread_id": str(uuid.uuid4()), "user_id": user_id},
+            "callbacks": callbacks or [],
+        }
+
+    async def _acquire(self) -> None:
+        """Wait for a generation slot, giving up after queue_timeout seconds"""
+        self.queued += 1
+        try:
+            await asyncio.wait_for(self._slots.acquire(), self.queue_timeout)
+        except asyncio.TimeoutError:
+            raise PlanCapacityError(
+                "Too many plans are being generated, please try again shortly."
+            )
+        finally:
+            self.queued -= 1
+        self.in_flight += 1
+
+    def _release(self) -> None:
+        self.in_flight -= 1
+        self._slots.release()
+
+    def record_usage(self, usage: UsageMetadataCallbackHandler) -> dict:
+        """Summarize one request's token usage and add it to the totals"""
+        tokens = token_usage(usage)
+        for field, count in tokens.items():
+            self.token_totals[field] += count
+        self.generations += 1
+        return tokens
+
+    def stats(self) -> dict:
+        return {
+            "in_flight": self.in_flight,
+            "queued": self.queued,
+            "max_concurrency": self.max_concurrency,
+            "generations": self.generations,
+            "tokens": dict(self.token_totals),
+        }
 
     def running_coach_tool(self):
         @tool
-        def running_coach(query: str) -> list:
-            """Analyze average pace for the last 6 months in min/km: SELECT AVG(average_pace) FROM workouts WHERE type = 'Run' AND start_date >= date('now', '-6 months').
-            When writing SQL queries, use SQLite's functions.
+        def running_coach(query: str, config: RunnableConfig) -> dict:
+            """Run a SQLite SELECT over my workouts, e.g. average pace for the last 6 months in min/km: SELECT AVG(average_pace) FROM workouts WHERE type = 'Run' AND start_date >= date('now', '-6 months').
+            Prefer running_metric when one of its metrics answers the question. Only my workouts are visible, so don't filter by user. Filter on type and start_date, keep queries small and aggregate where you can: at most 100 rows are returned.
 
-            Available columns:
+            Available columns of the workouts table:
 
             - strava_id: Activity ID
-            - user_id: Strava user ID
             - name: Name of activity
             - distance: Distance covered in kilometers
             - moving_time: Time spent moving in minutes
-            total_elevation_gain=activity["total_elevation_gain"],
+            - total_elevation_gain: Elevation gain in meters
             - type: Type of activity (e.g. Run)
             - start_date: Date of the activitiy
             - average_pace: Average pace during the workout (min/km)
@@ -501,38 +186,64 @@ Overall, this intensified plan is designed to push your limits while respecting
             - max_heartrate: Maximum beats per minute
 
             Args:
-                SELECT AVG(average_pace) FROM workouts WHERE type = 'Run' AND start_date >= date('now', '-6 months').
+                query: A single SELECT statement over the workouts table.
 
             Returns:
-                Average pace in km/min for the last 6 months
+                The column names, the rows and whether the rows were truncated
 
             """
-            if not query.strip().lower().startswith("select"):
-                raise ValueError("Only SELECT queries are allowed.")
-
-            project_root = Path(__file__).resolve().parents[2]
-            db_path = os.getenv("DATABASE_PATH", "backend/strava_app.db")
-            full_path = project_root / db_path
-
-            conn = sqlite3.connect(full_path)
-            try:
-                cursor = conn.cursor()
-                cursor.execute(query)
-                return cursor.fetchall()
-            finally:
-                cursor.close()
-                conn.close()
+            return _run_query(config, lambda user_id: _executor.execute(user_id, query))
 
         return running_coach
 
-    def run(self, user_message: str) -> str:
-        self._clear_memory()
-        thread_id = str(int(time.time() * 1000))
-        config = {"configurable": {"thread_id": thread_id}}
-        messages = self.graph.invoke(
-            {"messages": [HumanMessage(content=user_message)]}, config=config
+    def running_metric_tool(self):
+        metrics = "\n".join(
+            f"            - {name}: {description}"
+            for name, (description, _) in CANNED_METRICS.items()
         )
 
+        @tool
+        def running_metric(
+            metric: str, config: RunnableConfig, days: int = 180
+        ) -> dict:
+            """Look up a common metric over my runs in the last `days` days.
+
+            Available metrics:
+
+            {metrics}
+
+            Args:
+                metric: The name of one of the metrics above.
+                days: How many days back to look, 180 by default.
+
+            Returns:
+                The column names and the rows of the metric
+
+            """
+            return _run_query(
+                config, lambda user_id: _executor.metric(user_id, metric, days)
+            )
+
+        running_metric.description = running_metric.description.format(
+            metrics=metrics.strip()
+        )
+        return running_metric
+
+    async def run(
+        self,
+        user_message: str,
+        callbacks: Optional[List[BaseCallbackHandler]] = None,
+        user_id: Optional[str] = None,
+    ) -> str:
+        await self._acquire()
+        try:
+            messages = await self.graph.ainvoke(
+                {"messages": [HumanMessage(content=user_message)]},
+                config=self._config(callbacks, user_id),
+            )
+        finally:
+            self._release()
+
         formatted_messages = []
 
         for m in messages["messages"]:
@@ -544,13 +255,84 @@ Overall, this intensified plan is designed to push your limits while respecting
 
         return formatted_messages[-1]
 
-
+    async def stream(
+        self,
+        user_message: str,
+        callbacks: Optional[List[BaseCallbackHandler]] = None,
+        user_id: Optional[str] = None,
+    ) -> AsyncIterator[Tuple[str, str]]:
+        """Stream the reply as ("token", text) pairs while the model generates.
+
+        A ("reset", "") pair is sent when a tool call finishes, since the
+        text of the turn that requested the tool is not part of the answer.
+        """
+        await self._acquire()
+        try:
+            async for chunk, metadata in self.graph.astream(
+                {"messages": [HumanMessage(content=user_message)]},
+                config=self._config(callbacks, user_id),
+                stream_mode="messages",
+            ):
+                if metadata.get("langgraph_node") == "tools":
+                    yield "reset", ""
+                elif isinstance(chunk, AIMessageChunk):
+                    text = _chunk_text(chunk)
+                    if text:
+                        yield "token", text
+        finally:
+            self._release()
+
+
+def _run_query(config: RunnableConfig, query: Callable[[str], dict]) -> dict:
+    """Run a sandboxed query for the request's user, returning rejections as
+    an error the model can correct rather than failing the request"""
+    user_id = config.get("configurable", {}).get("user_id")
+    if not user_id:
+        return {"error": "No running history is linked, so there is nothing to query."}
+    try:
+        return query(user_id)
+    except QueryRejectedError as e:
+        return {"error": str(e)}
+
+
+def token_usage(usage: UsageMetadataCallbackHandler) -> dict:
+    """Total tokens across every model call of a request. input_tokens
+    includes the cached tokens, which are billed at a lower rate."""
+    tokens = dict.fromkeys(TOKEN_FIELDS, 0)
+    for metadata in usage.usage_metadata.values():
+        details = metadata.get("input_token_details") or {}
+        tokens["input_tokens"] += metadata.get("input_tokens", 0)
+        tokens["output_tokens"] += metadata.get("output_tokens", 0)
+        tokens["cache_read_input_tokens"] += details.get("cache_read") or 0
+        tokens["cache_creation_input_tokens"] += details.get("cache_creation") or 0
+    return tokens
+
+
+def _chunk_text(chunk: AIMessageChunk) -> str:
+    """Extract the text from a streamed chunk, skipping tool-call blocks"""
+    if isinstance(chunk.content, str):
+        return chunk.content
+
+    return "".join(
+        block.get("text", "")
+        for block in chunk.content
+        if isinstance(block, dict) and block.get("type") == "text"
+    )
+
+
+_executor = ReadOnlyQueryExecutor()
 _service = TrainingPlanService()
+plan_cache = PlanCache()
 
 
-def create_plan(message: str, preferences: dict, goals: dict) -> str:
-    _service._clear_memory()
+def _prepare_plan(
+    message: str, preferences: dict, goals: dict, user_id: Optional[str]
+) -> Tuple[str, Optional[StoredPlan], str, TrainingPlan]:
+    """Build the plan and the commentary prompt for a plan request, and look
+    it up in the plan cache.
 
+    Returns the cache key, the cached plan (if any), the prompt and the plan.
+    """
     if preferences:
         formatted_preferences = (
             f"Preferred Long Run Day: {preferences.get('preferredLongRunDay', 'N/A')}, "
@@ -570,9 +352,254 @@ def create_plan(message: str, preferences: dict, goals: dict) -> str:
     else:
         formatted_goals = "No specific preferences provided."
 
-    formatted_message = f"{message} with the following preferences: {formatted_preferences} and with the following goals {formatted_goals}"
+    # Precomputed so the model doesn't need a tool round trip for it
+    summary = None
+    if user_id:
+        with connection(user_id) as user_db:
+            summary = get_fitness_summary(user_db, user_id)
+
+    with connection() as db:
+        cache_key = plan_cache.make_key(user_id, message, preferences, goals, summary)
+        plan_id = plan_cache.get(db, cache_key)
+        # The key covers the user and the whole request, so a cached anonymous
+        # plan is only served for an identical anonymous request
+        cached = _load_plan(db, plan_id, user_id) if plan_id is not None else None
+
+    formatted_history = format_fitness_summary(summary)
+
+    # The plan is laid out by rules; the model only writes the commentary
+    plan = build_skeleton(goals, preferences, summary)
+
+    formatted_message = f"Today is {date.today().strftime('%A, %B %d, %Y')}. {message} with the following preferences: {formatted_preferences} and with the following goals {formatted_goals}\n\n{formatted_history}\n\n{describe_plan(plan)}"
+
+    return cache_key, cached, formatted_message, plan
+
+
+def get_plan(db, plan_id: int, user_id: Optional[str]) -> Optional[StoredPlan]:
+    """Load a stored plan, if it belongs to the user. Plans made without
+    signing in belong to no one, so they can't be loaded or revised by id."""
+    if user_id is None:
+        return None
+    return _load_plan(db, plan_id, user_id)
+
+
+def _load_plan(db, plan_id: int, user_id: Optional[str]) -> Optional[StoredPlan]:
+    row = TrainingPlanRepository(db).get(plan_id)
+    if not row or row["user_id"] != user_id:
+        return None
+    return _stored_plan(row, TrainingPlan.model_validate_json(row["plan"]))
+
+
+def _save_plan(
+    cache_key: Optional[str],
+    user_id: Optional[str],
+    request: dict,
+    commentary: str,
+    plan: TrainingPlan,
+) -> StoredPlan:
+    """Store a generated plan and cache it. Defaults such as rest days are left
+    out of the stored JSON to keep it small."""
+    with connection() as db:
+        plans = TrainingPlanRepository(db)
+        plan_id = plans.create(
+            user_id,
+            request,
+            commentary,
+            plan.model_dump_json(exclude_defaults=True),
+            int(time.time()),
+        )
+        db.commit()
+        if cache_key is not None:
+            plan_cache.put(db, cache_key, user_id, plan_id)
+        return _stored_plan(plans.get(plan_id), plan)
+
+
+def _stored_plan(row, plan: TrainingPlan) -> StoredPlan:
+    return StoredPlan(
+        id=row["id"],
+        commentary=row["commentary"],
+        plan=plan,
+        response=f"{row['commentary']}\n\n{render_plan_html(plan)}",
+        created_at=row["created_at"],
+        updated_at=row["updated_at"],
+    )
+
+
+async def create_plan(
+    message: str, preferences: dict, goals: dict, user_id: Optional[str] = None
+) -> Tuple[StoredPlan, Optional[dict]]:
+    """Generate a plan, returning it with the request's token usage, which is
+    None when the plan came from the cache"""
+    # SQLite calls are blocking, so keep them off the event loop
+    cache_key, cached, formatted_message, plan = await asyncio.to_thread(
+        _prepare_plan, message, preferences, goals, user_id
+    )
+    if cached is not None:
+        return cached, None
+
+    usage = UsageMetadataCallbackHandler()
+    commentary = await _service.run(
+        formatted_message, callbacks=[usage], user_id=user_id
+    )
+    tokens = _service.record_usage(usage)
+
+    request = {"message": message, "preferences": preferences, "goals": goals}
+    stored = await asyncio.to_thread(
+        _save_plan, cache_key, user_id, request, commentary, plan
+    )
+    return stored, tokens
+
+
+def _load_plan_request(
+    plan_id: int, user_id: Optional[str]
+) -> Optional[Tuple[StoredPlan, dict]]:
+    with connection() as db:
+        stored = get_plan(db, plan_id, user_id)
+        if stored is None:
+            return None
+        row = TrainingPlanRepository(db).get(plan_id)
+        return stored, json.loads(row["request"])
+
+
+async def revise_plan(
+    plan_id: int, revision: PlanRevision, user_id: Optional[str] = None
+) -> Optional[Tuple[StoredPlan, List[int], Optional[dict]]]:
+    """Apply a change to a stored plan, re-laying only the weeks it affects.
+
+    The model is only asked to comment on the changed weeks, so the cost
+    scales with the size of the change. The revision is stored as a new plan
+    and returned with the changed week numbers and the token usage; None if
+    the plan doesn't exist.
+    """
+    loaded = await asyncio.to_thread(_load_plan_request, plan_id, user_id)
+    if loaded is None:
+        return None
+    stored, request = loaded
+
+    goals = {**(request.get("goals") or {}), **(revision.goals or {})}
+    preferences = (
+        revision.preferences
+        if revision.preferences is not None
+        else request.get("preferences")
+    )
+    # Weeks that have already started are left alone; the week in progress
+    # can only change on its first day
+    days = (date.today() - stored.plan.start_date).days
+    first_open_week = days // 7 + 1 + (1 if days % 7 else 0)
+    from_week = max(revision.from_week or first_open_week, first_open_week, 1)
+    # Weeks before from_week are copied as they are, so they can't be skipped
+    skip_weeks = sorted(
+        set(stored.plan.skipped_weeks)
+        | {week for week in revision.skip_weeks if week >= from_week}
+    )
+
+    plan, revised = revise_skeleton(
+        stored.plan, goals, preferences, skip_weeks, from_week
+    )
+    if not revised:
+        return stored, [], None
+
+    message = (
+        f"Today is {date.today().strftime('%A, %B %d, %Y')}. "
+        f"I changed my training plan: {_describe_revision(revision)}. "
+        f"These weeks were updated:\n{describe_weeks(plan, revised)}\n\n"
+        "In two or three sentences, tell me what changed and how to approach "
+        "it. Don't list the weeks again."
+    )
+    usage = UsageMetadataCallbackHandler()
+    note = await _service.run(message, callbacks=[usage], user_id=user_id)
+    tokens = _service.record_usage(usage)
+
+    request = {
+        "message": request.get("message"),
+        "preferences": preferences,
+        "goals": goals,
+        "revision_of": plan_id,
+    }
+    commentary = f"{stored.commentary}\n\nUpdate: {note}"
+    revised_plan = await asyncio.to_thread(
+        _save_plan, None, user_id, request, commentary, plan
+    )
+    return revised_plan, revised, tokens
+
+
+def _describe_revision(revision: PlanRevision) -> str:
+    changes = []
+    if revision.goals:
+        changes.append(
+            "new goal "
+            + ", ".join(f"{key} {value}" for key, value in revision.goals.items())
+        )
+    if revision.preferences is not None:
+        preferences = revision.preferences
+        changes.append(
+            f"available days {', '.join(preferences.get('availableDays', []))}, "
+            f"long run on {preferences.get('preferredLongRunDay', 'N/A')}, "
+            f"strength training {'yes' if preferences.get('strengthTraining') else 'no'}"
+        )
+    if revision.skip_weeks:
+        changes.append(
+            f"taking week {', '.join(map(str, sorted(revision.skip_weeks)))} off"
+        )
+    return "; ".join(changes) or "no change"
+
+
+async def stream_plan(
+    message: str, preferences: dict, goals: dict, user_id: Optional[str] = None
+) -> AsyncIterator[str]:
+    """Generate a plan as Server-Sent Events.
+
+    Emits "token" events with text as it is generated, "reset" when earlier
+    text should be discarded, then "done" with the full response, or "error".
+    """
+    try:
+        cache_key, cached, formatted_message, plan = await asyncio.to_thread(
+            _prepare_plan, message, preferences, goals, user_id
+        )
+        if cached is not None:
+            yield _sse("done", plan_payload(cached))
+            return
+
+        text = ""
+        usage = UsageMetadataCallbackHandler()
+        async for event, token in _service.stream(formatted_message, [usage], user_id):
+            if event == "reset":
+                text = ""
+                yield _sse("reset", {})
+            else:
+                text += token
+                yield _sse("token", {"text": token})
+
+        yield _sse("token", {"text": f"\n\n{render_plan_html(plan)}"})
+
+        request = {"message": message, "preferences": preferences, "goals": goals}
+        stored = await asyncio.to_thread(
+            _save_plan, cache_key, user_id, request, text, plan
+        )
+        yield _sse("done", plan_payload(stored, _service.record_usage(usage)))
+    except Exception as e:
+        traceback.print_exc()
+        yield _sse("error", {"detail": str(e)})
+
+
+def generation_stats() -> dict:
+    """Plans being generated and waiting for a slot"""
+    return _service.stats()
+
+
+def plan_payload(stored: StoredPlan, tokens: Optional[dict] = None) -> dict:
+    """The /createplan response body: the rendered plan plus its structure
+    and the token usage of generating it"""
+    return {
+        "response": stored.response,
+        "plan_id": stored.id,
+        "plan": stored.plan.model_dump(mode="json"),
+        "usage": tokens,
+    }
+
 
-    return _service.run(formatted_message)
+def _sse(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
 
 
 # Graph to view nodes
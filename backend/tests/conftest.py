@@ -0,0 +1,9 @@
+import os
+import sys
+
+# Modules import each other relative to backend/ and backend/api, as when the
+# app is run from api/main.py
+backend = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [backend, os.path.join(backend, "api")]
+
+os.environ.setdefault("ANTHROPIC_KEY", "test")
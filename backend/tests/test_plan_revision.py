@@ -0,0 +1,94 @@
+import asyncio
+from datetime import date, timedelta
+
+import pytest
+from models.training_plan import PlanRevision, StoredPlan
+from services import training_plan_service
+from services.plan_skeleton import build_skeleton, revise_skeleton
+
+GOALS = {"type": "Half Marathon", "goalTime": "1:55:00"}
+PREFERENCES = {
+    "availableDays": ["Tuesday", "Thursday", "Saturday", "Sunday"],
+    "preferredLongRunDay": "Sunday",
+}
+# A Monday; the plan's week 3 starts two weeks later
+START = date(2026, 3, 2)
+
+
+@pytest.fixture
+def plan(monkeypatch):
+    plan = build_skeleton(GOALS, PREFERENCES, today=START)
+    assert plan.start_date == START
+    stored = StoredPlan(
+        id=1, commentary="", plan=plan, response="", created_at=0, updated_at=0
+    )
+    request = {"message": "Plan", "preferences": PREFERENCES, "goals": GOALS}
+
+    async def run(message, **kwargs):
+        return "Moved the long run."
+
+    monkeypatch.setattr(
+        training_plan_service, "_load_plan_request", lambda *args: (stored, request)
+    )
+    monkeypatch.setattr(training_plan_service._service, "run", run)
+    monkeypatch.setattr(
+        training_plan_service._service, "record_usage", lambda usage: None
+    )
+    monkeypatch.setattr(
+        training_plan_service,
+        "_save_plan",
+        lambda cache_key, user_id, request, commentary, plan: stored.model_copy(
+            update={"plan": plan}
+        ),
+    )
+    return plan
+
+
+def set_today(monkeypatch, today: date) -> None:
+    class Today(date):
+        @classmethod
+        def today(cls):
+            return today
+
+    monkeypatch.setattr(training_plan_service, "date", Today)
+
+
+def revise(revision: PlanRevision):
+    return asyncio.run(training_plan_service.revise_plan(1, revision, "user"))
+
+
+def test_revision_keeps_weeks_already_started(plan, monkeypatch):
+    # Wednesday of week 3
+    set_today(monkeypatch, START + timedelta(days=16))
+    preferences = {**PREFERENCES, "preferredLongRunDay": "Saturday"}
+    # The change would rewrite the first weeks if they were allowed to change
+    _, unclamped = revise_skeleton(plan, GOALS, preferences, [], 1)
+    assert unclamped[:3] == [1, 2, 3]
+
+    revised_plan, revised, _ = revise(
+        PlanRevision(preferences=preferences, from_week=1)
+    )
+
+    assert revised and min(revised) == 4
+    assert revised_plan.plan.weeks[:3] == plan.weeks[:3]
+    assert revised_plan.plan.weeks[3] != plan.weeks[3]
+
+
+def test_revision_on_first_day_of_week_changes_it(plan, monkeypatch):
+    # Monday of week 3, before any of its sessions
+    set_today(monkeypatch, START + timedelta(days=14))
+    preferences = {**PREFERENCES, "preferredLongRunDay": "Saturday"}
+
+    _, revised, _ = revise(PlanRevision(preferences=preferences, from_week=1))
+
+    assert revised and min(revised) == 3
+
+
+def test_revision_ignores_skips_of_weeks_already_started(plan, monkeypatch):
+    set_today(monkeypatch, START + timedelta(days=16))
+
+    revised_plan, revised, _ = revise(PlanRevision(skip_weeks=[2, 6], from_week=1))
+
+    assert revised_plan.plan.skipped_weeks == [6]
+    assert revised_plan.plan.weeks[:3] == plan.weeks[:3]
+    assert 6 in revised
@@ -41,6 +41,7 @@ const AppContent: React.FC = () => {
   const [isStravaConnected, setIsStravaConnected] = useState<boolean>(false);
   const [viewMode, setViewMode] = useState<'create' | 'list' | 'history' | 'plan'>('create');
   const [isLoading, setIsLoading] = useState<boolean>(false);
+  const [syncError, setSyncError] = useState<string | null>(null);
 
   // Save goals to localStorage whenever they change
   useEffect(() => {
@@ -113,6 +114,10 @@ const AppContent: React.FC = () => {
         setWorkouts(data);
         setIsStravaConnected(true);
         localStorage.setItem('stravaConnected', 'true');
+
+        // Stored workouts are returned immediately; reload once any
+        // background Strava sync has finished
+        reloadWhenSynced();
       } else if (response.status === 401 || response.status === 403 || response.status === 404) {
         setIsStravaConnected(false);
         localStorage.removeItem('stravaConnected');
@@ -132,6 +137,41 @@ const AppContent: React.FC = () => {
     }
   };
 
+  // Poll the background Strava sync and reload workouts when it finishes
+  const reloadWhenSynced = async () => {
+    try {
+      let polled = false;
+      while (true) {
+        const response = await fetch('http://localhost:8080/sync/status', {
+          credentials: 'include'
+        });
+        if (!response.ok) {
+          return;
+        }
+
+        const status = await response.json();
+        if (status.job && status.job.status === 'failed') {
+          // Reloading would only queue the same failing sync again
+          setSyncError(status.job.error || 'Unknown error');
+          return;
+        }
+        if (!status.job || !['queued', 'running'].includes(status.job.status)) {
+          setSyncError(null);
+          break;
+        }
+
+        polled = true;
+        await new Promise((resolve) => setTimeout(resolve, 2000));
+      }
+
+      if (polled) {
+        fetchWorkoutData();
+      }
+    } catch (error) {
+      console.error('Error checking sync status:', error);
+    }
+  };
+
   const handleAddGoal = (goal: RunningGoal) => {
     setGoals([...goals, goal]);
     setViewMode('list');
@@ -164,6 +204,7 @@ const AppContent: React.FC = () => {
         setIsStravaConnected(false);
         localStorage.removeItem('stravaConnected');
         setWorkouts([]);
+        setSyncError(null);
         alert('Strava disconnected successfully');
       } else {
         console.error('Error disconnecting Strava:', await response.text());
@@ -236,6 +277,11 @@ const AppContent: React.FC = () => {
                 trainingPlans={trainingPlans}
               />
             )}
+            {viewMode === 'history' && syncError && (
+              <p className="text-red-600 text-center mb-4">
+                Syncing with Strava failed: {syncError}
+              </p>
+            )}
             {viewMode === 'history' && (
               <WorkoutHistory
                 workouts={workouts}
@@ -41,8 +41,9 @@ const TrainingPlanViewer: React.FC<TrainingPlanProps> = ({ onSaveTrainingPlan, g
     const existingGoals = goals.find(goal => goal.id === goalId);
 
     try {
-      const res = await fetch('http://localhost:8080/createplan', {
+      const res = await fetch('http://localhost:8080/createplan/stream', {
         method: 'POST',
+        credentials: 'include',
         headers: {
           'Content-Type': 'application/json',
           'Cache-Control': 'no-cache',
@@ -50,13 +51,49 @@ const TrainingPlanViewer: React.FC<TrainingPlanProps> = ({ onSaveTrainingPlan, g
         body: JSON.stringify({ message, preferences: existingPreferences, goals: existingGoals }),
       });
 
-      if (!res.ok) {
+      if (!res.ok || !res.body) {
         throw new Error(`Error: ${res.statusText}`);
       }
 
-      const data = await res.json();
+      // Render the plan as it streams in over Server-Sent Events
+      const reader = res.body.getReader();
+      const decoder = new TextDecoder();
+      let buffer = '';
+      let text = '';
+
+      while (true) {
+        const { done, value } = await reader.read();
+        if (done) {
+          break;
+        }
+
+        buffer += decoder.decode(value, { stream: true });
+        const events = buffer.split('\n\n');
+        buffer = events.pop() ?? '';
+
+        for (const rawEvent of events) {
+          const eventLine = rawEvent.split('\n').find(line => line.startsWith('event: '));
+          const dataLine = rawEvent.split('\n').find(line => line.startsWith('data: '));
+          if (!eventLine || !dataLine) {
+            continue;
+          }
+
+          const event = eventLine.slice('event: '.length);
+          const data = JSON.parse(dataLine.slice('data: '.length));
+
+          if (event === 'token') {
+            text += data.text;
+          } else if (event === 'reset') {
+            text = '';
+          } else if (event === 'done') {
+            text = data.response;
+          } else if (event === 'error') {
+            throw new Error(data.detail);
+          }
+          setResponse(text);
+        }
+      }
 
-      setResponse(data.response);
       setIsSaved(false); 
     } catch (error) {
       setResponse('Failed to fetch plan. Please try again.');